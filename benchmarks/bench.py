@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+# Benchmarks of the detection hot paths on synthetic DHIS2 payloads
+# e.g python benchmarks/bench.py --org-units 1000 10000 --m 4 --n 2 --diseases 4 --output results.json
+# Results can be compared with an earlier run using --compare earlier.json
+
+import os
+import io
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import datetime
+import tracemalloc
+import subprocess
+import contextlib
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+
+from idsrappserver.idsrappserver import IdsrAppServer
+from idsrappserver.orgunits import OrgUnitIndex
+from idsrappserver.statestore import StateStore
+from idsrappserver.streaming import parseTable
+import fixtures
+
+# Configure a server as startEpidemics does, without reading .idsr.json
+def createServer(diseasesMeta,today):
+	server = IdsrAppServer()
+	server.today = today
+	notificationProgram = diseasesMeta['config']['notificationProgram']
+	server.programUid = notificationProgram['id']
+	server.outbreakProgram = diseasesMeta['config']['reportingProgram']['id']
+	server.dateOfOnsetUid = notificationProgram['dateOfOnSet']['id']
+	server.conditionOrDiseaseUid = notificationProgram['disease']['id']
+	server.patientStatusOutcome = notificationProgram['patientStatusOutcome']['id']
+	server.regPatientStatusOutcome = notificationProgram['regPatientStatusOutcome']['id']
+	server.caseClassification = notificationProgram['caseClassification']['id']
+	server.testResult = notificationProgram['testResult']['id']
+	server.testResultClassification = notificationProgram['testResultClassification']['id']
+	return server
+
+# Time a function over several runs, then measure its peak memory in a separate run
+def measure(function,repeat):
+	times = []
+	for run in range(repeat):
+		started = time.perf_counter()
+		function()
+		times.append(time.perf_counter() - started)
+	tracemalloc.start()
+	function()
+	peakMemory = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	return {'times': times,'min': min(times),'median': float(np.median(times)),'peakMemory': peakMemory}
+
+# Build the inputs of every benchmark for one size
+# @return list of (name,function)
+def createBenchmarks(orgUnitCount,m,n,diseaseCount,today,seed):
+	diseasesMeta = fixtures.createDiseasesConfig(diseaseCount,m,n)
+	programConfig = diseasesMeta['config']
+	server = createServer(diseasesMeta,today)
+	# Detections are merged with an empty state store or one holding the epidemics of a previous run
+	emptyStore = StateStore(os.path.abspath('idsr-{}-empty.sqlite'.format(orgUnitCount)))
+	storedStore = StateStore(os.path.abspath('idsr-{}-stored.sqlite'.format(orgUnitCount)))
+	server.stateStore = emptyStore
+	orgUnits = fixtures.createOrgUnits(orgUnitCount)
+	orgUnitIndex = OrgUnitIndex(orgUnits)
+	alertColumns = server.alertColumns
+	messageColumns = server.messageColumns
+
+	aggregateInputs = []
+	for position,diseaseMeta in enumerate(diseasesMeta['diseases']):
+		periods = server.createAggThresholdPeriod(m,n,diseaseMeta['epiAlgorithm'])
+		indicators = [indicator['id'] for indicator in diseaseMeta['programIndicators']]
+		aggregateInputs.append((diseaseMeta,periods,fixtures.createAnalyticsTable(orgUnits,indicators,periods,seed=seed+position)))
+
+	def detectOnAggregateIndicators():
+		return [server.detectOnAggregateIndicators(table,diseaseMeta,orgUnitIndex,periods,m,n) for diseaseMeta,periods,table in aggregateInputs]
+
+	# Case based detection reads program indicator values at detection level 6
+	caseOrgUnits = fixtures.createOrgUnits(orgUnitCount,6)
+	caseOrgUnitIndex = OrgUnitIndex(caseOrgUnits)
+	caseInputs = []
+	for position,diseaseMeta in enumerate(diseasesMeta['diseases']):
+		caseMeta = dict(diseaseMeta,epiAlgorithm='CASE_BASED',detectionLevel=6,reportingLevel=5)
+		caseEvents = fixtures.createProgramIndicatorTable(caseOrgUnits,['CONFIRMED','DEATHS','SUSPECTED'],seed=seed+position)
+		dateData = fixtures.createTrackedEntityTable(caseOrgUnits,diseaseMeta['disease'],today,seed=seed+position)
+		caseInputs.append((caseMeta,caseEvents,dateData))
+
+	def detectBasedOnProgramIndicators():
+		return [server.detectBasedOnProgramIndicators(caseEvents,caseMeta,caseOrgUnitIndex,'ANALYTICS',dateData) for caseMeta,caseEvents,dateData in caseInputs]
+
+	detected = detectOnAggregateIndicators()
+
+	def getEpidemics(stateStore=emptyStore):
+		server.stateStore = stateStore
+		merged = []
+		for diseaseMeta,detectedEpidemics in zip(diseasesMeta['diseases'],detected):
+			merged.append(server.getEpidemics(programConfig=programConfig,detectedAggEpidemics=detectedEpidemics.copy(),detectedMergedAlertsMessage=pd.DataFrame(),kind='epidemics',messageColumns=messageColumns,alertColumns=alertColumns,notify=diseaseMeta['notifiableUserGroups']))
+		server.stateStore = emptyStore
+		return merged
+
+	# Epidemics of a previous run as read back from the datastore
+	previous = [result[0] for result in getEpidemics() if result is not None]
+	if len(previous) > 0:
+		storedStore.sync('epidemics',json.loads(pd.concat(previous,sort=False).to_json(orient='records',date_format='iso')),int(today[:4]))
+
+	dataElements = programConfig['reportingProgram']['programStage']['dataElements']
+	epidemics = pd.concat(previous,sort=False) if len(previous) > 0 else pd.DataFrame()
+
+	def createEventDatavalues():
+		if epidemics.empty:
+			return []
+		return epidemics.apply(server.createEventDatavalues,args=(dataElements,epidemics.columns),axis=1)
+
+	eventQuery = fixtures.createEventQueryTable(orgUnits,diseasesMeta['diseases'][0]['disease'],today,uids={'dateOfOnSet': server.dateOfOnsetUid,'disease': server.conditionOrDiseaseUid,'patientStatusOutcome': server.patientStatusOutcome,'regPatientStatusOutcome': server.regPatientStatusOutcome,'caseClassification': server.caseClassification,'testResult': server.testResult,'testResultClassification': server.testResultClassification},seed=seed)
+	eventQueryBody = json.dumps(eventQuery).encode('utf-8')
+
+	def parseEventQuery():
+		table = parseTable(eventQueryBody[start:(start+65536)] for start in range(0,len(eventQueryBody),65536))
+		return server.createDataFrame(table,'EVENT')
+
+	return [
+		('detectOnAggregateIndicators',detectOnAggregateIndicators),
+		('detectBasedOnProgramIndicators',detectBasedOnProgramIndicators),
+		('getEpidemics',getEpidemics),
+		('getEpidemics.stored',lambda: getEpidemics(storedStore)),
+		('createEventDatavalues',createEventDatavalues),
+		('parseEventQuery',parseEventQuery)
+	]
+
+def getCommit():
+	try:
+		return subprocess.check_output(['git','rev-parse','--short','HEAD'],cwd=os.path.dirname(os.path.abspath(__file__)),stderr=subprocess.DEVNULL).decode('utf-8').strip()
+	except (OSError,subprocess.CalledProcessError):
+		return None
+
+# Print the median time ratio of each benchmark against an earlier results file
+def compare(results,earlierPath):
+	with open(earlierPath) as earlierFile:
+		earlier = json.load(earlierFile)
+	medians = {(result['name'],result['orgUnits']): result['median'] for result in earlier['results']}
+	print("{:<34}{:>10}{:>12}{:>12}{:>8}".format('benchmark','orgUnits','before','after','ratio'))
+	for result in results:
+		before = medians.get((result['name'],result['orgUnits']))
+		if before is None:
+			continue
+		print("{:<34}{:>10}{:>12.4f}{:>12.4f}{:>8.2f}".format(result['name'],result['orgUnits'],before,result['median'],result['median']/before if before > 0 else float('nan')))
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmark the detection hot paths on synthetic DHIS2 payloads')
+	parser.add_argument('--org-units',type=int,nargs='+',default=[1000])
+	parser.add_argument('--m',type=int,default=4)
+	parser.add_argument('--n',type=int,default=2)
+	parser.add_argument('--diseases',type=int,default=2)
+	parser.add_argument('--repeat',type=int,default=3)
+	parser.add_argument('--seed',type=int,default=1)
+	parser.add_argument('--only',nargs='*',help='names of the benchmarks to run')
+	parser.add_argument('--output',help='write results as JSON to this file')
+	parser.add_argument('--compare',help='earlier results file to compare with')
+	parser.add_argument('--verbose',action='store_true',help='show the output of the engine')
+	args = parser.parse_args()
+
+	today = datetime.date.today().strftime('%Y-%m-%d')
+	results = []
+	# The engine writes csv files in the working directory
+	workingDirectory = tempfile.mkdtemp(prefix='idsr-bench-')
+	currentDirectory = os.getcwd()
+	os.chdir(workingDirectory)
+	try:
+		for orgUnitCount in args.org_units:
+			output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+			with output:
+				benchmarks = createBenchmarks(orgUnitCount,args.m,args.n,args.diseases,today,args.seed)
+			for name,function in benchmarks:
+				if args.only and name not in args.only:
+					continue
+				with (contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())):
+					measured = measure(function,args.repeat)
+				result = dict({'name': name,'orgUnits': orgUnitCount,'m': args.m,'n': args.n,'diseases': args.diseases},**measured)
+				results.append(result)
+				print("{:<34}{:>8} org units  median {:.4f}s  min {:.4f}s  peak {:.1f} MB".format(name,orgUnitCount,result['median'],result['min'],result['peakMemory']/1e6))
+	finally:
+		os.chdir(currentDirectory)
+
+	report = {
+		'meta': {
+			'timestamp': datetime.datetime.now().isoformat(),
+			'commit': getCommit(),
+			'python': platform.python_version(),
+			'pandas': pd.__version__,
+			'numpy': np.__version__,
+			'platform': platform.platform(),
+			'repeat': args.repeat,
+			'seed': args.seed
+		},
+		'results': results
+	}
+	if args.output:
+		with open(args.output,'w') as outputFile:
+			json.dump(report,outputFile,indent=2)
+		print("Results written to " + args.output)
+	if args.compare:
+		compare(results,args.compare)
+
+if __name__ == "__main__":
+	main()
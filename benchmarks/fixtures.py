@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+# Synthetic DHIS2 payloads for the benchmarks
+# Analytics tables are laid out like tableLayout=true&showHierarchy=true responses:
+# one name column per hierarchy level, the org unit id, name, code and description,
+# then the values ordered by indicator then period (columns=dx;pe)
+
+import os
+import json
+import argparse
+import datetime
+import numpy as np
+
+HIERARCHY_FANOUT = 8
+
+# Create org units at a detection level with their ancestors
+# @return list of {id,code,name,ancestors[id,code,name]} as returned by organisationUnits
+def createOrgUnits(count,level=3):
+	orgUnits = []
+	for position in range(count):
+		ancestors = []
+		parent = position
+		for ancestorLevel in range(level-1,0,-1):
+			parent = parent // HIERARCHY_FANOUT
+			ancestors.insert(0,{'id': 'L{}{:09d}'.format(ancestorLevel,parent),'code': 'L{}_{}'.format(ancestorLevel,parent),'name': 'Level {} unit {}'.format(ancestorLevel,parent)})
+		# The root is a single org unit
+		if len(ancestors) > 0:
+			ancestors[0] = {'id': 'L1000000000','code': 'L1_0','name': 'National'}
+		orgUnits.append({'id': 'OU{:09d}'.format(position),'code': 'OU_{}'.format(position),'name': 'Facility {}'.format(position),'ancestors': ancestors})
+	return orgUnits
+
+def createHierarchyHeaders(level):
+	headers = [{'name': 'level{}'.format(position),'column': 'Level {}'.format(position),'type': 'java.lang.String'} for position in range(1,level+1)]
+	for name in ['organisationunitid','organisationunitname','organisationunitcode','organisationunitdescription']:
+		headers.append({'name': name,'column': name,'type': 'java.lang.String'})
+	return headers
+
+def createHierarchyRow(orgUnit):
+	return [ancestor['name'] for ancestor in orgUnit['ancestors']] + [orgUnit['name'],orgUnit['id'],orgUnit['name'],orgUnit['code'],'']
+
+# Create an aggregate analytics table
+# @param spikeRate share of org units with an outbreak in the current period
+def createAnalyticsTable(orgUnits,indicators,periods,level=3,spikeRate=0.1,seed=1):
+	rng = np.random.default_rng(seed)
+	headers = createHierarchyHeaders(level)
+	for indicator in indicators:
+		for period in periods:
+			headers.append({'name': indicator + period,'column': indicator + ' ' + period,'type': 'java.lang.Double'})
+	values = rng.poisson(3,size=(len(orgUnits),len(indicators),len(periods)))
+	spikes = rng.random(len(orgUnits)) < spikeRate
+	values[spikes,:,0] = values[spikes,:,0] + 40
+	rows = []
+	for position,orgUnit in enumerate(orgUnits):
+		rows.append(createHierarchyRow(orgUnit) + [str(value) for value in values[position].ravel().tolist()])
+	return {'headers': headers,'metaData': {},'rows': rows,'height': len(rows),'width': len(headers)}
+
+# Create a program indicators analytics table with confirmed, deaths and suspected values
+# The case based detection reads these values from columns 10 to 12, i.e detection level 6
+def createProgramIndicatorTable(orgUnits,indicators,level=6,spikeRate=0.1,seed=1):
+	rng = np.random.default_rng(seed)
+	headers = createHierarchyHeaders(level)
+	for indicator in indicators:
+		headers.append({'name': indicator,'column': indicator,'type': 'java.lang.Double'})
+	values = rng.poisson(1,size=(len(orgUnits),len(indicators)))
+	spikes = rng.random(len(orgUnits)) < spikeRate
+	values[spikes,:] = values[spikes,:] + 10
+	rows = [createHierarchyRow(orgUnit) + [str(value) for value in values[position].tolist()] for position,orgUnit in enumerate(orgUnits)]
+	return {'headers': headers,'metaData': {},'rows': rows,'height': len(rows),'width': len(headers)}
+
+# Create a trackedEntityInstances/query table of cases with disease and onset attributes
+def createTrackedEntityTable(orgUnits,disease,today,casesPerOrgUnit=2,diseaseUid='DISEASE0001',onsetUid='ONSETDATE01',seed=1):
+	rng = np.random.default_rng(seed)
+	headers = [{'name': name,'column': name,'type': 'java.lang.String'} for name in ['instance','created','lastupdated','ou','ouname','te','inactive',diseaseUid,onsetUid]]
+	start = datetime.datetime.strptime(today,'%Y-%m-%d')
+	rows = []
+	for position,orgUnit in enumerate(orgUnits):
+		for case in range(casesPerOrgUnit):
+			created = (start - datetime.timedelta(days=int(rng.integers(0,8)))).strftime('%Y-%m-%d')
+			rows.append(['TEI{:08d}'.format(len(rows)),created + 'T08:00:00.000',created + 'T08:00:00.000',orgUnit['id'],orgUnit['name'],'PERSON00001','false',disease,created])
+	return {'headers': headers,'metaData': {},'rows': rows,'height': len(rows),'width': len(headers)}
+
+# Create an analytics/events/query table of case events
+def createEventQueryTable(orgUnits,disease,today,eventsPerOrgUnit=5,uids=None,seed=1):
+	rng = np.random.default_rng(seed)
+	uids = uids or {}
+	columns = ['psi','ps','eventdate','ou','ouname','oucode'] + [uids.get(name,name) for name in ['dateOfOnSet','disease','patientStatusOutcome','regPatientStatusOutcome','caseClassification','testResult','testResultClassification']]
+	headers = [{'name': column,'column': column,'type': 'java.lang.String'} for column in columns]
+	start = datetime.datetime.strptime(today,'%Y-%m-%d')
+	classifications = ['Confirmed','Suspected','Probable']
+	outcomes = ['Alive','Dead']
+	results = ['Positive','Negative','Pending']
+	rows = []
+	for orgUnit in orgUnits:
+		for event in range(eventsPerOrgUnit):
+			date = (start - datetime.timedelta(days=int(rng.integers(0,8)))).strftime('%Y-%m-%d')
+			rows.append(['EVENT{:06d}'.format(len(rows)),'STAGE000001',date + ' 00:00:00.0',orgUnit['id'],orgUnit['name'],orgUnit['code'],date,disease,outcomes[int(rng.integers(0,2))],outcomes[int(rng.integers(0,2))],classifications[int(rng.integers(0,3))],results[int(rng.integers(0,3))],classifications[int(rng.integers(0,3))]])
+	return {'headers': headers,'metaData': {},'rows': rows,'height': len(rows),'width': len(headers)}
+
+# Create the diseases config of the datastore
+# Diseases alternate between NON_SEASONAL and SEASONAL
+def createDiseasesConfig(diseases,m,n,level=3):
+	config = {
+		'mPeriods': m,
+		'nPeriods': n,
+		'notificationProgram': {'id': 'NOTIFPROG01'},
+		'reportingProgram': {'id': 'REPORTPROG1','programStage': {'id': 'REPORTSTAGE','dataElements': [{'name': name,'id': 'DE{:09d}'.format(position)} for position,name in enumerate(['suspected','deaths','confirmed','firstCaseDate','origin','outbreakId','disease','endDate','status'])]}}
+	}
+	for position,attribute in enumerate(['dateOfOnSet','disease','patientStatusOutcome','regPatientStatusOutcome','caseClassification','testResult','testResultClassification']):
+		config['notificationProgram'][attribute] = {'id': 'ATTRIB{:05d}'.format(position)}
+	diseasesMeta = []
+	for position in range(diseases):
+		diseasesMeta.append({
+			'disease': 'Disease {}'.format(position),
+			'code': 'D{}'.format(position),
+			'epiAlgorithm': 'NON_SEASONAL' if position % 2 == 0 else 'SEASONAL',
+			'detectionLevel': level,
+			'reportingLevel': max(1,level-1),
+			'incubationDays': 14,
+			'alertThreshold': 1,
+			'epiThreshold': 2,
+			'programIndicators': [{'id': 'PICASES{:04d}'.format(position)},{'id': 'PIDEATH{:04d}'.format(position)}],
+			'notifiableUserGroups': [{'id': 'USERGROUP01'}]
+		})
+	return {'config': config,'diseases': diseasesMeta}
+
+def main():
+	parser = argparse.ArgumentParser(description='Write synthetic DHIS2 fixtures as JSON files')
+	parser.add_argument('directory')
+	parser.add_argument('--org-units',type=int,default=1000)
+	parser.add_argument('--m',type=int,default=4)
+	parser.add_argument('--n',type=int,default=2)
+	parser.add_argument('--diseases',type=int,default=2)
+	args = parser.parse_args()
+	os.makedirs(args.directory,exist_ok=True)
+	today = datetime.date.today().strftime('%Y-%m-%d')
+	orgUnits = createOrgUnits(args.org_units)
+	diseasesMeta = createDiseasesConfig(args.diseases,args.m,args.n)
+	periods = ['P{}'.format(position) for position in range(args.m*(args.n+1))]
+	fixtures = {
+		'organisationUnits.json': {'organisationUnits': orgUnits},
+		'diseases.json': diseasesMeta,
+		'analytics.json': createAnalyticsTable(orgUnits,['PICASES0000','PIDEATH0000'],periods),
+		'programIndicators.json': createProgramIndicatorTable(createOrgUnits(args.org_units,6),['CONFIRMED','DEATHS','SUSPECTED']),
+		'trackedEntityInstances.json': createTrackedEntityTable(orgUnits,'Disease 0',today),
+		'events.json': createEventQueryTable(orgUnits,'Disease 0',today)
+	}
+	for name,fixture in fixtures.items():
+		with open(os.path.join(args.directory,name),'w') as fixtureFile:
+			json.dump(fixture,fixtureFile)
+		print("Wrote " + os.path.join(args.directory,name))
+
+if __name__ == "__main__":
+	main()
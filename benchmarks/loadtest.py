@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+# End-to-end load test of startEpidemics against the local stub DHIS2 server
+# e.g python benchmarks/loadtest.py --org-units 1000 10000 50000 --diseases 4 --case-based 1 --output load.json
+# Each size runs the engine in its own process, reporting its run time, peak RSS,
+# the requests it made by endpoint and the wall time of its stages
+# Engine settings are read from --settings and merged over the generated .idsr.json
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import platform
+import datetime
+import subprocess
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+
+from stubserver import StubDhis2, StubServer
+
+# Run the engine once with a settings file and write its run time and peak RSS
+def runEngine(configFile,resultFile):
+	import resource
+	from idsrappserver.idsrappserver import IdsrAppServer
+	server = IdsrAppServer(configFile=configFile)
+	started = time.perf_counter()
+	server.startEpidemics()
+	seconds = time.perf_counter() - started
+	maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+	peakRss = maxRss if sys.platform == 'darwin' else maxRss*1024
+	with open(resultFile,'w') as outputFile:
+		json.dump({'seconds': seconds,'peakRss': peakRss},outputFile)
+
+def getStageSeconds(directory):
+	try:
+		with open(os.path.join(directory,'idsr-run.json')) as reportFile:
+			report = json.load(reportFile)
+	except (OSError,ValueError):
+		return {}
+	return {stage['stage']: stage['seconds'] for stage in report['stages'] if stage['disease'] is None}
+
+# Run the engine against a stub of one size
+def runSize(orgUnitCount,args,settings):
+	stub = StubDhis2(orgUnits=orgUnitCount,diseases=args.diseases,caseBased=args.case_based,m=args.m,n=args.n,latency=args.latency,errorRate=args.error_rate,seed=args.seed)
+	server = StubServer(stub).start()
+	directory = tempfile.mkdtemp(prefix='idsr-load-')
+	try:
+		config = {
+			'url': server.getUrl(),
+			'username': 'admin',
+			'password': 'district',
+			'localStore': os.path.join(directory,'idsr.sqlite'),
+			'metricsDirectory': directory,
+			'notificationRateLimit': 0,
+			'notificationDrainTimeout': 60
+		}
+		config.update(settings)
+		configFile = os.path.join(directory,'idsr.json')
+		with open(configFile,'w') as outputFile:
+			json.dump(config,outputFile)
+		resultFile = os.path.join(directory,'result.json')
+		started = time.perf_counter()
+		# The engine writes csv files in its working directory
+		with open(os.path.join(directory,'engine.log'),'w') as logFile:
+			process = subprocess.run([sys.executable,os.path.abspath(__file__),'--engine',configFile,resultFile],cwd=directory,stdout=None if args.verbose else logFile,stderr=subprocess.STDOUT if not args.verbose else None)
+		wallSeconds = time.perf_counter() - started
+		result = {'orgUnits': orgUnitCount,'exitCode': process.returncode,'wallSeconds': wallSeconds}
+		if os.path.exists(resultFile):
+			with open(resultFile) as resultInput:
+				result.update(json.load(resultInput))
+		result.update(stub.getStats())
+		result['stages'] = getStageSeconds(directory)
+		return result
+	finally:
+		server.stop()
+		if args.keep:
+			print("Kept the run directory " + directory)
+		else:
+			shutil.rmtree(directory,ignore_errors=True)
+
+def main():
+	if len(sys.argv) == 4 and sys.argv[1] == '--engine':
+		runEngine(sys.argv[2],sys.argv[3])
+		return
+	parser = argparse.ArgumentParser(description='Load test startEpidemics against a local stub DHIS2 server')
+	parser.add_argument('--org-units',type=int,nargs='+',default=[1000,10000,50000])
+	parser.add_argument('--diseases',type=int,default=2)
+	parser.add_argument('--case-based',type=int,default=1)
+	parser.add_argument('--m',type=int,default=4)
+	parser.add_argument('--n',type=int,default=2)
+	parser.add_argument('--latency',type=float,default=0,help='seconds added to each stub response')
+	parser.add_argument('--error-rate',type=float,default=0,help='share of stub requests answered with a 503')
+	parser.add_argument('--seed',type=int,default=1)
+	parser.add_argument('--settings',help='JSON file of engine settings merged over the generated .idsr.json')
+	parser.add_argument('--output',help='write results as JSON to this file')
+	parser.add_argument('--keep',action='store_true',help='keep the run directories with the engine log and metrics')
+	parser.add_argument('--verbose',action='store_true',help='show the output of the engine')
+	args = parser.parse_args()
+
+	settings = {}
+	if args.settings:
+		with open(args.settings) as settingsFile:
+			settings = json.load(settingsFile)
+	results = []
+	for orgUnitCount in args.org_units:
+		result = runSize(orgUnitCount,args,settings)
+		results.append(result)
+		print("{:>8} org units  run {:.2f}s  requests {:>6}  errors {:>4}  events {:>6}  peak RSS {:.1f} MB{}".format(orgUnitCount,result.get('seconds',float('nan')),result['totalRequests'],result['injectedErrors'],result['eventsPosted'],result.get('peakRss',0)/1e6,'' if result['exitCode'] == 0 else '  exit code {}'.format(result['exitCode'])))
+		for endPoint,count in result['requests'].items():
+			print("{:>18}  {}".format(count,endPoint))
+	report = {
+		'meta': {
+			'timestamp': datetime.datetime.now().isoformat(),
+			'python': platform.python_version(),
+			'platform': platform.platform(),
+			'diseases': args.diseases,
+			'caseBased': args.case_based,
+			'latency': args.latency,
+			'errorRate': args.error_rate,
+			'settings': settings
+		},
+		'results': results
+	}
+	if args.output:
+		with open(args.output,'w') as outputFile:
+			json.dump(report,outputFile,indent=2)
+		print("Results written to " + args.output)
+
+if __name__ == "__main__":
+	main()
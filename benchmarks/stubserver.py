@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+
+# Local stand-in for the DHIS2 API serving generated data to the engine
+# e.g python benchmarks/stubserver.py --org-units 10000 --diseases 4 --case-based 1 --port 8080
+# then point the url of .idsr.json at http://127.0.0.1:8080/api/
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+
+import fixtures
+
+DATASTORE = 'ugxzr_idsr_app'
+
+# Generated DHIS2 data and the state written by the engine
+class StubDhis2:
+	# @param caseBased number of CASE_BASED diseases, detected at level 6
+	# @param latency seconds added to each response
+	# @param errorRate share of requests answered with a 503
+	def __init__(self,orgUnits=1000,diseases=2,caseBased=0,m=4,n=2,level=3,casesPerOrgUnit=2,latency=0,errorRate=0,seed=1,today=None):
+		self.orgUnitCount = orgUnits
+		self.level = level
+		self.casesPerOrgUnit = casesPerOrgUnit
+		self.latency = float(latency)
+		self.errorRate = float(errorRate)
+		self.seed = seed
+		self.today = today or datetime.date.today().strftime('%Y-%m-%d')
+		self.random = random.Random(seed)
+		self.lock = threading.Lock()
+		self.diseasesMeta = fixtures.createDiseasesConfig(diseases,m,n,level)
+		for position in range(caseBased):
+			self.diseasesMeta['diseases'].append({
+				'disease': 'Case disease {}'.format(position),
+				'code': 'C{}'.format(position),
+				'epiAlgorithm': 'CASE_BASED',
+				'detectionLevel': 6,
+				'reportingLevel': 5,
+				'incubationDays': 14,
+				'alertThreshold': 1,
+				'epiThreshold': 2,
+				# Confirmed, deaths and suspected, read in this order by the case based detection
+				'programIndicators': [{'id': 'PICONF{:05d}'.format(position)},{'id': 'PIDEAT{:05d}'.format(position)},{'id': 'PISUSP{:05d}'.format(position)}],
+				'notifiableUserGroups': [{'id': 'USERGROUP01'}]
+			})
+		self.dataStore = {DATASTORE + '/diseases': self.diseasesMeta,DATASTORE + '/epidemics': []}
+		self.orgUnits = {}
+		self.tables = {}
+		self.requests = {}
+		self.events = 0
+		self.messages = 0
+		self.errors = 0
+
+	def getOrgUnits(self,level):
+		with self.lock:
+			if level not in self.orgUnits:
+				if level == 1:
+					self.orgUnits[level] = [{'id': 'L1000000000','code': 'L1_0','name': 'National','ancestors': []}]
+				elif level == 2:
+					count = max(1,(self.orgUnitCount - 1) // (fixtures.HIERARCHY_FANOUT ** (self.level - 2)) + 1)
+					self.orgUnits[level] = [{'id': 'L2{:09d}'.format(position),'code': 'L2_{}'.format(position),'name': 'Level 2 unit {}'.format(position),'ancestors': [{'id': 'L1000000000','code': 'L1_0','name': 'National'}]} for position in range(count)]
+				else:
+					self.orgUnits[level] = fixtures.createOrgUnits(self.orgUnitCount,level)
+			return self.orgUnits[level]
+
+	# Tables are generated once per query and sliced into pages
+	def getTable(self,key,create):
+		with self.lock:
+			table = self.tables.get(key)
+		if table is None:
+			table = create()
+			with self.lock:
+				self.tables[key] = table
+		return table
+
+	def getDiseaseByCode(self,code):
+		for diseaseMeta in self.diseasesMeta['diseases']:
+			if diseaseMeta['code'] == code:
+				return diseaseMeta
+		return self.diseasesMeta['diseases'][0]
+
+	def getDimensions(self,params):
+		dimensions = {}
+		for dimension in params.get('dimension',[]):
+			name,_,items = dimension.partition(':')
+			dimensions[name] = items
+		return dimensions
+
+	def getLevel(self,items):
+		return int(items.split('LEVEL-')[1].split(';')[0]) if 'LEVEL-' in items else self.level
+
+	def getPage(self,table,params):
+		if params.get('paging',['true'])[0] == 'false' or 'page' not in params:
+			return table
+		page = int(params['page'][0])
+		pageSize = int(params.get('pageSize',['50'])[0])
+		rows = table['rows'][(page-1)*pageSize:page*pageSize]
+		metaData = dict(table.get('metaData',{}),pager={'page': page,'pageSize': pageSize,'total': len(table['rows']),'pageCount': max(1,-(-len(table['rows']) // pageSize))})
+		return dict(table,rows=rows,height=len(rows),metaData=metaData)
+
+	def getAnalytics(self,params):
+		dimensions = self.getDimensions(params)
+		indicators = dimensions.get('dx','').split(';')
+		level = self.getLevel(dimensions.get('ou',''))
+		if 'pe' in dimensions:
+			periods = dimensions['pe'].split(';')
+			return self.getTable(('analytics',level,dimensions['dx'],dimensions['pe']),lambda: fixtures.createAnalyticsTable(self.getOrgUnits(level),indicators,periods,level,seed=self.seed))
+		return self.getTable(('programIndicators',level,dimensions['dx']),lambda: fixtures.createProgramIndicatorTable(self.getOrgUnits(level),indicators,level,seed=self.seed))
+
+	def getNotificationUids(self):
+		program = self.diseasesMeta['config']['notificationProgram']
+		return {name: program[name]['id'] for name in ['dateOfOnSet','disease','patientStatusOutcome','regPatientStatusOutcome','caseClassification','testResult','testResultClassification']}
+
+	def getEventQuery(self,params):
+		dimensions = self.getDimensions(params)
+		uids = self.getNotificationUids()
+		code = dimensions.get(uids['disease'],'IN:').split('IN:')[-1]
+		level = self.getLevel(dimensions.get('ou',''))
+		table = self.getTable(('events',level,code),lambda: fixtures.createEventQueryTable(self.getOrgUnits(level),self.getDiseaseByCode(code)['disease'],self.today,uids=uids,seed=self.seed))
+		return self.getPage(table,params)
+
+	def getTrackedEntities(self,params):
+		uids = self.getNotificationUids()
+		code = ''
+		for attribute in params.get('attribute',[]):
+			if attribute.startswith(uids['disease'] + ':IN:'):
+				code = attribute.split(':IN:')[-1]
+		diseaseMeta = self.getDiseaseByCode(code)
+		level = int(diseaseMeta['detectionLevel'])
+		table = self.getTable(('trackedEntityInstances',level,code),lambda: fixtures.createTrackedEntityTable(self.getOrgUnits(level),diseaseMeta['disease'],self.today,casesPerOrgUnit=self.casesPerOrgUnit,diseaseUid=uids['disease'],onsetUid=uids['dateOfOnSet'],seed=self.seed))
+		return self.getPage(table,params)
+
+	def getOrganisationUnits(self,params):
+		level = self.level
+		for filter in params.get('filter',[]):
+			if filter.startswith('level:eq:'):
+				level = int(filter[len('level:eq:'):])
+		return {'organisationUnits': self.getOrgUnits(level)}
+
+	# Answer a request
+	# @return (status,body)
+	def handle(self,method,path,params,body):
+		endPoint = path.split('/api/',1)[-1].strip('/')
+		if endPoint.endswith('.json'):
+			endPoint = endPoint[:-len('.json')]
+		with self.lock:
+			key = method + ' ' + ('analytics/events/query' if endPoint.startswith('analytics/events/query') else endPoint)
+			self.requests[key] = self.requests.get(key,0) + 1
+			failed = self.errorRate > 0 and self.random.random() < self.errorRate
+			if failed:
+				self.errors = self.errors + 1
+		if self.latency > 0:
+			time.sleep(self.latency)
+		if failed:
+			return 503,{'httpStatus': 'Service Unavailable','httpStatusCode': 503,'status': 'ERROR','message': 'Injected error'}
+		if endPoint.startswith('dataStore/'):
+			return self.handleDataStore(method,endPoint[len('dataStore/'):],body)
+		if method == 'GET':
+			if endPoint == 'analytics':
+				return 200,self.getAnalytics(params)
+			if endPoint.startswith('analytics/events/query/'):
+				return 200,self.getEventQuery(params)
+			if endPoint == 'trackedEntityInstances/query':
+				return 200,self.getTrackedEntities(params)
+			if endPoint == 'organisationUnits':
+				return 200,self.getOrganisationUnits(params)
+			if endPoint == 'system/id':
+				limit = int(params.get('limit',['1'])[0])
+				return 200,{'codes': ['S{:010d}'.format(self.random.randrange(10 ** 10)) for position in range(limit)]}
+		if method == 'POST' and endPoint == 'events':
+			events = body.get('events',[]) if isinstance(body,dict) else []
+			with self.lock:
+				self.events = self.events + len(events)
+			return 200,{'httpStatus': 'OK','httpStatusCode': 200,'status': 'OK','response': {'responseType': 'ImportSummaries','status': 'SUCCESS','imported': len(events),'updated': 0,'deleted': 0,'ignored': 0,'importSummaries': [{'status': 'SUCCESS','reference': event.get('event'),'importCount': {'imported': 1,'updated': 0,'ignored': 0,'deleted': 0}} for event in events]}}
+		if method == 'POST' and endPoint == 'messageConversations':
+			conversations = body.get('messageConversations',[body]) if isinstance(body,dict) else []
+			with self.lock:
+				self.messages = self.messages + len(conversations)
+			return 201,{'httpStatus': 'Created','httpStatusCode': 201,'status': 'OK'}
+		return 404,{'httpStatus': 'Not Found','httpStatusCode': 404,'status': 'ERROR','message': 'No stub for ' + method + ' ' + endPoint}
+
+	# Keys are created with POST and updated with PUT as in DHIS2
+	def handleDataStore(self,method,key,body):
+		with self.lock:
+			exists = key in self.dataStore
+			if method == 'GET':
+				return (200,self.dataStore[key]) if exists else (404,{'httpStatusCode': 404,'status': 'ERROR','message': "The key '" + key + "' was not found"})
+			if method == 'POST':
+				if exists:
+					return 409,{'httpStatusCode': 409,'status': 'ERROR','message': "The key '" + key + "' already exists"}
+				self.dataStore[key] = body
+				return 201,{'httpStatusCode': 201,'status': 'OK'}
+			if method == 'PUT':
+				if not exists:
+					return 404,{'httpStatusCode': 404,'status': 'ERROR','message': "The key '" + key + "' was not found"}
+				self.dataStore[key] = body
+				return 200,{'httpStatusCode': 200,'status': 'OK'}
+		return 405,{'httpStatusCode': 405,'status': 'ERROR'}
+
+	def getStats(self):
+		with self.lock:
+			return {'requests': dict(sorted(self.requests.items())),'totalRequests': sum(self.requests.values()),'injectedErrors': self.errors,'eventsPosted': self.events,'messagesPosted': self.messages}
+
+# HTTP server of a StubDhis2, started in a background thread
+class StubServer:
+	def __init__(self,stub,host='127.0.0.1',port=0):
+		self.stub = stub
+		stubDhis2 = stub
+		class StubHandler(BaseHTTPRequestHandler):
+			protocol_version = 'HTTP/1.1'
+
+			def reply(self):
+				parts = urlsplit(self.path)
+				length = int(self.headers.get('Content-Length') or 0)
+				body = None
+				if length > 0:
+					try:
+						body = json.loads(self.rfile.read(length))
+					except ValueError:
+						body = None
+				status,response = stubDhis2.handle(self.command,parts.path,parse_qs(parts.query,keep_blank_values=True),body)
+				content = json.dumps(response).encode('utf-8')
+				self.send_response(status)
+				self.send_header('Content-Type','application/json')
+				self.send_header('Content-Length',str(len(content)))
+				self.end_headers()
+				self.wfile.write(content)
+
+			do_GET = reply
+			do_POST = reply
+			do_PUT = reply
+
+			def log_message(self,format,*args):
+				pass
+		self.server = ThreadingHTTPServer((host,port),StubHandler)
+		self.server.daemon_threads = True
+		self.thread = None
+
+	def getUrl(self):
+		host,port = self.server.server_address[:2]
+		return 'http://{}:{}/api/'.format(host,port)
+
+	def start(self):
+		self.thread = threading.Thread(target=self.server.serve_forever,name='stub-dhis2',daemon=True)
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+def main():
+	parser = argparse.ArgumentParser(description='Serve generated DHIS2 data to the engine')
+	parser.add_argument('--org-units',type=int,default=1000)
+	parser.add_argument('--diseases',type=int,default=2)
+	parser.add_argument('--case-based',type=int,default=0)
+	parser.add_argument('--m',type=int,default=4)
+	parser.add_argument('--n',type=int,default=2)
+	parser.add_argument('--latency',type=float,default=0,help='seconds added to each response')
+	parser.add_argument('--error-rate',type=float,default=0,help='share of requests answered with a 503')
+	parser.add_argument('--seed',type=int,default=1)
+	parser.add_argument('--host',default='127.0.0.1')
+	parser.add_argument('--port',type=int,default=8080)
+	args = parser.parse_args()
+	stub = StubDhis2(orgUnits=args.org_units,diseases=args.diseases,caseBased=args.case_based,m=args.m,n=args.n,latency=args.latency,errorRate=args.error_rate,seed=args.seed)
+	server = StubServer(stub,args.host,args.port)
+	print("Serving {} org units on {}".format(args.org_units,server.getUrl()))
+	try:
+		server.server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server.server_close()
+		print(json.dumps(stub.getStats(),indent=2))
+
+if __name__ == "__main__":
+	main()
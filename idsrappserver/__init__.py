@@ -1,6 +1,12 @@
 #!/usr/bin/env python
 
- from IdsrAppServer import IdsrAppServer
+# IdsrAppServer is imported on first use, so that the command line and the light modules
+# do not load pandas and numpy
+def __getattr__(name):
+	if name == 'IdsrAppServer':
+		from .idsrappserver import IdsrAppServer
+		return IdsrAppServer
+	raise AttributeError("module {!r} has no attribute {!r}".format(__name__,name))
 
 #idsr = idsrappserver.IdsrAppServer()
 #idsr.startEpidemics()
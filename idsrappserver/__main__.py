@@ -0,0 +1,7 @@
+#!/usr/bin/env python
+
+import sys
+
+from .cli import main
+
+sys.exit(main())
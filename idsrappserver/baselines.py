@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+import time
+import numpy as np
+
+from .localstore import LocalStore
+
+# Local store of aggregate indicator values keyed by (indicator, orgUnit, period)
+# Only non zero values are kept, baselinePeriods records which periods were fetched
+# for a detection level so that missing values of a fetched period are zeros
+class BaselineStore(LocalStore):
+	SCHEMA = [
+		"CREATE TABLE IF NOT EXISTS baselines (indicator TEXT NOT NULL, level INTEGER NOT NULL, period TEXT NOT NULL, orgUnit TEXT NOT NULL, value REAL NOT NULL, PRIMARY KEY (indicator,level,period,orgUnit))",
+		"CREATE TABLE IF NOT EXISTS baselinePeriods (indicator TEXT NOT NULL, level INTEGER NOT NULL, period TEXT NOT NULL, fetched REAL NOT NULL, PRIMARY KEY (indicator,level,period))"
+	]
+
+	# Get periods already stored for all indicators at a level
+	def getStoredPeriods(self,indicators,level,periods):
+		if len(indicators) == 0 or len(periods) == 0:
+			return set()
+		query = "SELECT period,COUNT(*) FROM baselinePeriods WHERE level = ? AND indicator IN ({}) AND period IN ({}) GROUP BY period".format(self.getMarks(indicators),self.getMarks(periods))
+		rows = self.execute(query,[level] + list(indicators) + list(periods))
+		return set([period for period,count in rows if count == len(indicators)])
+
+	# Get stored values as an (orgUnit x indicator x period) array, zeros when not stored
+	def getValues(self,indicators,level,periods,orgUnits):
+		cube = np.zeros((len(orgUnits),len(indicators),len(periods)))
+		if len(indicators) == 0 or len(periods) == 0 or len(orgUnits) == 0:
+			return cube
+		query = "SELECT indicator,period,orgUnit,value FROM baselines WHERE level = ? AND indicator IN ({}) AND period IN ({})".format(self.getMarks(indicators),self.getMarks(periods))
+		rows = self.execute(query,[level] + list(indicators) + list(periods))
+		indicatorPositions = {indicator: position for position,indicator in enumerate(indicators)}
+		periodPositions = {period: position for position,period in enumerate(periods)}
+		orgUnitPositions = {orgUnit: position for position,orgUnit in enumerate(orgUnits)}
+		for indicator,period,orgUnit,value in rows:
+			position = orgUnitPositions.get(orgUnit)
+			if position is not None:
+				cube[position,indicatorPositions[indicator],periodPositions[period]] = value
+		return cube
+
+	# Replace stored values of the fetched periods with an (orgUnit x indicator x period) array
+	def saveValues(self,indicators,level,periods,orgUnits,cube):
+		fetched = time.time()
+		keys = [(indicator,level,period) for indicator in indicators for period in periods]
+		ouPositions,indicatorPositions,periodPositions = np.nonzero(cube)
+		values = [(indicators[i],level,periods[p],orgUnits[o],float(cube[o,i,p])) for o,i,p in zip(ouPositions.tolist(),indicatorPositions.tolist(),periodPositions.tolist())]
+		with self.lock:
+			with self.connection:
+				self.connection.executemany("DELETE FROM baselines WHERE indicator = ? AND level = ? AND period = ?",keys)
+				self.connection.executemany("INSERT INTO baselines (indicator,level,period,orgUnit,value) VALUES (?,?,?,?,?)",values)
+				self.connection.executemany("INSERT OR REPLACE INTO baselinePeriods (indicator,level,period,fetched) VALUES (?,?,?,?)",[key + (fetched,) for key in keys])
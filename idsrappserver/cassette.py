@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+import io
+import json
+import gzip
+import time
+import base64
+import threading
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+# Cassette of DHIS2 requests and responses, a gzip file of one JSON interaction per line
+# Recorded runs are replayed offline: GET requests are matched on the method and the url with
+# sorted query params, requests of the same key are served in the recorded order and the last
+# one is served again once they are exhausted. Bodies are not matched so that posts of
+# generated UIDs still find their recorded import summaries.
+class Cassette:
+	# Headers that no longer describe the decoded body
+	DROPPED_HEADERS = ['content-encoding','content-length','transfer-encoding']
+
+	def __init__(self,path):
+		self.path = path
+		self.lock = threading.Lock()
+		self.interactions = {}
+		self.served = {}
+		self.file = None
+
+	def getKey(self,method,url):
+		parts = urlsplit(url)
+		query = urlencode(sorted(parse_qsl(parts.query,keep_blank_values=True)))
+		return method.upper() + ' ' + urlunsplit((parts.scheme,parts.netloc,parts.path,query,''))
+
+	# Read the recorded interactions, a recording cut short keeps its complete lines
+	def load(self):
+		self.interactions = {}
+		self.served = {}
+		with gzip.open(self.path,'rt',encoding='utf-8') as cassetteFile:
+			try:
+				for line in cassetteFile:
+					if line.strip() == '':
+						continue
+					interaction = json.loads(line)
+					self.interactions.setdefault(self.getKey(interaction['method'],interaction['url']),[]).append(interaction)
+			except (EOFError,ValueError):
+				print("Cassette {} ends with an incomplete interaction".format(self.path))
+		print("Loaded {} recorded requests from {}".format(sum(len(interactions) for interactions in self.interactions.values()),self.path))
+		return self
+
+	# Start a new recording, each interaction is flushed as soon as it is written
+	def open(self):
+		self.file = gzip.open(self.path,'wt',encoding='utf-8')
+		return self
+
+	def getBody(self,body):
+		if body is None:
+			return None
+		if isinstance(body,bytes):
+			try:
+				return body.decode('utf-8')
+			except UnicodeDecodeError:
+				return base64.b64encode(body).decode('ascii')
+		return body
+
+	def record(self,request,response,elapsed):
+		interaction = {
+			'method': request.method,
+			'url': request.url,
+			'body': self.getBody(request.body),
+			'status': response.status_code,
+			'reason': response.reason,
+			'headers': {name: value for name,value in response.headers.items() if name.lower() not in self.DROPPED_HEADERS},
+			'elapsed': elapsed
+		}
+		try:
+			interaction['content'] = response.content.decode('utf-8')
+		except UnicodeDecodeError:
+			interaction['contentBase64'] = base64.b64encode(response.content).decode('ascii')
+		line = json.dumps(interaction) + '\n'
+		with self.lock:
+			self.file.write(line)
+			self.file.flush()
+
+	# Get the next recorded interaction of a request, None when it was never recorded
+	def play(self,method,url):
+		key = self.getKey(method,url)
+		with self.lock:
+			interactions = self.interactions.get(key)
+			if not interactions:
+				return None
+			position = self.served.get(key,0)
+			self.served[key] = position + 1
+			return interactions[min(position,len(interactions)-1)]
+
+	def getUnplayed(self):
+		with self.lock:
+			return sum(max(0,len(interactions) - self.served.get(key,0)) for key,interactions in self.interactions.items())
+
+	def close(self):
+		with self.lock:
+			if self.file is not None:
+				self.file.close()
+				self.file = None
+
+# Transport adapter sending requests to DHIS2 and writing every response to a cassette
+class RecordingAdapter(HTTPAdapter):
+	def __init__(self,cassette,**kwargs):
+		self.cassette = cassette
+		super(RecordingAdapter,self).__init__(**kwargs)
+
+	def send(self,request,**kwargs):
+		started = time.perf_counter()
+		response = super(RecordingAdapter,self).send(request,**kwargs)
+		# Reading the content keeps it available to streamed reads of the response
+		response.content
+		self.cassette.record(request,response,time.perf_counter() - started)
+		return response
+
+	def close(self):
+		super(RecordingAdapter,self).close()
+		self.cassette.close()
+
+# Transport adapter serving responses from a cassette without any network access
+# @param latency seconds added to each response, or 'recorded' to wait as long as the recorded request took
+class ReplayAdapter(BaseAdapter):
+	def __init__(self,cassette,latency=0):
+		super(ReplayAdapter,self).__init__()
+		self.cassette = cassette
+		self.latency = latency
+
+	def getLatency(self,interaction):
+		if self.latency == 'recorded':
+			return float(interaction.get('elapsed',0))
+		return float(self.latency or 0)
+
+	def send(self,request,**kwargs):
+		interaction = self.cassette.play(request.method,request.url)
+		if interaction is None:
+			raise requests.exceptions.ConnectionError("No recorded response for {} {}".format(request.method,request.url),request=request)
+		latency = self.getLatency(interaction)
+		if latency > 0:
+			time.sleep(latency)
+		if 'contentBase64' in interaction:
+			content = base64.b64decode(interaction['contentBase64'])
+		else:
+			content = (interaction.get('content') or '').encode('utf-8')
+		response = requests.Response()
+		response.status_code = interaction['status']
+		response.reason = interaction.get('reason')
+		response.headers = CaseInsensitiveDict(interaction.get('headers',{}))
+		response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+		response.raw = io.BytesIO(content)
+		response._content = content
+		response._content_consumed = True
+		response.url = request.url
+		response.request = request
+		return response
+
+	def close(self):
+		pass
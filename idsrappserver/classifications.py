@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+import json
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# Normalization of the classification and outcome columns of case events
+# Option values are mapped to the standard text the detection counts on e.g
+# Confirmed -> confirmedValue, other columns such as org unit names and dates are left as they are
+# Columns are converted to categoricals so that each distinct option value is looked up once
+
+# Columns of the case events named by createColumns
+COLUMNS = ['caseClassification','immediateOutcome','statusOutcome','testResult','testResultClassification']
+
+# Option values and their standard text, extended or overridden by
+# "classificationValues" of the diseases datastore config e.g {"Died": "deathValue"}
+VALUES = {
+	'Confirmed case': 'confirmedValue',
+	'Suspected case': 'suspectedValue',
+	'Confirmed': 'confirmedValue',
+	'Suspected': 'suspectedValue',
+	'confirmed case': 'confirmedValue',
+	'suspected case': 'suspectedValue',
+	'died': 'deathValue',
+	'Died case': 'deathValue'
+}
+
+# Lookup table of the default values merged with those configured
+# The table is built once for each configuration
+@lru_cache(maxsize=16)
+def getTable(configured=None):
+	table = dict(VALUES)
+	if configured:
+		table.update(json.loads(configured))
+	return table
+
+def getLookup(values=None):
+	return getTable(json.dumps(values,sort_keys=True) if values else None)
+
+# Map the option values of a column through the lookup table, values not in the table are kept
+# @return categorical Series
+def normalizeColumn(column,table):
+	column = column.astype('category')
+	mapped = [table.get(value,value) for value in column.cat.categories]
+	categories = list(dict.fromkeys(mapped))
+	# Values mapped to the same text share a category
+	positions = np.array([categories.index(value) for value in mapped] + [-1],dtype=np.int64)
+	codes = positions[column.cat.codes.to_numpy()]
+	return pd.Series(pd.Categorical.from_codes(codes,categories=categories),index=column.index,name=column.name)
+
+# Normalize the classification and outcome columns of case events
+# @param values option values configured in the diseases datastore config
+def normalize(df,values=None):
+	table = getLookup(values)
+	for column in COLUMNS:
+		if column in df.columns:
+			df[column] = normalizeColumn(df[column],table)
+	return df
+
+# Count the values of a column for each group of keys, one column per value
+# Categoricals are counted with a grouped size, value_counts would run once per group
+def countValues(df,keys,column):
+	counts = df.groupby(keys + [column],observed=True).size().unstack(fill_value=0)
+	counts.columns = pd.Index(counts.columns.astype(object),name=column)
+	return counts.reset_index()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import datetime
+
+# Command line of the engine, installed as the idsr console script
+# e.g idsr run, idsr run Cholera, idsr validate, idsr diseases, idsr state, idsr daemon
+# pandas, numpy and requests are only imported by the commands that need them, so
+# validate and state start without loading the detection engine
+
+# Same directory as IdsrAppServer.fileDirectory, the parent of the project folder
+FILE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DATASTORE = 'ugxzr_idsr_app'
+
+# Settings read by IdsrAppServer.loadSettings and the daemon, by type
+NUMBERS = (int,float)
+SETTINGS = {
+	'url': str,
+	'username': str,
+	'password': str,
+	'workers': int,
+	'retries': int,
+	'timeouts': dict,
+	'localStore': str,
+	'cacheTtls': dict,
+	'refreshCache': bool,
+	'uidSource': ['local','remote'],
+	'baselineStore': bool,
+	'baselineRevisionWeeks': int,
+	'eventChunkSize': int,
+	'importWorkers': int,
+	'importRetries': int,
+	'eventLedger': bool,
+	'datastoreLayout': ['single','partitioned'],
+	'caseBasedDetection': ['analytics','events'],
+	'notificationBatchSize': int,
+	'notificationRateLimit': NUMBERS,
+	'notificationRetries': int,
+	'notificationDrainTimeout': NUMBERS,
+	'streamTables': bool,
+	'pageSize': int,
+	'pageWorkers': int,
+	'fanOutSubtrees': bool,
+	'metrics': bool,
+	'metricsDirectory': str,
+	'cassette': str,
+	'cassetteMode': ['record','replay'],
+	'replayLatency': NUMBERS + (str,),
+	'today': str,
+	'seed': int,
+	'schedule': dict,
+	'scheduleTick': NUMBERS,
+	'scheduleRetry': NUMBERS,
+	'healthHost': str,
+	'healthPort': int
+}
+REQUIRED = ['url','username','password']
+
+def getConfigFile(args):
+	return args.config or os.path.join(FILE_DIRECTORY,'.idsr.json')
+
+def readConfig(configFile):
+	with open(configFile,'r') as jsonfile:
+		return json.load(jsonfile)
+
+# Settings of a command, None when the file cannot be read
+def getConfig(args):
+	try:
+		return readConfig(getConfigFile(args))
+	except (OSError,ValueError) as e:
+		print("Cannot read {}: {}".format(getConfigFile(args),e))
+		return None
+
+# Check a settings file without contacting DHIS2
+# @return list of errors, empty when the file is valid
+def validateConfig(configFile):
+	try:
+		config = readConfig(configFile)
+	except OSError as e:
+		return ["Cannot read {}: {}".format(configFile,e.strerror)]
+	except ValueError as e:
+		return ["{} is not valid JSON: {}".format(configFile,e)]
+	if not isinstance(config,dict):
+		return ["{} must hold a JSON object".format(configFile)]
+	errors = []
+	for name in REQUIRED:
+		if not config.get(name):
+			errors.append('"{}" is required'.format(name))
+	for name,value in config.items():
+		expected = SETTINGS.get(name)
+		if expected is None:
+			errors.append('"{}" is not a known setting'.format(name))
+		elif isinstance(expected,list):
+			if value not in expected:
+				errors.append('"{}" must be one of {}'.format(name,', '.join(expected)))
+		# bool is an int, flags are not counts
+		elif (isinstance(value,bool) and expected is not bool) or not isinstance(value,expected):
+			errors.append('"{}" has the wrong type {}'.format(name,type(value).__name__))
+	url = config.get('url')
+	if isinstance(url,str) and url:
+		if not url.startswith(('http://','https://')):
+			errors.append('"url" must start with http:// or https://')
+		if not url.endswith('/'):
+			errors.append('"url" must end with / e.g https://play.dhis2.org/demo/api/')
+	if isinstance(config.get('replayLatency'),str) and config['replayLatency'] != 'recorded':
+		errors.append('"replayLatency" must be a number of seconds or "recorded"')
+	if isinstance(config.get('today'),str):
+		try:
+			datetime.datetime.strptime(config['today'],'%Y-%m-%d')
+		except ValueError:
+			errors.append('"today" must be a date like 2026-10-14')
+	if config.get('cassetteMode') == 'replay' and not config.get('cassette'):
+		errors.append('"cassetteMode":"replay" needs a "cassette" file')
+	return errors
+
+# Relative paths of the settings are in the directory of the settings file, as in IdsrAppServer.getSettingsPath
+def getSettingsPath(args,path):
+	return os.path.join(os.path.dirname(os.path.abspath(getConfigFile(args))),path)
+
+# Store file of the DHIS2 instance of the url, as in IdsrAppServer.getLocalStorePath
+def getLocalStore(args,config):
+	from .localstore import getStorePath
+	return getStorePath(getSettingsPath(args,config.get('localStore','.idsr.sqlite')),config.get('url',''))
+
+def formatAge(seconds):
+	if seconds < 120:
+		return "{:.0f}s".format(seconds)
+	if seconds < 2*3600:
+		return "{:.0f}m".format(seconds/60)
+	if seconds < 2*24*3600:
+		return "{:.1f}h".format(seconds/3600)
+	return "{:.1f}d".format(seconds/(24*3600))
+
+def runValidate(args):
+	configFile = getConfigFile(args)
+	errors = validateConfig(configFile)
+	for error in errors:
+		print(error)
+	if errors:
+		print("{} has {} error(s)".format(configFile,len(errors)))
+		return 1
+	print("{} is valid".format(configFile))
+	return 0
+
+# Get the diseases config through the metadata cache, from DHIS2 when missing or expired
+def getDiseasesMeta(args,config,refresh=False):
+	from .httpclient import Dhis2Client
+	from .metadatacache import MetadataCache
+	key = 'dataStore/' + DATASTORE + '/diseases'
+	cache = MetadataCache(getLocalStore(args,config),ttls=config.get('cacheTtls'),refresh=refresh or bool(config.get('refreshCache',False)))
+	client = None
+	try:
+		def load():
+			nonlocal client
+			client = Dhis2Client(config['url'],config['username'],config['password'],timeouts=config.get('timeouts'),retries=int(config.get('retries',3)))
+			return client.get(config['url'] + key + '.json',params={})
+		return cache.get(key,load,resource='diseases')
+	finally:
+		if client is not None:
+			client.close()
+		cache.close()
+
+def runDiseases(args):
+	from .httpclient import Dhis2Error
+	from .scheduler import DiseaseScheduler
+	config = getConfig(args)
+	if config is None:
+		return 1
+	try:
+		diseasesMeta = getDiseasesMeta(args,config,refresh=args.refresh)
+	except Dhis2Error as e:
+		print("Failed to get disease meta data: ",e)
+		return 1
+	cadences = dict(DiseaseScheduler.CADENCES)
+	cadences.update(config.get('schedule') or {})
+	print("{:<30} {:<10} {:<14} {:>9} {:>9} {:>8}".format('disease','code','algorithm','detection','reporting','cadence'))
+	for diseaseMeta in diseasesMeta['diseases']:
+		cadence = cadences.get(diseaseMeta['disease'],cadences.get(diseaseMeta.get('epiAlgorithm')))
+		print("{:<30} {:<10} {:<14} {:>9} {:>9} {:>8}".format(str(diseaseMeta['disease']),str(diseaseMeta.get('code','')),str(diseaseMeta.get('epiAlgorithm','')),str(diseaseMeta.get('detectionLevel','')),str(diseaseMeta.get('reportingLevel','')),'-' if cadence is None else formatAge(float(cadence))))
+	return 0
+
+# Show the local store and the report of the last run
+def runState(args):
+	from .metadatacache import MetadataCache
+	config = getConfig(args)
+	if config is None:
+		return 1
+	localStore = getLocalStore(args,config)
+	print("Local store " + localStore)
+	if not os.path.exists(localStore):
+		print("  not created yet")
+	else:
+		connection = sqlite3.connect('file:' + localStore + '?mode=ro',uri=True)
+		try:
+			tables = [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+			for table in tables:
+				print("  {:<24} {:>10} rows".format(table,connection.execute('SELECT COUNT(*) FROM "{}"'.format(table)).fetchone()[0]))
+			if 'metadata' in tables:
+				ttls = dict(MetadataCache.TTLS)
+				ttls.update(config.get('cacheTtls') or {})
+				print("Cached metadata")
+				now = time.time()
+				for key,fetched in connection.execute("SELECT key,fetched FROM metadata ORDER BY key"):
+					resource = next((resource for resource in ttls if key.startswith(resource) or key.endswith('/' + resource)),key)
+					print("  {:<60} {:>8} {}".format(key,formatAge(now - fetched),'fresh' if (now - fetched) < ttls.get(resource,0) else 'expired'))
+			if 'notifications' in tables:
+				print("Notification outbox")
+				for status,count in connection.execute("SELECT status,COUNT(*) FROM notifications GROUP BY status ORDER BY status"):
+					print("  {:<24} {:>10}".format(status,count))
+		finally:
+			connection.close()
+	reportFile = os.path.join(getSettingsPath(args,config.get('metricsDirectory') or ''),'idsr-run.json')
+	try:
+		with open(reportFile) as inputFile:
+			report = json.load(inputFile)
+	except (OSError,ValueError):
+		print("No run report in " + reportFile)
+		return 0
+	print("Last run started {} and took {:.1f}s".format(report['started'],report['seconds']))
+	for disease,totals in sorted(report.get('diseases',{}).items()):
+		print("  {:<30} {}".format(disease,' '.join('{}={}'.format(name,round(value,2) if isinstance(value,float) else value) for name,value in sorted(totals.items()))))
+	return 0
+
+def getServer(args):
+	from .idsrappserver import IdsrAppServer
+	return IdsrAppServer(configFile=getConfigFile(args))
+
+# Detect all diseases, or only those named
+def runDetection(args):
+	getServer(args).startEpidemics(args.diseases or None)
+	return 0
+
+def runDaemon(args):
+	getServer(args).startDaemon()
+	return 0
+
+def runMigrate(args):
+	getServer(args).migrateDatastore()
+	return 0
+
+def getParser():
+	parser = argparse.ArgumentParser(prog='idsr',description='eIDSR outbreak detection and alerts engine')
+	parser.add_argument('--config',help='settings file, .idsr.json next to the project folder by default')
+	commands = parser.add_subparsers(dest='command',metavar='command')
+	commands.required = True
+	run = commands.add_parser('run',help='detect outbreaks once, for all diseases or those named')
+	run.add_argument('diseases',nargs='*',metavar='disease',help='name or code of a disease')
+	run.set_defaults(handler=runDetection)
+	commands.add_parser('daemon',help='keep running and detect each disease on its own cadence').set_defaults(handler=runDaemon)
+	commands.add_parser('validate',help='check the settings file').set_defaults(handler=runValidate)
+	diseases = commands.add_parser('diseases',help='list the configured diseases')
+	diseases.add_argument('--refresh',action='store_true',help='reload the diseases config from DHIS2')
+	diseases.set_defaults(handler=runDiseases)
+	commands.add_parser('state',help='show the local store and the last run report').set_defaults(handler=runState)
+	commands.add_parser('migrate',help='split the epidemics and alerts keys into partitions').set_defaults(handler=runMigrate)
+	return parser
+
+def main(argv=None):
+	args = getParser().parse_args(argv)
+	return args.handler(args)
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+import string
+import numpy as np
+
+# DHIS2 UID: a letter followed by 10 alphanumeric characters
+ALPHABET = string.digits + string.ascii_lowercase + string.ascii_uppercase
+ID_LENGTH = 11
+
+# Generate n unique DHIS2 UIDs in one vectorized draw
+# @param existing UIDs already in use that must not be generated
+# @return numpy array of n UIDs
+def generateUids(n,existing=None,alphabet=ALPHABET,length=ID_LENGTH,rng=None):
+	rng = np.random.default_rng() if rng is None else rng
+	chars = np.array(list(alphabet))
+	letters = chars[np.char.isalpha(chars)]
+	taken = set() if existing is None else set(existing)
+	uids = []
+	# Redraw only the few UIDs that collide with each other or with existing ones
+	while len(uids) < n:
+		size = n - len(uids)
+		draw = np.concatenate([letters[rng.integers(0,len(letters),size=(size,1))],chars[rng.integers(0,len(chars),size=(size,length-1))]],axis=1)
+		for uid in draw.view('<U{}'.format(length)).ravel().tolist():
+			if uid not in taken:
+				taken.add(uid)
+				uids.append(uid)
+	return np.array(uids,dtype=object)
+
+# Outbreak codes use upper case letters and digits
+CODE_ALPHABET = string.ascii_uppercase + string.digits
+
+# Generate n unique outbreak codes formatted as prefix_value_suffix in one vectorized draw
+# e.g E_OU_CODE_K0QIA9CN3K6 with prefix='E', sep='_' and values from the orgUnitCode column
+# @param values optional n values placed between the prefix and the random suffix
+# @param existing codes already stored in the epidemics datastore
+# @return numpy array of n codes
+def generateCodes(n,values=None,prefix='',sep='',existing=None,size=ID_LENGTH,rng=None):
+	rng = np.random.default_rng() if rng is None else rng
+	chars = np.array(list(CODE_ALPHABET))
+	if values is None:
+		heads = np.full(n,'{}{}'.format(prefix,sep),dtype=object)
+	else:
+		heads = np.char.add('{}{}'.format(prefix,sep),np.char.add(np.asarray(values).astype(str),sep)).astype(object)
+	taken = set() if existing is None else set(existing)
+	generated = np.empty(n,dtype=object)
+	pending = np.arange(n)
+	# Redraw suffixes only for the codes colliding with each other or with existing ones
+	while len(pending) > 0:
+		suffixes = chars[rng.integers(0,len(chars),size=(len(pending),size))].view('<U{}'.format(size)).ravel().astype(object)
+		candidates = heads[pending] + suffixes
+		collisions = []
+		for position,code in zip(pending.tolist(),candidates.tolist()):
+			if code in taken:
+				collisions.append(position)
+			else:
+				taken.add(code)
+				generated[position] = code
+		pending = np.array(collisions,dtype=np.int64)
+	return generated
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+import re
+import json
+import hashlib
+
+from .httpclient import Dhis2HttpError
+
+# Epi-year of a record from its first case date or period, the default year when it has neither
+def getEpiYear(record,default):
+	for column in ['firstCaseDate','period']:
+		value = str(record.get(column) or '')
+		if re.match('^[0-9]{4}',value):
+			return int(value[:4])
+	return int(default)
+
+# Partitioned layout of the epidemics/alerts datastore
+# Records are kept under one key per disease and epi-year e.g epidemics-Measles-2020
+# and an index key e.g epidemics-index lists the partitions with their record and open counts
+# Runs read the partitions of the current and previous year and those with open records
+# and only write back the partitions that changed
+class PartitionedDatastore:
+	# @param get function getting a datastore key, raising Dhis2HttpError when missing
+	# @param save function updating a datastore key, creating it when it does not exist yet
+	# @param name datastore array being partitioned i.e epidemics or alerts
+	def __init__(self,get,save,name):
+		self.get = get
+		self.save = save
+		self.name = name
+		self.index = None
+		# key -> hash of the records loaded or saved in this run
+		self.hashes = {}
+		# (disease,year) of the partitions read by load
+		self.loaded = []
+
+	def getIndexKey(self):
+		return self.name + '-index'
+
+	def getPartitionKey(self,disease,year):
+		return '{}-{}-{}'.format(self.name,re.sub('[^A-Za-z0-9]+','_',str(disease)).strip('_'),year)
+
+	def getYear(self,record,default):
+		return getEpiYear(record,default)
+
+	def getOpenCount(self,records):
+		return len([record for record in records if record.get('closeDate') == ''])
+
+	def getHash(self,records):
+		return hashlib.sha1(json.dumps(self.sortRecords(records),sort_keys=True,default=str).encode('utf-8')).hexdigest()
+
+	def sortRecords(self,records):
+		return sorted(records,key=lambda record: (str(record.get('event')),str(record.get('period')),str(record.get('orgUnit'))))
+
+	# Group records by partition key
+	# @return dict key -> {'disease','year','records'}
+	def createPartitions(self,records,year):
+		partitions = {}
+		for record in records:
+			disease = record.get('disease')
+			if disease is None:
+				continue
+			recordYear = self.getYear(record,year)
+			key = self.getPartitionKey(disease,recordYear)
+			partitions.setdefault(key,{'disease': disease,'year': recordYear,'records': []})['records'].append(record)
+		return partitions
+
+	def loadIndex(self):
+		try:
+			self.index = self.get(self.getIndexKey())
+		except Dhis2HttpError as e:
+			if e.status != 404:
+				raise
+			self.index = {'partitions': []}
+		return self.index
+
+	# Get records of the given diseases in the given epi-years and of partitions with open records
+	def load(self,diseases,years):
+		index = self.loadIndex() if self.index is None else self.index
+		records = []
+		for partition in index['partitions']:
+			if partition['disease'] not in diseases:
+				continue
+			if partition['year'] not in years and partition.get('open',0) == 0:
+				continue
+			try:
+				partitionRecords = self.get(partition['key'])
+			except Dhis2HttpError as e:
+				if e.status != 404:
+					raise
+				partitionRecords = []
+			self.hashes[partition['key']] = self.getHash(partitionRecords)
+			self.loaded.append((partition['disease'],partition['year']))
+			records.extend(partitionRecords)
+		return records
+
+	# Write the changed partitions of the given diseases and the index
+	# Partitions without records in this run are left as they are
+	# @return keys of the written partitions
+	def saveRecords(self,records,diseases,year):
+		index = self.loadIndex() if self.index is None else self.index
+		entries = {partition['key']: partition for partition in index['partitions']}
+		written = []
+		for key,partition in self.createPartitions(records,year).items():
+			if partition['disease'] not in diseases:
+				continue
+			partitionRecords = self.sortRecords(partition['records'])
+			partitionHash = self.getHash(partitionRecords)
+			if self.hashes.get(key) == partitionHash:
+				continue
+			self.save(key,partitionRecords)
+			self.hashes[key] = partitionHash
+			entries[key] = {'key': key,'disease': partition['disease'],'year': partition['year'],'count': len(partitionRecords),'open': self.getOpenCount(partitionRecords)}
+			written.append(key)
+		if len(written) > 0:
+			self.index = {'partitions': sorted(entries.values(),key=lambda entry: entry['key'])}
+			self.save(self.getIndexKey(),self.index)
+		return written
+
+	# Split the records of the single key layout into partitions
+	# The single key itself is left in place
+	def migrate(self,records,year):
+		self.index = {'partitions': []}
+		self.hashes = {}
+		diseases = set([record.get('disease') for record in records])
+		return self.saveRecords(records,diseases,year)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .httpclient import Dhis2Error
+
+# Bulk import of DHIS2 events in chunks posted with bounded parallelism
+# Import summaries are parsed and only the failed chunks are posted again
+class EventImporter:
+	# @param post function posting {'events': chunk} and returning the response
+	def __init__(self,post,chunkSize=500,workers=2,retries=2):
+		self.post = post
+		self.chunkSize = max(1,int(chunkSize))
+		self.workers = max(1,int(workers))
+		self.retries = int(retries)
+
+	def createChunks(self,events):
+		return [events[start:(start+self.chunkSize)] for start in range(0,len(events),self.chunkSize)]
+
+	# Get counts from an ImportSummaries response
+	# Newer DHIS2 versions wrap the summaries in 'response'
+	def getImportSummary(self,body):
+		summaries = body.get('response',body) if isinstance(body,dict) else {}
+		conflicts = []
+		rejected = []
+		for importSummary in summaries.get('importSummaries',[]):
+			for conflict in importSummary.get('conflicts',[]):
+				conflicts.append({'reference': importSummary.get('reference'),'object': conflict.get('object'),'value': conflict.get('value')})
+			if importSummary.get('status') == 'ERROR' or (importSummary.get('importCount') or {}).get('ignored',0) > 0:
+				rejected.append(importSummary.get('reference'))
+		return {
+			'status': summaries.get('status',body.get('status') if isinstance(body,dict) else None),
+			'imported': summaries.get('imported',0),
+			'updated': summaries.get('updated',0),
+			'ignored': summaries.get('ignored',0),
+			'deleted': summaries.get('deleted',0),
+			'conflicts': conflicts,
+			'rejected': rejected
+		}
+
+	def getResponseBody(self,response):
+		try:
+			return response.json()
+		except ValueError:
+			return {}
+
+	# Post one chunk and summarise it
+	def importChunk(self,number,chunk):
+		started = time.time()
+		summary = {'chunk': number,'events': len(chunk),'status': None,'imported': 0,'updated': 0,'ignored': 0,'deleted': 0,'conflicts': [],'rejected': [],'error': None}
+		try:
+			summary.update(self.getImportSummary(self.getResponseBody(self.post({'events': chunk}))))
+		except Dhis2Error as e:
+			summary['error'] = str(e)
+			# A 409 still carries the import summaries
+			if e.response is not None:
+				summary.update(self.getImportSummary(self.getResponseBody(e.response)))
+		summary['latency'] = time.time() - started
+		summary['failed'] = (summary['error'] is not None and summary['status'] is None) or summary['status'] == 'ERROR'
+		return summary
+
+	def importChunks(self,chunks):
+		if self.workers == 1 or len(chunks) <= 1:
+			return [self.importChunk(number,chunk) for number,chunk in chunks]
+		with ThreadPoolExecutor(max_workers=min(self.workers,len(chunks))) as executor:
+			futures = [executor.submit(self.importChunk,number,chunk) for number,chunk in chunks]
+			return [future.result() for future in futures]
+
+	# Import all events and return the latest summary of every chunk
+	def importEvents(self,events):
+		chunks = list(enumerate(self.createChunks(events),1))
+		total = len(chunks)
+		summaries = {}
+		attempt = 0
+		while len(chunks) > 0:
+			for summary in self.importChunks(chunks):
+				summary['attempt'] = attempt + 1
+				summaries[summary['chunk']] = summary
+				print("Events chunk {}/{}: {} events, imported {}, updated {}, ignored {}, status {} in {:.2f}s".format(summary['chunk'],total,summary['events'],summary['imported'],summary['updated'],summary['ignored'],summary['status'] if summary['error'] is None else summary['error'],summary['latency']))
+			failed = [summary['chunk'] for summary in summaries.values() if summary['failed']]
+			if len(failed) == 0 or attempt >= self.retries:
+				break
+			attempt = attempt + 1
+			# Exponential backoff before posting the failed chunks again
+			time.sleep(2 ** (attempt - 1))
+			chunks = [(number,chunk) for number,chunk in enumerate(self.createChunks(events),1) if number in failed]
+		return [summaries[number] for number in sorted(summaries)]
+
+	# Get events of the chunks that were imported, leaving out those DHIS2 rejected
+	def getImportedEvents(self,events,summaries):
+		chunks = self.createChunks(events)
+		imported = []
+		for summary in summaries:
+			if summary['failed']:
+				continue
+			rejected = set(summary['rejected'])
+			imported.extend([event for event in chunks[summary['chunk']-1] if event.get('event') not in rejected])
+		return imported
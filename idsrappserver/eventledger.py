@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+import json
+import hashlib
+import time
+
+from .localstore import LocalStore
+
+# Ledger of the content hash of every outbreak event last posted to DHIS2
+# Events whose dataValues, status and orgUnit did not change since are not posted again
+class EventLedger(LocalStore):
+	SCHEMA = ["CREATE TABLE IF NOT EXISTS eventHashes (event TEXT PRIMARY KEY, hash TEXT NOT NULL, posted REAL NOT NULL)"]
+
+	# Whole numbers are hashed as int, values read back from the state store are float e.g 45.0
+	def getValue(self,value):
+		if isinstance(value,float) and value.is_integer():
+			return int(value)
+		return value
+
+	# Hash the posted content of an event, dataValues are sorted so their order does not matter
+	def getHash(self,event):
+		dataValues = [dict(dataValue,value=self.getValue(dataValue.get('value'))) for dataValue in event.get('dataValues') or []]
+		dataValues = sorted(dataValues,key=lambda dataValue: (str(dataValue.get('dataElement')),str(dataValue.get('value'))))
+		content = {'orgUnit': event.get('orgUnit'),'status': event.get('status'),'dataValues': dataValues}
+		return hashlib.sha1(json.dumps(content,sort_keys=True,default=str).encode('utf-8')).hexdigest()
+
+	def getHashes(self,uids):
+		return dict(self.executeIn("SELECT event,hash FROM eventHashes WHERE event IN ({})",uids))
+
+	# Get events that are new or changed since their last successful post
+	# @return changed events and the hash of each by event uid
+	def getChangedEvents(self,events):
+		hashes = {event.get('event'): self.getHash(event) for event in events}
+		posted = self.getHashes([uid for uid in hashes if uid is not None])
+		changed = [event for event in events if event.get('event') is None or posted.get(event.get('event')) != hashes[event.get('event')]]
+		return [changed,hashes]
+
+	# Record the hashes of events DHIS2 accepted
+	def saveHashes(self,hashes):
+		posted = time.time()
+		self.executemany("INSERT OR REPLACE INTO eventHashes (event,hash,posted) VALUES (?,?,?)",[(uid,value,posted) for uid,value in hashes.items() if uid is not None])
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .cassette import RecordingAdapter, ReplayAdapter
+
+# Raised by Dhis2Client instead of returning 'HTTP_ERROR'
+class Dhis2Error(Exception):
+	def __init__(self,message,url=None,status=None,response=None):
+		super(Dhis2Error,self).__init__(message)
+		self.url = url
+		self.status = status
+		self.response = response
+
+# DHIS2 answered with a non 2xx status
+class Dhis2HttpError(Dhis2Error):
+	pass
+
+# DHIS2 could not be reached or timed out after all retries
+class Dhis2ConnectionError(Dhis2Error):
+	pass
+
+# Shared HTTP client for all DHIS2 calls
+# Keeps connections alive, asks for gzip, applies per endpoint timeouts
+# and retries with exponential backoff on 429/5xx and connection resets
+class Dhis2Client:
+	# (connect,read) timeouts in seconds by endpoint prefix, the longest matching prefix wins
+	TIMEOUTS = {
+		'': (10,60),
+		'analytics': (10,300),
+		'trackedEntityInstances': (10,300),
+		'events': (10,600),
+		'dataStore': (10,120),
+		'messageConversations': (10,120),
+		'system/id': (10,30)
+	}
+	RETRY_STATUS = [429,500,502,503,504]
+	# POST is only retried when the connection could not be made
+	RETRY_METHODS = ['GET','PUT','DELETE','HEAD','OPTIONS']
+
+	# @param cassette Cassette recording every response, or serving them back when replay is set
+	def __init__(self,url,username,password,timeouts=None,retries=3,backoff=0.5,poolSize=10,cassette=None,replay=False,replayLatency=0):
+		self.url = url
+		self.timeouts = dict(self.TIMEOUTS)
+		if timeouts is not None:
+			for endPoint,timeout in timeouts.items():
+				self.timeouts[endPoint] = self.createTimeout(timeout)
+		retry = Retry(total=retries,connect=retries,read=retries,status=retries,backoff_factor=backoff,status_forcelist=self.RETRY_STATUS,allowed_methods=frozenset(self.RETRY_METHODS),raise_on_status=False,respect_retry_after_header=True)
+		if cassette is not None and replay:
+			adapter = ReplayAdapter(cassette.load(),latency=replayLatency)
+		elif cassette is not None:
+			adapter = RecordingAdapter(cassette.open(),pool_connections=poolSize,pool_maxsize=poolSize,max_retries=retry)
+		else:
+			adapter = HTTPAdapter(pool_connections=poolSize,pool_maxsize=poolSize,max_retries=retry)
+		self.session = requests.Session()
+		self.session.auth = (username,password)
+		self.session.headers.update({'Accept':'application/json','Accept-Encoding':'gzip, deflate'})
+		self.session.mount('http://',adapter)
+		self.session.mount('https://',adapter)
+		# RunMetrics of the current run, latency and payload sizes are recorded by endpoint
+		self.metrics = None
+
+	# Timeouts from .idsr.json are either the read timeout or [connect,read]
+	def createTimeout(self,timeout):
+		if isinstance(timeout,(list,tuple)):
+			return tuple(timeout)
+		return (self.TIMEOUTS[''][0],timeout)
+
+	# Get endpoint relative to the api url e.g analytics/events/query/xxx.json
+	def getEndPoint(self,url):
+		if url.startswith(self.url):
+			return url[len(self.url):]
+		return url
+
+	def getTimeout(self,url):
+		endPoint = self.getEndPoint(url)
+		prefixes = [prefix for prefix in self.timeouts if endPoint.startswith(prefix)]
+		return self.timeouts[max(prefixes,key=len)]
+
+	def request(self,method,url,params=None,data=None,stream=False):
+		started = time.perf_counter()
+		try:
+			response = self.session.request(method,url,params=params,json=data,timeout=self.getTimeout(url),stream=stream)
+		except requests.exceptions.RequestException as e:
+			self.observe(method,url,started)
+			raise Dhis2ConnectionError("{} {} failed: {}".format(method,self.getEndPoint(url),e),url=url)
+		# Streamed responses are recorded once their body is read
+		if not stream or response.status_code >= 300:
+			self.observe(method,url,started,response,len(response.content))
+		if response.status_code >= 300:
+			raise Dhis2HttpError("{} {} returned {}".format(method,self.getEndPoint(url),response.status_code),url=url,status=response.status_code,response=response)
+		return response
+
+	# Record the latency and payload sizes of a request
+	def observe(self,method,url,started,response=None,responseBytes=0):
+		if self.metrics is None:
+			return
+		requestBytes = 0
+		if response is not None and response.request is not None and response.request.body is not None:
+			requestBytes = len(response.request.body)
+		self.metrics.observeHttp(method,self.getEndPoint(url),time.perf_counter() - started,None if response is None else response.status_code,requestBytes,responseBytes)
+
+	def get(self,url,params=None):
+		return self.request('GET',url,params=params).json()
+
+	# Get the response body as byte chunks without reading it in memory
+	def stream(self,url,params=None,chunkSize=65536):
+		started = time.perf_counter()
+		response = self.request('GET',url,params=params,stream=True)
+		size = 0
+		try:
+			for chunk in response.iter_content(chunk_size=chunkSize):
+				size = size + len(chunk)
+				yield chunk
+		finally:
+			response.close()
+			self.observe('GET',url,started,response,size)
+
+	def post(self,url,data,params=None):
+		return self.request('POST',url,params=params,data=data)
+
+	def put(self,url,data,params=None):
+		return self.request('PUT',url,params=params,data=data)
+
+	def close(self):
+		self.session.close()
@@ -1,24 +1,48 @@
 #!/usr/bin/env python
 
-import requests
 import os
-import string
-import random
+import sys
 import json
+import time
 import datetime
+import threading
+import signal
 import pandas as pd
 import numpy as np
 
-import moment
 from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
+
+from .orgunits import OrgUnitIndex
+from .httpclient import Dhis2Client, Dhis2Error, Dhis2HttpError
+from .localstore import getStorePath
+from .metadatacache import MetadataCache
+from .baselines import BaselineStore
+from .eventimport import EventImporter
+from .eventledger import EventLedger
+from .statestore import StateStore
+from .datastore import PartitionedDatastore
+from .notifications import NotificationOutbox, NotificationDispatcher
+from .streaming import StreamedTable, parseTable
+from .paging import PagedTableFetcher
+from .scheduler import DiseaseScheduler
+from .metrics import RunMetrics
+from .cassette import Cassette
+from . import thresholds
+from . import codes
+from . import periods
+from . import classifications
 
 class IdsrAppServer:
-	def __init__(self):
+	# @param configFile settings file, .idsr.json in the parent directory of the package by default
+	def __init__(self,configFile=None):
 		self.dataStore = "ugxzr_idsr_app"
 		self.period = "LAST_7_DAYS"
 		self.ALPHABET = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
 		self.ID_LENGTH = 11
-		self.today = moment.now().format('YYYY-MM-DD')
+		# DHIS2 UIDs are generated locally unless set to 'remote'
+		self.uidSource = 'local'
+		self.today = datetime.date.today().strftime('%Y-%m-%d')
 		print("Epidemic/Outbreak Detection script started on %s" %self.today)
 
 		self.path = os.path.abspath(os.path.dirname(__file__))
@@ -27,6 +51,9 @@ class IdsrAppServer:
 		newPath.pop(-1)
 
 		self.fileDirectory = '/'.join(newPath)
+		self.configFile = configFile or os.path.join(self.fileDirectory,'.idsr.json')
+		# Modification time and size of the settings file when it was last loaded
+		self.settingsVersion = None
 		self.url = ""
 		self.username = ''
 		self.password = ''
@@ -46,35 +73,95 @@ class IdsrAppServer:
 		self.testResultClassification=''
 
 		self.epidemics = {}
+		# Number of diseases detected concurrently
+		self.workers = 1
+		# Shared DHIS2 HTTP client, timeouts by endpoint and retries
+		self.client = None
+		self.clientSettings = None
+		self.timeouts = None
+		self.retries = 3
+		self.runLock = threading.Lock()
+		# On-disk metadata cache, ttls by resource and forced refresh
+		self.metadataCache = None
+		self.storeSettings = None
+		self.localStore = '.idsr.sqlite'
+		self.cacheTtls = None
+		self.refreshCache = False
+		# Local store of aggregate baselines, recent weeks are always fetched again
+		self.baselineStore = None
+		self.useBaselineStore = True
+		self.baselineRevisionWeeks = 4
+		# Events are imported in chunks posted in parallel, failed chunks are retried
+		self.eventChunkSize = 500
+		self.importWorkers = 2
+		self.importRetries = 2
+		# Ledger of posted event hashes, unchanged events are not posted again
+		self.eventLedger = None
+		self.useEventLedger = True
+		# Local state of epidemics and alerts indexed by orgUnit, disease and period
+		self.stateStore = None
+		# Datastore layout of epidemics and alerts, 'single' key or 'partitioned' by disease and epi-year
+		self.datastoreLayout = 'single'
+		self.epidemicsStore = None
+		self.alertsStore = None
+		# Case based diseases are detected on program indicators ('analytics') or on the case events ('events')
+		self.caseBasedDetection = 'analytics'
+		# Outbox of messages sent by a background worker in rate limited batches
+		self.notificationDispatcher = None
+		self.notificationBatchSize = 20
+		self.notificationRateLimit = 5
+		self.notificationRetries = 5
+		self.notificationDrainTimeout = 300
+		# Parse analytics and query tables from the response stream into column buffers
+		self.streamTables = True
+		# Case queries are paged, pages fetched concurrently, optionally one query per level 2 subtree
+		self.pageSize = 1000
+		self.pageWorkers = 4
+		self.fanOutSubtrees = False
+		# Metrics of the current run, written as a JSON report and a Prometheus text file
+		self.metrics = RunMetrics()
+		self.useMetrics = True
+		self.metricsDirectory = None
+		# DHIS2 traffic recorded to a cassette or replayed from it, 'record' or 'replay'
+		self.cassette = None
+		self.cassetteMode = 'record'
+		self.replayLatency = 0
+		# Seeded generator of UIDs and outbreak codes for reproducible runs
+		self.rng = None
+		# Org unit indexes by detection level, shared by all diseases and kept between runs
+		# (org units,index) rebuilt when the metadata cache loads the org units again
+		self.orgUnitIndexes = {}
+		self.orgUnitIndexLocks = {}
+		self.orgUnitIndexLock = threading.Lock()
+
+		self.alertColumns = ['disease','orgUnit','orgUnitName','reportingOrgUnit','reportingOrgUnitName','confirmedValue','deathValue','suspectedValue','event','period','lastCaseDate','firstCaseDate','epicode','epidemic','alert','status']
+		self.messageColumns = ['subject','text','users','organisationUnits']
 
 		self.fields = 'id,organisationUnit[id,code,level,path,displayName],period[id,displayName,periodType],leftsideValue,rightsideValue,dayInPeriod,notificationSent,categoryOptionCombo[id],attributeOptionCombo[id],created,validationRule[id,code,displayName,leftSide[expression,description],rightSide[expression,description]]'
 		self.eventEndPoint = 'analytics/events/query/'
 
 	# Get Authentication details
 	def getAuth(self):
-		with open(os.path.join(self.fileDirectory,'.idsr.json'),'r') as jsonfile:
+		with open(self.configFile,'r') as jsonfile:
 			auth = json.load(jsonfile)
 			return auth
 
 
 	def getIsoWeek(self,d):
-		ddate = datetime.datetime.strptime(d,'%Y-%m-%d')
-		return datetime.datetime.strftime(ddate, '%YW%W')
+		return periods.formatWeek(d)
 
 	def formatIsoDate(self,d):
-		return moment.date(d).format('YYYY-MM-DD')
+		return periods.formatDate(d)
 
 	def getDateDifference(self,d1,d2):
 		if d1 and d2 :
-			delta = moment.date(d1) - moment.date(d2)
-			return delta.days
+			return periods.getDateDifference(periods.formatDate(d1),periods.formatDate(d2))
 		else:
 			return ""
 
 	def addDays(self,d1,days):
 		if d1:
-			newDay = moment.date(d1).add(days=days)
-			return newDay.format('YYYY-MM-DD')
+			return periods.addDays(periods.formatDate(d1),days)
 		else:
 			return ""
 	# create aggregate threshold period
@@ -82,63 +169,105 @@ class IdsrAppServer:
 	# @param m number of periods
 	# @param type seasonal (SEASONAL) or Non-seasonal (NON_SEASONAL) or case based (CASE_BASED)
 	def createAggThresholdPeriod(self,m,n,type):
-		periods = []
-		currentDate = moment.now().format('YYYY-MM-DD')
-		currentYear = self.getIsoWeek(currentDate)
-		if(type == 'SEASONAL'):
-
-			for year in range(0,n,1):
-				currentYDate = moment.date(currentDate).subtract(months=((year +1)*12)).format('YYYY-MM-DD')
-				for week in range(0,m,1):
-					currentWDate = moment.date(currentYDate).subtract(weeks=week).format('YYYY-MM-DD')
-					pe = self.getIsoWeek(currentWDate)
-					periods.append(pe)
-		elif(type == 'NON_SEASONAL'):
-			for week in range(0,(m+1),1):
-				currentWDate = moment.date(currentDate).subtract(weeks=week).format('YYYY-MM-DD')
-				pe = self.getIsoWeek(currentWDate)
-				periods.append(pe)
-		else:
-			pe = 'LAST_7_DAYS'
-			periods.append(pe)
-		return periods
-
+		return list(periods.getPeriods(self.today,m,n,type))
+
+	# Resolve a path of the settings e.g localStore or cassette, relative paths are in the directory of the settings file
+	def getSettingsPath(self,path):
+		return os.path.join(os.path.dirname(os.path.abspath(self.configFile)),path)
+
+	# Local store file of the DHIS2 instance of the url
+	def getLocalStorePath(self):
+		return getStorePath(self.getSettingsPath(self.localStore),self.url)
+
+	# Get shared DHIS2 client, created on first use for the current credentials
+	def getClient(self):
+		if self.client is None:
+			cassette = None if self.cassette is None else Cassette(self.getSettingsPath(self.cassette))
+			self.client = Dhis2Client(self.url,self.username,self.password,timeouts=self.timeouts,retries=self.retries,poolSize=max(10,2*self.workers,self.workers*self.pageWorkers),cassette=cassette,replay=self.cassetteMode == 'replay',replayLatency=self.replayLatency)
+		self.client.metrics = self.metrics
+		return self.client
+
+	# Get on-disk metadata cache stored near the settings file
+	def getMetadataCache(self):
+		if self.metadataCache is None:
+			self.metadataCache = MetadataCache(self.getLocalStorePath(),ttls=self.cacheTtls,refresh=self.refreshCache)
+		return self.metadataCache
+
+	# Get metadata through the cache, loading it from DHIS2 when missing or expired
+	def getCachedHttpData(self,key,resource,fields,params):
+		return self.getMetadataCache().get(key,lambda: self.getHttpData(self.url,fields,self.username,self.password,params),resource=resource)
+
+	# Raises Dhis2Error when the data could not be retrieved
 	def getHttpData(self,url,fields,username,password,params):
 		url = url+fields+".json"
-		data = requests.get(url, auth=(username, password),params=params)
-		if(data.status_code == 200):
-			return data.json()
-		else:
-			return 'HTTP_ERROR'
+		return self.getClient().get(url,params=params)
+
+	# Get a table response {headers,rows,height,...}, streamed into column buffers
+	def getHttpTable(self,url,fields,username,password,params):
+		if not self.streamTables:
+			return self.getHttpData(url,fields,username,password,params)
+		url = url+fields+".json"
+		chunks = self.getClient().stream(url,params=params)
+		try:
+			return parseTable(chunks)
+		finally:
+			chunks.close()
+
+	# Get every page of a query table
+	# @param scope how params are limited to a level 2 subtree, the 'dimension' ou or the 'ou' param
+	def getPagedTable(self,fields,params,scope):
+		fetcher = PagedTableFetcher(lambda pageParams: self.getHttpTable(self.url,fields,self.username,self.password,pageParams),pageSize=self.pageSize,workers=self.pageWorkers)
+		return fetcher.fetchScopes(self.getScopedParams(params,scope))
+
+	# Get params of a query for each level 2 subtree when fanning out
+	def getScopedParams(self,params,scope):
+		if not self.fanOutSubtrees:
+			return [params]
+		subtrees = list(self.getOrgUnitIndex(2).ancestors.keys())
+		if len(subtrees) == 0:
+			return [params]
+		scopedParams = []
+		for subtree in subtrees:
+			subtreeParams = dict(params)
+			if scope == 'dimension':
+				subtreeParams['dimension'] = [dimension + ';' + subtree if dimension.startswith('ou:') else dimension for dimension in params['dimension']]
+			else:
+				subtreeParams['ou'] = subtree
+			scopedParams.append(subtreeParams)
+		return scopedParams
 
 	def getHttpDataWithId(self,url,fields,idx,username,password,params):
 		url = url + fields + "/"+ idx + ".json"
-		data = requests.get(url, auth=(username, password),params=params)
-
-		if(data.status_code == 200):
-			return data.json()
-		else:
-			return 'HTTP_ERROR'
+		return self.getClient().get(url,params=params)
 
 	# Post data
 	def postJsonData(self,url,endPoint,username,password,data):
 		url = url+endPoint
-		submittedData = requests.post(url, auth=(username, password),json=data)
+		submittedData = self.getClient().post(url,data)
 		return submittedData
 
 	# Post data with parameters
 	def postJsonDataWithParams(self,url,endPoint,username,password,data,params):
 		url = url+endPoint
-		submittedData = requests.post(url, auth=(username, password),json=data,params=params)
+		submittedData = self.getClient().post(url,data,params=params)
 		return submittedData
 
 	# Update data
 	def updateJsonData(self,url,endPoint,username,password,data):
 		url = url+endPoint
-		submittedData = requests.put(url, auth=(username, password),json=data)
+		submittedData = self.getClient().put(url,data)
 		print("Status for ",endPoint, " : ",submittedData.status_code)
 		return submittedData
 
+	# Update a datastore key, creating it when it does not exist yet
+	def saveJsonData(self,url,endPoint,username,password,data):
+		try:
+			return self.updateJsonData(url,endPoint,username,password,data)
+		except Dhis2HttpError as e:
+			if e.status != 404:
+				raise
+		return self.postJsonData(url,endPoint,username,password,data)
+
 	# Get array from Object Array
 
 	def getArrayFromObject(self,arrayObject):
@@ -152,51 +281,50 @@ class IdsrAppServer:
 	def checkDataStore(self,url,fields,username,password,params):
 		url = url+fields+".json"
 		storesValues = {"exists": "false", "stores": []}
-		httpData = requests.get(url, auth=(username, password),params=params)
-		if(httpData.status_code != 200):
+		try:
+			storesValues['stores'] = self.getClient().get(url,params=params)
+			storesValues['exists'] = "true"
+		except Dhis2Error:
 			storesValues['exists'] = "false"
 			storesValues['stores'] = []
-		else:
-			storesValues['exists'] = "true"
-			storesValues['stores'] = httpData.json()
 		return storesValues
 
-	# Get orgUnit
-	def getOrgUnit(self,detectionOu,ous):
-		ou = []
-		if((ous !='undefined') and len(ous) > 0):
-			for oux in ous:
-				if(oux['id'] == detectionOu):
-					return oux['ancestors']
-		else:
-			return ou
-
-	# Get orgUnit value
-	# @param type = { id,name,code}
-	def getOrgUnitValue(self,detectionOu,ous,level,type):
-		ou = []
-		if((ous !='undefined') and len(ous) > 0):
-			for oux in ous:
-				if(oux['id'] == detectionOu):
-					return oux['ancestors'][level][type]
-		else:
-			return ou
-
-
-	# Generate code
-
-	def generateCode(self,row=None,column=None,prefix='',sep=''):
-		size = self.ID_LENGTH
-		chars = string.ascii_uppercase + string.digits
-		code = ''.join(random.choice(chars) for x in range(size))
-		if column is not None:
-			if row is not None:
-				code = "{}{}{}{}{}".format(prefix,sep,row[column],sep,code)
-			else:
-				code = "{}{}{}{}{}".format(prefix,sep,column,sep,code)
-		else:
-			code = "{}{}{}".format(prefix,sep,code)
-		return code
+	# Get org unit index for a detection level
+	# Org units are indexed once for each level, and again when their cache entry expired
+	def getOrgUnitIndex(self,level):
+		with self.orgUnitIndexLock:
+			lock = self.orgUnitIndexLocks.setdefault(level,threading.Lock())
+		with lock:
+			ouFields = 'organisationUnits'
+			ouParams = {"fields": "id,code,name,ancestors[id,code,name]","paging":"false","filter":"level:eq:"+ str(level)}
+			organisationUnits = self.getCachedHttpData('organisationUnits/level/' + str(level),'organisationUnits',ouFields,ouParams)
+			indexed = self.orgUnitIndexes.get(level)
+			if indexed is None or indexed[0] is not organisationUnits:
+				self.orgUnitIndexes[level] = (organisationUnits,OrgUnitIndex(organisationUnits['organisationUnits']))
+			return self.orgUnitIndexes[level][1]
+
+	# Generate DHIS2 UIDs locally, or with system/id when uidSource is 'remote'
+	# Falls back to local generation when the remote UIDs cannot be retrieved
+	def generateUids(self,n,existing=None):
+		if self.uidSource == 'remote':
+			epiCodesFields = "system/id"
+			epiCodesParams = { "limit" : n }
+			try:
+				epiCodes = self.getHttpData(self.url,epiCodesFields,self.username,self.password,params=epiCodesParams)
+				return epiCodes['codes']
+			except Dhis2Error as e:
+				print("Failed to generated DHIS2 UID codes: ",e)
+		return codes.generateUids(n,existing=existing,alphabet=self.ALPHABET,length=self.ID_LENGTH,rng=self.rng)
+
+	# Generate codes for all rows of a dataframe
+	# Codes are prefix,sep,row[column],sep,random code and unique against existing codes
+	def generateCodes(self,df,column=None,prefix='',sep='',existing=None):
+		values = df[column] if (column is not None and column in df.columns) else None
+		return codes.generateCodes(len(df.index),values=values,prefix=prefix,sep=sep,existing=existing,size=self.ID_LENGTH,rng=self.rng)
+
+	# Get outbreak codes already stored
+	def getEpicodes(self):
+		return self.getStateStore().getValues('epidemics','epicode')
 
 	def createMessage(self,outbreak=None,usergroups=[],type='EPIDEMIC'):
 		message = []
@@ -236,30 +364,38 @@ class IdsrAppServer:
 		return sentMessages
 		#return 0
 
+	# Get the notification dispatcher, its outbox shares the local store
+	def getNotificationDispatcher(self):
+		if self.notificationDispatcher is None:
+			outbox = NotificationOutbox(self.getLocalStorePath())
+			self.notificationDispatcher = NotificationDispatcher(outbox,self.sendSmsAndEmailMessage,batchSize=self.notificationBatchSize,rateLimit=self.notificationRateLimit,retries=self.notificationRetries)
+		return self.notificationDispatcher
+
+	# Queue messages for the background worker, already queued alerts are skipped
+	def queueMessages(self,messages,type='ALERT'):
+		dispatcher = self.getNotificationDispatcher()
+		queued = dispatcher.outbox.enqueue(messages,type)
+		print("Messages queued: {} of {}".format(queued,len(messages)))
+		dispatcher.notify()
+		return queued
+
 	# create alerts data
 
 	def createAlerts(self,userGroup,values,type):
 
 		messageConversations = []
 		messages = { "messageConversations": []}
-		if type == 'EPIDEMIC':
+		if type in ['EPIDEMIC','ALERT','REMINDER']:
 			for val in values:
-				messageConversations.append(self.createMessage(userGroup,val,type))
-			messages['messageConversations'] = messageConversations
-		elif type == 'ALERT':
-			for val in values:
-				messageConversations.append(self.createMessage(userGroup,val,type))
-			messages['messageConversations'] = messageConversations
-		elif type == 'REMINDER':
-			for val in values:
-				messageConversations.append(self.createMessage(userGroup,val,type))
+				message = dict(val)
+				message.update(zip(self.messageColumns,self.createMessage(val,userGroup,type)))
+				message['messageType'] = type
+				messageConversations.append(message)
 			messages['messageConversations'] = messageConversations
 		else:
 			pass
 
-		for message in messageConversations:
-			msgSent = self.sendSmsAndEmailMessage(message)
-			print("Message Sent status",msgSent)
+		self.queueMessages(messageConversations,type)
 		return messages
 
 	# create columns from event data
@@ -291,13 +427,7 @@ class IdsrAppServer:
 		return cols
 	# Get start and end date
 	def getStartEndDates(self,year, week):
-		d = moment.date(year,1,1).date
-		if(d.weekday() <= 3):
-			d = d - datetime.timedelta(d.weekday())
-		else:
-			d = d + datetime.timedelta(7-d.weekday())
-		dlt = datetime.timedelta(days = (week-1)*7)
-		return [d + dlt,  d + dlt + datetime.timedelta(days=6)]
+		return periods.getStartEndDates(year,week)
 
 	# create Panda Data Frame from event data
 	def createDataFrame(self,events,type=None):
@@ -309,95 +439,209 @@ class IdsrAppServer:
 				dataFrame = pd.DataFrame()
 		else:
 			cols = self.createColumns(events['headers'],type)
-			dataFrame = pd.DataFrame.from_records(events['rows'],columns=cols)
+			if isinstance(events,StreamedTable):
+				dataFrame = events.createDataFrame(cols)
+			else:
+				dataFrame = pd.DataFrame.from_records(events['rows'],columns=cols)
 		return dataFrame
 
+	# Get baseline store kept in the local store file
+	def getBaselineStore(self):
+		if self.baselineStore is None:
+			self.baselineStore = BaselineStore(self.getLocalStorePath())
+		return self.baselineStore
+
+	# Get a partitioned datastore of epidemics or alerts
+	def getPartitionedDatastore(self,name):
+		endPoint = 'dataStore/' + self.dataStore + '/'
+		return PartitionedDatastore(
+			lambda key: self.getHttpData(self.url,endPoint + key,self.username,self.password,{}),
+			lambda key,data: self.saveJsonData(self.url,endPoint + key,self.username,self.password,data),
+			name)
+
+	# Epi-years read from a partitioned datastore, the current and the previous year
+	def getEpiYears(self):
+		year = int(self.today[:4])
+		return [year,year-1]
+
+	# Rows of a DataFrame or a table response, for the run metrics
+	def getRowCount(self,data):
+		if data is None:
+			return 0
+		if isinstance(data,pd.DataFrame):
+			return len(data.index)
+		if isinstance(data,dict):
+			return len(data.get('rows',[]))
+		return len(data)
+
+	# Split the single epidemics and alerts keys into partitions by disease and epi-year
+	def migrateDatastore(self):
+		self.loadSettings()
+		for name in ['epidemics','alerts']:
+			try:
+				records = self.getHttpData(self.url,'dataStore/' + self.dataStore + '/' + name,self.username,self.password,{})
+			except Dhis2HttpError as e:
+				if e.status != 404:
+					print("Failed to load " + name + " datastore: ",e)
+					return
+				records = []
+			written = self.getPartitionedDatastore(name).migrate(records,self.getEpiYears()[0])
+			print("Migrated {} {} into {} partitions".format(len(records),name,len(written)))
+
+	def getStateStore(self):
+		if self.stateStore is None:
+			self.stateStore = StateStore(self.getLocalStorePath())
+		return self.stateStore
+
+	# Get the stored outbreaks with the keys of detections, the id of each in the state store as stateId
+	def getStoredEpidemics(self,kind,df):
+		matches = self.getStateStore().getMatches(kind,df[['orgUnit','disease','period']].itertuples(index=False,name=None))
+		if len(matches) == 0:
+			return pd.DataFrame()
+		stored = self.createDataFrame([record for id,record in matches])
+		stored['stateId'] = [id for id,record in matches]
+		return stored
+
+	# Write the stored epidemics or alerts to their datastore key, or to the changed partitions of the diseases
+	# The datastore already holds the stored records when nothing changed in this run
+	# @return number of records written
+	def saveDatastoreMirror(self,kind,diseases,changes):
+		if len(changes) == 0:
+			print("No changed " + kind + " to write to the datastore")
+			return 0
+		stateStore = self.getStateStore()
+		year = self.getEpiYears()[0]
+		if self.datastoreLayout == 'partitioned':
+			# Only the partitions of the diseases of this run are written
+			records = stateStore.getRecords(kind,diseases)
+			partitionedStore = self.epidemicsStore if kind == 'epidemics' else self.alertsStore
+			written = partitionedStore.saveRecords(records,diseases,year)
+			print("Updated " + kind + " partitions: ",written)
+		else:
+			records = stateStore.getRecords(kind)
+			self.saveJsonData(self.url,'dataStore/' + self.dataStore + '/' + kind,self.username,self.password,records)
+		stateStore.setMirrorHashes(kind,records,year)
+		return len(records)
+
+	# Get changed outbreaks as (stateId,record) for the state store, stateId is None for new outbreaks
+	def getStateChanges(self,df,columns):
+		records = json.loads(df.filter(columns).to_json(orient='records',date_format='iso'))
+		ids = df['stateId'].tolist() if 'stateId' in df.columns else [None]*len(records)
+		return [(None if pd.isnull(id) else int(id),record) for id,record in zip(ids,records)]
+
+	def getEventLedger(self):
+		if self.eventLedger is None:
+			self.eventLedger = EventLedger(self.getLocalStorePath())
+		return self.eventLedger
+
+	# Get periods to fetch from analytics
+	# Periods of the current window, of the revision window and those not stored yet
+	def getBaselineFetchPeriods(self,indicators,level,periods,algorithm,m,n):
+		if not self.useBaselineStore:
+			return periods
+		stored = self.getBaselineStore().getStoredPeriods(indicators,level,periods)
+		current = thresholds.getWindows(algorithm,m,n)[0].tolist()
+		revisionDate = datetime.datetime.strptime(self.today,'%Y-%m-%d') - datetime.timedelta(weeks=self.baselineRevisionWeeks)
+		fetchPeriods = []
+		for position,period in enumerate(periods):
+			year,week = period.split('W')
+			if (position in current) or (period not in stored) or (self.getStartEndDates(int(year),int(week))[1] >= revisionDate):
+				fetchPeriods.append(period)
+		return fetchPeriods
+
+	# Merge the fetched analytics table with stored baselines into a table of all periods
+	# Fetched values replace the stored ones
+	def mergeBaselines(self,aggData,indicators,level,periods,fetchPeriods):
+		if not self.useBaselineStore:
+			return aggData
+		df = self.createDataFrame(aggData,'AGGREGATE')
+		if df.empty:
+			return df
+		valueStart = level+4
+		values = df.iloc[:,valueStart:].apply(pd.to_numeric,errors='coerce').fillna(0).to_numpy()
+		fetched = thresholds.createCube(values,len(indicators),len(fetchPeriods))
+		orgUnits = df.iloc[:,level].tolist()
+		baselineStore = self.getBaselineStore()
+		baselineStore.saveValues(indicators,level,fetchPeriods,orgUnits,fetched)
+		storedPeriods = [period for period in periods if period not in fetchPeriods]
+		positions = {period: position for position,period in enumerate(periods)}
+		cube = np.zeros((len(orgUnits),len(indicators),len(periods)))
+		cube[:,:,[positions[period] for period in fetchPeriods]] = fetched
+		cube[:,:,[positions[period] for period in storedPeriods]] = baselineStore.getValues(indicators,level,storedPeriods,orgUnits)
+		valueColumns = ['{} {}'.format(indicator,period) for indicator in indicators for period in periods]
+		merged = pd.DataFrame(cube.reshape(len(orgUnits),-1),columns=valueColumns,index=df.index)
+		return pd.concat([df.iloc[:,:valueStart],merged],axis=1)
+
 	# Detect using aggregated indicators
 	# Confirmed, Deaths,Suspected
-	def detectOnAggregateIndicators(self,aggData,diseaseMeta,epidemics,ou,periods,mPeriods,nPeriods):
+	def detectOnAggregateIndicators(self,aggData,diseaseMeta,ou,periods,mPeriods,nPeriods):
 		dhis2Events = pd.DataFrame()
 		detectionLevel = int(diseaseMeta['detectionLevel'])
 		reportingLevel = int(diseaseMeta['reportingLevel'])
 		m=mPeriods
 		n=nPeriods
-		if(aggData != 'HTTP_ERROR'):
-			if((aggData != 'undefined') and (aggData['rows'] != 'undefined') and len(aggData['rows']) >0):
-
-				df = self.createDataFrame(aggData,'AGGREGATE')
-				dfColLength = len(df.columns)
-				df1 = df.iloc[:,(detectionLevel+4):dfColLength]
-				df.iloc[:,(detectionLevel+4):dfColLength] = df1.apply(pd.to_numeric,errors='coerce').fillna(0).astype(np.int64)
-				# print(df.iloc[:,(detectionLevel+4):(detectionLevel+4+m)])	# cases, deaths
+		if(aggData is not None):
+			# aggData is the analytics response or a table already merged with stored baselines
+			if (isinstance(aggData,pd.DataFrame) and aggData.empty is not True) or ((not isinstance(aggData,pd.DataFrame)) and (aggData != 'undefined') and (aggData['rows'] != 'undefined') and len(aggData['rows']) >0):
+
+				df = aggData if isinstance(aggData,pd.DataFrame) else self.createDataFrame(aggData,'AGGREGATE')
+				valueStart = detectionLevel+4
+				indicators = len(diseaseMeta['programIndicators'])
+				values = df.iloc[:,valueStart:].apply(pd.to_numeric,errors='coerce').fillna(0).astype(np.int64).to_numpy()
+				# Keep hierarchy and org unit columns, values move to the (orgUnit x indicator x period) cube
+				df = df.iloc[:,:valueStart].copy()
+				cube = thresholds.createCube(values,indicators,len(periods))
+				current,baseline = thresholds.getWindows(diseaseMeta['epiAlgorithm'],m,n)
+				aggThresholds = thresholds.computeThresholds(cube,current,baseline)
+				for case,indicator in [('cases',thresholds.CASES),('deaths',thresholds.DEATHS)]:
+					if indicator < indicators:
+						df['mean_current_' + case] = aggThresholds['current'][:,indicator]
+						df['mean_mn_' + case] = aggThresholds['mean'][:,indicator]
+						df['stddev_mn_' + case] = aggThresholds['std'][:,indicator]
+						df['mean20std_mn_' + case] = aggThresholds['threshold20'][:,indicator]
+						df['mean15std_mn_' + case] = aggThresholds['threshold15'][:,indicator]
+					else:
+						df['mean_current_' + case] = 0
 
-				### Make generic functions for math
 				if diseaseMeta['epiAlgorithm'] == "NON_SEASONAL":
-					# No need to do mean for current cases or deaths
-					df['mean_current_cases'] = df.iloc[:,(detectionLevel+4)]
-					df['mean_mn_cases'] = df.iloc[:,(detectionLevel+5):(detectionLevel+4+m)].mean(axis=1)
-					df['stddev_mn_cases'] = df.iloc[:,(detectionLevel+5):(detectionLevel+4+m)].std(axis=1)
-					df['mean20std_mn_cases'] = (df.mean_mn_cases + (2*df.stddev_mn_cases))
-					df['mean15std_mn_cases'] = (df.mean_mn_cases + (1.5*df.stddev_mn_cases))
-
-					df['mean_current_deaths'] = df.iloc[:,(detectionLevel+5+m)]
-					df['mean_mn_deaths'] = df.iloc[:,(detectionLevel+6+m):(detectionLevel+6+(2*m))].mean(axis=1)
-					df['stddev_mn_deaths'] = df.iloc[:,(detectionLevel+6+m):(detectionLevel+6+(2*m))].std(axis=1)
-					df['mean20std_mn_deaths'] = (df.mean_mn_deaths + (2*df.stddev_mn_deaths))
-					df['mean15std_mn_deaths'] = (df.mean_mn_deaths + (1.5*df.stddev_mn_deaths))
 					# periods
-					df['period']= periods[0]
-					startOfMidPeriod = periods[0].split('W')
+					detectionPeriod = periods[0]
+					startOfMidPeriod = detectionPeriod.split('W')
 					startEndDates = self.getStartEndDates(int(startOfMidPeriod[0]),int(startOfMidPeriod[1]))
-					df['dateOfOnSetWeek'] = moment.date(startEndDates[0]).format('YYYY-MM-DD')
-					# First case date is the start date of the week where outbreak was detected
-					df['firstCaseDate'] = moment.date(startEndDates[0]).format('YYYY-MM-DD')
 					# Last case date is the end date of the week boundary.
-					df['lastCaseDate'] = moment.date(startEndDates[1]).format('YYYY-MM-DD')
-					df['endDate'] = ""
-					df['closeDate'] = moment.date(startEndDates[1]).add(days=int(diseaseMeta['incubationDays'])).format('YYYY-MM-DD')
+					lastCaseDate = startEndDates[1]
+					closeDate = startEndDates[1] + datetime.timedelta(days=int(diseaseMeta['incubationDays']))
 
 				if diseaseMeta['epiAlgorithm'] == "SEASONAL":
-					df['mean_current_cases'] = df.iloc[:,(detectionLevel+4):(detectionLevel+3+m)].mean(axis=1)
-					df['mean_mn_cases'] = df.iloc[:,(detectionLevel+3+m):(detectionLevel+3+m+(m*n))].mean(axis=1)
-					df['stddev_mn_cases'] = df.iloc[:,(detectionLevel+3+m):(detectionLevel+3+m+(m*n))].std(axis=1)
-					df['mean20std_mn_cases'] = (df.mean_mn_cases + (2*df.stddev_mn_cases))
-					df['mean15std_mn_cases'] = (df.mean_mn_cases + (1.5*df.stddev_mn_cases))
-
-					df['mean_current_deaths'] = df.iloc[:,(detectionLevel+3+m+(m*n)):(detectionLevel+3+(2*m)+(m*n))].mean(axis=1)
-					df['mean_mn_deaths'] = df.iloc[:,(detectionLevel+3+(2*m)+(m*n)):dfColLength-1].mean(axis=1)
-					df['stddev_mn_deaths'] = df.iloc[:,(detectionLevel+3+(2*m)+(m*n)):dfColLength-1].std(axis=1)
-					df['mean20std_mn_deaths'] = (df.mean_mn_deaths + (2*df.stddev_mn_deaths))
-					df['mean15std_mn_deaths'] = (df.mean_mn_deaths + (1.5*df.stddev_mn_deaths))
 					# Mid period for seasonal = mean of range(1,(m+1)) where m = number of periods
 					midPeriod = int(np.median(range(1,(m+1))))
-					df['period']= periods[midPeriod]
-					startOfMidPeriod = periods[midPeriod].split('W')
+					detectionPeriod = periods[midPeriod]
+					startOfMidPeriod = detectionPeriod.split('W')
 					startEndDates = self.getStartEndDates(int(startOfMidPeriod[0]),int(startOfMidPeriod[1]))
-					df['dateOfOnSetWeek'] = moment.date(startEndDates[0]).format('YYYY-MM-DD')
-					# First case date is the start date of the week where outbreak was detected
-					df['firstCaseDate'] = moment.date(startEndDates[0]).format('YYYY-MM-DD')
-					# Last case date is the end date of the week boundary.
-					startOfEndPeriod = periods[(m+1)].split('W')
-					endDates = moment.date(startEndDates[0] + datetime.timedelta(days=(m-1)*(7/2))).format('YYYY-MM-DD')
-					df['lastCaseDate'] = moment.date(startEndDates[0] + datetime.timedelta(days=(m-1)*(7/2))).format('YYYY-MM-DD')
-					df['endDate'] = ""
-					df['closeDate'] = moment.date(startEndDates[0]).add(days=(m-1)*(7/2)+ int(diseaseMeta['incubationDays'])).format('YYYY-MM-DD')
-
+					# Last case date is half of the current window after the start of the mid period
+					lastCaseDate = startEndDates[0] + datetime.timedelta(days=(m-1)*(7/2))
+					closeDate = startEndDates[0] + datetime.timedelta(days=(m-1)*(7/2)+ int(diseaseMeta['incubationDays']))
+
+				df['period']= detectionPeriod
+				df['dateOfOnSetWeek'] = startEndDates[0].strftime('%Y-%m-%d')
+				# First case date is the start date of the week where outbreak was detected
+				df['firstCaseDate'] = startEndDates[0].strftime('%Y-%m-%d')
+				df['lastCaseDate'] = lastCaseDate.strftime('%Y-%m-%d')
+				df['endDate'] = ""
+				df['closeDate'] = closeDate.strftime('%Y-%m-%d')
 
 				df['reportingOrgUnitName'] = df.iloc[:,reportingLevel-1]
-				df['reportingOrgUnit'] = df.iloc[:,detectionLevel].apply(self.getOrgUnitValue,args=(ou,(reportingLevel-1),'id'))
+				df['reportingOrgUnit'] = ou.mapValues(df.iloc[:,detectionLevel],reportingLevel,'id')
 				df['orgUnit'] = df.iloc[:,detectionLevel]
 				df['orgUnitName'] = df.iloc[:,detectionLevel+1]
 				df['orgUnitCode'] = df.iloc[:,detectionLevel+2]
-				dropColumns = [col for idx,col in enumerate(df.columns.values.tolist()) if idx > (detectionLevel+4) and idx < (detectionLevel+4+(3*m))]
-				df.drop(columns=dropColumns,inplace=True)
 				df['confirmedValue'] = df.loc[:,'mean_current_cases']
 				df['deathValue'] = df.loc[:,'mean_current_deaths']
 				df['suspectedValue'] = df.loc[:,'mean_current_cases']
 				df['disease'] = diseaseMeta['disease']
 				df['incubationDays'] = diseaseMeta['incubationDays']
 
-				checkEpidemic = "mean_current_cases >= mean20std_mn_cases & mean_current_cases != 0 & mean20std_mn_cases != 0"
-				df.query(checkEpidemic,inplace=True)
+				df = df[thresholds.getEpidemicMask(aggThresholds)]
 				if df.empty is True:
 					df['alert'] = "false"
 				if df.empty is not True:
@@ -409,113 +653,92 @@ class IdsrAppServer:
 					df['reminder'] = "false"
 
 					#df['epicode']=df['orgUnitCode'].str.cat('E',sep="_")
-					df['epicode'] = df.apply(self.generateCode,args=('orgUnitCode','E','_'), axis=1)
+					df['epicode'] = self.generateCodes(df,'orgUnitCode','E','_',existing=self.getEpicodes())
 					closedQuery = "df['epidemic'] == 'true' && df['active'] == 'true' && df['reminder'] == 'false'"
 					closedVigilanceQuery = "df['epidemic'] == 'true' && df['active'] == 'true' && df['reminder'] == 'true'"
 
-					df[['status','active','closeDate','reminderSent','dateReminderSent']] = df.apply(self.getEpidemicDetails,axis=1)
+					df[['status','active','closeDate','reminderSent','dateReminderSent']] = self.getEpidemicDetails(df)
 			else:
 				# No data for cases found
-				pass
+				df = dhis2Events
 			return df
 		else:
 			print("No outbreaks/epidemics for " + diseaseMeta['disease'])
 			return dhis2Events
 
-	# Replace all values with standard text
-	def replaceText(self,df):
-
-		df.replace(to_replace='Confirmed case',value='confirmedValue',regex=True,inplace=True)
-		df.replace(to_replace='Suspected case',value='suspectedValue',regex=True,inplace=True)
-		df.replace(to_replace='Confirmed',value='confirmedValue',regex=True,inplace=True)
-		df.replace(to_replace='Suspected',value='suspectedValue',regex=True,inplace=True)
-		df.replace(to_replace='confirmed case',value='confirmedValue',regex=True,inplace=True)
-		df.replace(to_replace='suspected case',value='suspectedValue',regex=True,inplace=True)
-		df.replace(to_replace='died',value='deathValue',regex=True,inplace=True)
-		df.replace(to_replace='Died case',value='deathValue',regex=True,inplace=True)
-		return df
-
-	# Get Confirmed,suspected cases and deaths
-	def getCaseStatus(self,row=None,columns=None,caseType='CONFIRMED'):
+	# Replace None values of a column with 0, missing numbers (NaN) are kept
+	def getValueOrZero(self,column):
+		if column.dtype == object:
+			return column.mask(np.equal(column.to_numpy(),None),0)
+		return column
+
+	# Get the larger of the _left and _right merge values, left when they cannot be compared
+	def getMergedValue(self,df,column):
+		left = self.getValueOrZero(df[column + '_left'])
+		right = self.getValueOrZero(df[column + '_right'])
+		return pd.Series(np.where(left <= right,right,left),index=df.index)
+
+	# Get Confirmed,suspected cases and deaths for all rows
+	def getCaseStatus(self,df,caseType='CONFIRMED'):
+		columns = df.columns
 		if caseType == 'CONFIRMED':
-			# if all(elem in columns.values for elem in ['confirmedValue']):
 			if set(['confirmedValue']).issubset(columns.values):
-				return int(row['confirmedValue'])
+				return df['confirmedValue'].astype(np.int64)
 			elif set(['confirmedValue_left','confirmedValue_right']).issubset(columns.values):
-				confirmedValue_left = row['confirmedValue_left']
-				confirmedValue_right = row['confirmedValue_right']
-
-				confirmedValue_left = confirmedValue_left if row['confirmedValue_left'] is not None else 0
-				confirmedValue_right = confirmedValue_right if row['confirmedValue_right'] is not None else 0
-				if confirmedValue_left <= confirmedValue_right:
-					return confirmedValue_right
-				else:
-					return confirmedValue_left
+				return self.getMergedValue(df,'confirmedValue')
 			else:
-				return 0
+				return pd.Series(0,index=df.index)
 		elif caseType == 'SUSPECTED':
 			if set(['suspectedValue','confirmedValue']).issubset(columns.values):
-				if int(row['suspectedValue']) <= int(row['confirmedValue']):
-					return row['confirmedValue']
-				else:
-					return row['suspectedValue']
+				suspected = df['suspectedValue']
+				confirmed = df['confirmedValue']
+				return pd.Series(np.where(suspected.astype(np.int64) <= confirmed.astype(np.int64),confirmed,suspected),index=df.index)
 			elif set(['suspectedValue_left','suspectedValue_right','confirmedValue']).issubset(columns.values):
-				suspectedValue_left = row['suspectedValue_left']
-				suspectedValue_right = row['suspectedValue_right']
-
-				suspectedValue_left = suspectedValue_left if row['suspectedValue_left'] is not None else 0
-				suspectedValue_right = suspectedValue_right if row['suspectedValue_right'] is not None else 0
-				if (suspectedValue_left <= row['confirmedValue']) and (suspectedValue_right <= suspectedValue_left):
-					return row['confirmedValue']
-				elif (suspectedValue_left <= suspectedValue_right) and (row['confirmedValue'] <= suspectedValue_left):
-					return suspectedValue_right
-				else:
-					return suspectedValue_left
+				suspectedValue_left = self.getValueOrZero(df['suspectedValue_left'])
+				suspectedValue_right = self.getValueOrZero(df['suspectedValue_right'])
+				confirmed = df['confirmedValue']
+				conditions = [(suspectedValue_left <= confirmed) & (suspectedValue_right <= suspectedValue_left),(suspectedValue_left <= suspectedValue_right) & (confirmed <= suspectedValue_left)]
+				return pd.Series(np.select(conditions,[confirmed,suspectedValue_right],default=suspectedValue_left),index=df.index)
 			else:
-				return 0
+				return pd.Series(0,index=df.index)
 		elif caseType == 'DEATH':
 			if set(['deathValue_left','deathValue_right']).issubset(columns.values):
-				deathValue_left = row['deathValue_left']
-				deathValue_right = row['deathValue_right']
-				deathValue_left = deathValue_left if row['deathValue_left'] is not None else 0
-				deathValue_right = deathValue_right if row['deathValue_right'] is not None else 0
-				if deathValue_left <= deathValue_right:
-					return deathValue_right
-				else:
-					return deathValue_left
+				return self.getMergedValue(df,'deathValue')
 			elif set(['deathValue']).issubset(columns.values):
-				return row['deathValue']
+				return df['deathValue']
 			else:
-				return 0
+				return pd.Series(0,index=df.index)
 
-	# Check if epedimic is active or ended
-	def getStatus(self,row=None,status=None):
-		currentStatus = 'false'
+	# Check if epedimic is active or ended for all rows
+	def getStatus(self,df,status=None):
+		today = pd.to_datetime(self.today)
+		currentStatus = pd.Series('false',index=df.index)
 		if status == 'active':
-			if pd.to_datetime(self.today) < pd.to_datetime(row['endDate']):
-				currentStatus='active'
-			elif pd.to_datetime(row['endDate']) == (pd.to_datetime(self.today)):
-				currentStatus='true'
-			else:
-				currentStatus='false'
+			endDate = pd.to_datetime(df['endDate'])
+			currentStatus[:] = np.select([today < endDate,endDate == today],['active','true'],default='false')
 		elif status == 'reminder':
-			if row['reminderDate'] == pd.to_datetime(self.today):
-				currentStatus='true'
-			else:
-				currentStatus='false'
-		return pd.Series(currentStatus)
+			currentStatus[:] = np.where(df['reminderDate'] == today,'true','false')
+		return currentStatus
 	# get onset date
 	def getOnSetDate(self,row):
 		if row['eventdate'] == '':
 			return row['onSetDate']
 		else:
-			return moment.date(row['eventdate']).format('YYYY-MM-DD')
+			return periods.formatDate(row['eventdate'])
 	# Get onset for TrackedEntityInstances
 	def getTeiOnSetDate(self,row):
 		if row['dateOfOnSet'] == '':
 			return row['dateOfOnSet']
 		else:
-			return moment.date(row['created']).format('YYYY-MM-DD')
+			return periods.formatDate(row['created'])
+
+	# Onset dates of a column of events, the event date when set
+	def getOnSetDates(self,df):
+		return pd.Series(np.where(df['eventdate'] == '',df['onSetDate'],periods.formatDates(df['eventdate']).to_numpy()),index=df.index)
+
+	# Onset dates of a column of tracked entity instances, see getTeiOnSetDate
+	def getTeiOnSetDates(self,df):
+		return pd.Series(np.where(df['dateOfOnSet'] == '',df['dateOfOnSet'],periods.formatDates(df['created']).to_numpy()),index=df.index)
 
 
 	# replace data of onset with event dates
@@ -535,32 +758,21 @@ class IdsrAppServer:
 	def queryValue(self,df,query,column=None,inplace=True):
 		df.query(query)
 		return df
-	# Get epidemic, closure and status
-	def getEpidemicDetails(self,row,columns=None):
-		details = []
-		if row['epidemic'] == "true" and row['active'] == "true" and row['reminder'] == "false":
-		 	details.append('Closed')
-		 	details.append('false')
-		 	details.append(self.today)
-		 	details.append('false')
-		 	details.append('')
-		 	# Send closure message
-
-		elif row['epidemic'] == "true" and row['active'] == "true" and row['reminder'] == "true":
-			details.append('Closed Vigilance')
-			details.append('true')
-			details.append(row['closeDate'])
-			details.append('true')
-			details.append(self.today)
-			# Send Reminder for closure
-		else:
-			details.append('Confirmed')
-			details.append('true')
-			details.append('')
-			details.append('false')
-			details.append('')
-		detailsSeries = tuple(details)
-		return pd.Series(detailsSeries)
+	# Get epidemic, closure and status for all rows
+	# @return status,active,closeDate,reminderSent,dateReminderSent columns
+	def getEpidemicDetails(self,df,columns=None):
+		closed = (df['epidemic'] == "true") & (df['active'] == "true") & (df['reminder'] == "false")
+		# Send closure message
+		closedVigilance = (df['epidemic'] == "true") & (df['active'] == "true") & (df['reminder'] == "true")
+		# Send Reminder for closure
+		conditions = [closed,closedVigilance]
+		details = pd.DataFrame(index=df.index)
+		details['status'] = np.select(conditions,['Closed','Closed Vigilance'],default='Confirmed')
+		details['active'] = np.select(conditions,['false','true'],default='true')
+		details['closeDate'] = np.select(conditions,[self.today,df['closeDate']],default='')
+		details['reminderSent'] = np.select(conditions,['false','true'],default='false')
+		details['dateReminderSent'] = np.select(conditions,['',self.today],default='')
+		return details
 
 	# Get key id from dataelements
 	def getDataElement(self,dataElements,key):
@@ -573,11 +785,11 @@ class IdsrAppServer:
 
 	# detect self.epidemics
 	# Confirmed, Deaths,Suspected
-	def detectBasedOnProgramIndicators(self,caseEvents,diseaseMeta,orgUnits,type,dateData):
+	def detectBasedOnProgramIndicators(self,caseEvents,diseaseMeta,orgUnits,type,dateData,classificationValues=None):
 		dhis2Events = pd.DataFrame()
 		detectionLevel = int(diseaseMeta['detectionLevel'])
 		reportingLevel = int(diseaseMeta['reportingLevel'])
-		if(caseEvents != 'HTTP_ERROR'):
+		if(caseEvents is not None):
 			if((caseEvents != 'undefined') and (caseEvents['rows'] != 'undefined') and caseEvents['height'] >0):
 				df = self.createDataFrame(caseEvents,type)
 
@@ -587,48 +799,54 @@ class IdsrAppServer:
 				if(type =='EVENT'):
 					# If date of onset is null, use eventdate
 					#df['dateOfOnSet'] = np.where(df['onSetDate']== '',pd.to_datetime(df['eventdate']).dt.strftime('%Y-%m-%d'),df['onSetDate'])
-					df['dateOfOnSet'] = df.apply(self.getOnSetDate,axis=1)
-					# Replace all text with standard text
+					df['dateOfOnSet'] = self.getOnSetDates(df)
+					# Map classification and outcome option values to standard text
 
-					df = self.replaceText(df)
+					df = classifications.normalize(df,classificationValues)
 
 					# Transpose and Aggregate values
 
-					dfCaseClassification = df.groupby(['ouname','ou','disease','dateOfOnSet'])['caseClassification'].value_counts().unstack().fillna(0).reset_index()
+					caseKeys = ['ouname','ou','disease','dateOfOnSet']
+					dfCaseClassification = classifications.countValues(df,caseKeys,'caseClassification')
 
-					dfCaseImmediateOutcome = df.groupby(['ouname','ou','disease','dateOfOnSet'])['immediateOutcome'].value_counts().unstack().fillna(0).reset_index()
+					dfCaseImmediateOutcome = classifications.countValues(df,caseKeys,'immediateOutcome')
 
-					dfTestResult = df.groupby(['ouname','ou','disease','dateOfOnSet'])['testResult'].value_counts().unstack().fillna(0).reset_index()
+					dfTestResult = classifications.countValues(df,caseKeys,'testResult')
 
-					dfTestResultClassification = df.groupby(['ouname','ou','disease','dateOfOnSet'])['testResultClassification'].value_counts().unstack().fillna(0).reset_index()
+					dfTestResultClassification = classifications.countValues(df,caseKeys,'testResultClassification')
 
-					dfStatusOutcome = df.groupby(['ouname','ou','disease','dateOfOnSet'])['statusOutcome'].value_counts().unstack().fillna(0).reset_index()
+					dfStatusOutcome = classifications.countValues(df,caseKeys,'statusOutcome')
 
-					combinedDf = pd.merge(dfCaseClassification,dfCaseImmediateOutcome,on=['ou','ouname','disease','dateOfOnSet'],how='left').merge(dfTestResultClassification,on=['ou','ouname','disease','dateOfOnSet'],how='left').merge(dfTestResult,on=['ou','ouname','disease','dateOfOnSet'],how='left').merge(dfStatusOutcome,on=['ou','ouname','disease','dateOfOnSet'],how='left')
+					# Counts found in two columns e.g confirmedValue of caseClassification and testResultClassification are read by getCaseStatus as _left and _right
+					combinedDf = pd.merge(dfCaseClassification,dfCaseImmediateOutcome,on=caseKeys,how='left',suffixes=('_left','_right')).merge(dfTestResultClassification,on=caseKeys,how='left',suffixes=('_left','_right')).merge(dfTestResult,on=caseKeys,how='left',suffixes=('_left','_right')).merge(dfStatusOutcome,on=caseKeys,how='left',suffixes=('_left','_right'))
 					combinedDf.sort_values(['ouname','disease','dateOfOnSet'],ascending=[True,True,True])
-					combinedDf['dateOfOnSetWeek'] = pd.to_datetime(combinedDf['dateOfOnSet']).dt.strftime('%YW%V')
-					combinedDf['confirmedValue'] = combinedDf.apply(self.getCaseStatus,args=(combinedDf.columns,'CONFIRMED'),axis=1)
-					combinedDf['suspectedValue'] = combinedDf.apply(self.getCaseStatus,args=(combinedDf.columns,'SUSPECTED'),axis=1)
-
-					#combinedDf['deathValue'] = combinedDf.apply(self.getCaseStatus,args=(combinedDf.columns,'DEATH'),axis=1)
+					combinedDf['dateOfOnSetWeek'] = pd.to_datetime(combinedDf['dateOfOnSet']).dt.strftime(periods.WEEK_FORMAT)
+					combinedDf['confirmedValue'] = self.getCaseStatus(combinedDf,'CONFIRMED')
+					combinedDf['suspectedValue'] = self.getCaseStatus(combinedDf,'SUSPECTED')
+					combinedDf['deathValue'] = self.getCaseStatus(combinedDf,'DEATH')
 
 					dfConfirmed = combinedDf.groupby(['ouname','ou','disease','dateOfOnSetWeek'])['confirmedValue'].agg(['sum']).reset_index()
 
 					dfConfirmed.rename(columns={'sum':'confirmedValue' },inplace=True)
 					dfSuspected = combinedDf.groupby(['ouname','ou','disease','dateOfOnSetWeek'])['suspectedValue'].agg(['sum']).reset_index()
 					dfSuspected.rename(columns={'sum':'suspectedValue' },inplace=True)
+					dfDeaths = combinedDf.groupby(['ouname','ou','disease','dateOfOnSetWeek'])['deathValue'].agg(['sum']).reset_index()
+					dfDeaths.rename(columns={'sum':'deathValue' },inplace=True)
 					dfFirstAndLastCaseDate = df.groupby(['ouname','ou','disease'])['dateOfOnSet'].agg(['min','max']).reset_index()
 					dfFirstAndLastCaseDate.rename(columns={'min':'firstCaseDate','max':'lastCaseDate'},inplace=True)
 
-					aggDf = pd.merge(dfConfirmed,dfSuspected,on=['ouname','ou','disease','dateOfOnSetWeek'],how='left').merge(dfFirstAndLastCaseDate,on=['ouname','ou','disease'],how='left')
-					aggDf['reportingOrgUnitName'] = aggDf.loc[:,'ou'].apply(self.getOrgUnitValue,args=(orgUnits,(reportingLevel-1),'name'))
-					aggDf['reportingOrgUnit'] = aggDf.loc[:,'ou'].apply(self.getOrgUnitValue,args=(orgUnits,(reportingLevel-1),'id'))
+					aggDf = pd.merge(dfConfirmed,dfSuspected,on=['ouname','ou','disease','dateOfOnSetWeek'],how='left').merge(dfDeaths,on=['ouname','ou','disease','dateOfOnSetWeek'],how='left').merge(dfFirstAndLastCaseDate,on=['ouname','ou','disease'],how='left')
+					aggDf['reportingOrgUnitName'] = orgUnits.mapValues(aggDf.loc[:,'ou'],reportingLevel,'name')
+					aggDf['reportingOrgUnit'] = orgUnits.mapValues(aggDf.loc[:,'ou'],reportingLevel,'id')
 					aggDf['incubationDays'] = int(diseaseMeta['incubationDays'])
-					aggDf['endDate'] = pd.to_datetime(pd.to_datetime(dfDates['lastCaseDate']) + pd.to_timedelta(pd.np.ceil(2*aggDf['incubationDays']), unit="D")).dt.strftime('%Y-%m-%d')
-					aggDf['reminderDate'] = pd.to_datetime(pd.to_datetime(aggDf['lastCaseDate']) + pd.to_timedelta(pd.np.ceil(2*aggDf['incubationDays']-7), unit="D")).dt.strftime('%Y-%m-%d')
+					aggDf['endDate'] = pd.to_datetime(pd.to_datetime(aggDf['lastCaseDate']) + pd.to_timedelta(np.ceil(2*aggDf['incubationDays']), unit="D")).dt.strftime('%Y-%m-%d')
+					aggDf['reminderDate'] = pd.to_datetime(pd.to_datetime(aggDf['lastCaseDate']) + pd.to_timedelta(np.ceil(2*aggDf['incubationDays']-7), unit="D")).dt.strftime('%Y-%m-%d')
 					aggDf.rename(columns={'ouname':'orgUnitName','ou':'orgUnit'},inplace=True);
-					aggDf[['active']] =  aggDf.apply(self.getStatus,args=['active'],axis=1)
-					aggDf[['reminder']] =  aggDf.apply(self.getStatus,args=['reminder'],axis=1)
+					aggDf['orgUnitCode'] = aggDf['orgUnit'].map(orgUnits.codes)
+					# Outbreaks are keyed on the week of onset
+					aggDf['period'] = aggDf['dateOfOnSetWeek']
+					aggDf['active'] = self.getStatus(aggDf,'active')
+					aggDf['reminder'] = self.getStatus(aggDf,'reminder')
 
 				else:
 					df1 = df.iloc[:,(detectionLevel+4):dfColLength]
@@ -637,17 +855,17 @@ class IdsrAppServer:
 						dfDates = self.createDataFrame(dateData,'DATES')
 						dfDates.to_csv('aggDfDates.csv',encoding='utf-8')
 						dfDates.rename(columns={dfDates.columns[7]:'disease',dfDates.columns[8]:'dateOfOnSet'},inplace=True)
-						dfDates['dateOfOnSet'] = dfDates.apply(self.getTeiOnSetDate,axis=1)
+						dfDates['dateOfOnSet'] = self.getTeiOnSetDates(dfDates)
 						dfDates = dfDates.groupby(['ou','disease'])['dateOfOnSet'].agg(['min','max']).reset_index()
 						dfDates.rename(columns={'min':'firstCaseDate','max':'lastCaseDate'},inplace=True)
 						df = pd.merge(df,dfDates,right_on=['ou'],left_on=['organisationunitid'],how='left')
 						df['incubationDays'] = int(diseaseMeta['incubationDays'])
-						df['endDate'] = pd.to_datetime(pd.to_datetime(df['lastCaseDate']) + pd.to_timedelta(pd.np.ceil(2*df['incubationDays']), unit="D")).dt.strftime('%Y-%m-%d')
-						df['reminderDate'] = pd.to_datetime(pd.to_datetime(df['lastCaseDate']) + pd.to_timedelta(pd.np.ceil(2*df['incubationDays']-7), unit="D")).dt.strftime('%Y-%m-%d')
+						df['endDate'] = pd.to_datetime(pd.to_datetime(df['lastCaseDate']) + pd.to_timedelta(np.ceil(2*df['incubationDays']), unit="D")).dt.strftime('%Y-%m-%d')
+						df['reminderDate'] = pd.to_datetime(pd.to_datetime(df['lastCaseDate']) + pd.to_timedelta(np.ceil(2*df['incubationDays']-7), unit="D")).dt.strftime('%Y-%m-%d')
 						df.dropna(subset=['disease'],inplace=True)
 
-						df[['active']] =  df.apply(self.getStatus,args=['active'],axis=1)
-						df[['reminder']] =  df.apply(self.getStatus,args=['reminder'],axis=1)
+						df['active'] = self.getStatus(df,'active')
+						df['reminder'] = self.getStatus(df,'reminder')
 
 
 					else:
@@ -656,13 +874,18 @@ class IdsrAppServer:
 					df.rename(columns={df.columns[11]:'deathValue' },inplace=True)
 					df.rename(columns={df.columns[12]:'suspectedValue' },inplace=True)
 					df['reportingOrgUnitName'] = df.iloc[:,reportingLevel-1]
-					df['reportingOrgUnit'] = df.loc[:,'organisationunitid'].apply(self.getOrgUnitValue,args=(orgUnits,(reportingLevel-1),'id'))
+					df['reportingOrgUnit'] = orgUnits.mapValues(df.loc[:,'organisationunitid'],reportingLevel,'id')
 					df.rename(columns={'organisationunitname':'orgUnitName','organisationunitid':'orgUnit'},inplace=True);
 					df['dateOfOnSetWeek'] = self.getIsoWeek(self.today)
 					df["period"]= df['dateOfOnSetWeek']
 					#df['disease'] = diseaseMeta['disease']
 					aggDf = df
 
+				# A confirmed case was a suspected case first: the suspected count is at least the
+				# confirmed count, as getEpidemics already counts it when an outbreak is updated.
+				# New outbreaks are counted the same way so that they are not changed by the first
+				# run that finds them again, and confirmed cases reaching the alert threshold raise an alert
+				aggDf['suspectedValue'] = self.getCaseStatus(aggDf,'SUSPECTED')
 				aggDf['alertThreshold'] = int(diseaseMeta['alertThreshold'])
 				aggDf['epiThreshold'] = int(diseaseMeta['epiThreshold'])
 
@@ -721,35 +944,27 @@ class IdsrAppServer:
 		else:
 			pass
 		return event
+	# Index open epidemics by keys, built once per run from the stored epidemics
+	# Open epidemics have no closeDate, the first stored epidemic of each key is kept
+	def createOpenEpidemicsIndex(self,check='epicode',keys=['disease','orgUnit']):
+		openEpidemics = pd.DataFrame(self.getStateStore().getOpen('epidemics'),columns=['disease','orgUnit','epicode'])
+		if openEpidemics.empty:
+			return pd.DataFrame(columns=keys + [check]).set_index(keys)
+		openEpidemics = openEpidemics.sort_values(keys,kind='mergesort').drop_duplicates(subset=keys,keep='first')
+		return openEpidemics.set_index(keys)[[check]]
+
 	# Replace existing outbreak code in the new epidemics for tracking
 	'''
 	check is the column to track e.g outbreak code
 	keys is the columns to use as keys and must be a list
-	row is the row in the dataFrame
-	append is the column to use as a append column
-	df is the dataframe to compare with
+	df is the dataFrame of new epidemics
+	openEpidemics is the index of open epidemics to compare with
 	'''
-	def trackEpidemics(self,row=None,df=None,check=None,keys=None,append=None):
-		if row is not None:
-			# filter by keys and not closed
-			query = ['{}{}{}{}'.format(key,' in "',row[key],'"') for key in keys]
-			query = ' and '.join(query)
-			query = '{}{}'.format(query,' and closeDate == ""')
-			if df.empty:
-				return self.generateCode(prefix='E',sep='_')
-			else:
-				filteredDf = df.query(query).sort_values(keys,inplace=True)
-				if filteredDf is None:
-					return self.generateCode(column=row[append],prefix='E',sep='_')
-				else:
-					checked =  [filteredDf.at[index,check] for index in filteredDf.index]
-					if len(checked) > 0:
-						row[check] = checked[0]
-					else:
-						row[check] = self.generateCode(column=row[append],prefix='E',sep='_')
-					return row[check]
-		else:
-			return self.generateCode(prefix='E',sep='_')
+	# Returns the carried over codes, missing when there is none. Codes are then generated in one batch
+	def trackEpidemics(self,df=None,openEpidemics=None,check='epicode',keys=['disease','orgUnit']):
+		if df.empty or openEpidemics.empty:
+			return pd.Series(None,index=df.index,dtype=object)
+		return df[keys].join(openEpidemics,on=keys)[check]
 
 
 	# Remove existing  and update with new from data store epidemics
@@ -778,7 +993,7 @@ class IdsrAppServer:
 
 	def getRootOrgUnit(self):
 		root = {};
-		root = self.getHttpData(self.url,'organisationUnits',self.username,self.password,params={"paging":"false","filter":"level:eq:1"})
+		root = self.getCachedHttpData('rootOrgUnit','rootOrgUnit','organisationUnits',{"paging":"false","filter":"level:eq:1"})
 		return root['organisationUnits']
 	# Drop columns
 	def dropColumns(self,df=None,columns=None):
@@ -787,19 +1002,19 @@ class IdsrAppServer:
 		else:
 			deleteColumns =[]
 		return deleteColumns
-	# Get epidemics
-	def getEpidemics(self,programConfig=None,detectedAggEpidemics=None,detectedMergedAlertsMessage=None,dfEpidemics=None,messageColumns=None,alertColumns=None,type='EPIDEMIC',notify=None):
+	# Get new and updated epidemics
+	# Detections are only merged with the stored outbreaks of the same orgUnit, disease and period,
+	# stored outbreaks that were not detected again are left in the state store
+	# @param kind outbreaks in the state store the detections are merged with, epidemics or alerts
+	def getEpidemics(self,programConfig=None,detectedAggEpidemics=None,detectedMergedAlertsMessage=None,kind='epidemics',messageColumns=None,alertColumns=None,type='EPIDEMIC',notify=None,openEpidemics=None):
 		# New epidemics only
 		newEpidemics = pd.DataFrame()
 		# updated epidemics only
 		updatedEpidemics = pd.DataFrame()
-		# Existing epidemics only
-		existsEpidemics = pd.DataFrame()
-		if dfEpidemics.empty is not True:
-			dfEpidemics['period'] =pd.to_datetime(dfEpidemics['firstCaseDate']).dt.strftime('%YW%V')
 		if detectedAggEpidemics.empty:
 			print("Nothing to update or detect. Proceeding to next disease")
 			return
+		dfEpidemics = self.getStoredEpidemics(kind,detectedAggEpidemics)
 		allAggEpidemics = self.getDfUpdatedEpidemics(dfEpidemics,detectedAggEpidemics,mergeColumns=['orgUnit','disease','period'],how='outer',track=True,epidemic=False)
 		remindersQuery = "{}{}{}'".format("reminderDate", "=='", self.today)
 		# New epidemics
@@ -807,31 +1022,19 @@ class IdsrAppServer:
 			newEpidemics = allAggEpidemics.query("_merge == 'right_only'")
 			newEpidemics.drop(list(newEpidemics.filter(regex = '_left')), axis = 1, inplace = True)
 			newEpidemics.columns = newEpidemics.columns.str.replace('_right', '')
-			# Existing epidemics and not updated
-			existsEpidemics = allAggEpidemics.query("_merge == 'left_only'")
-			existsEpidemics.drop(list(existsEpidemics.filter(regex = '_right')), axis = 1, inplace = True)
-			existsEpidemics.columns = existsEpidemics.columns.str.replace('_left', '')
 			# Updated epidemics
 			updatedEpidemics =allAggEpidemics.query("_merge == 'both'")
 			# Drop duplicated columns
 			newEpidemics = newEpidemics.loc[:,~newEpidemics.columns.duplicated()]
 			updatedEpidemics = updatedEpidemics.loc[:,~updatedEpidemics.columns.duplicated()]
-			existsEpidemics = existsEpidemics.loc[:,~existsEpidemics.columns.duplicated()]
 		if '_merge' not in allAggEpidemics.columns:
 			newEpidemics = allAggEpidemics
 
 
 		print("Number of New Epidemics ", len(newEpidemics.index))
 		if( len(newEpidemics.index) > 0):
-			epiCodesFields = "system/id"
-			epiCodesParams = { "limit" : len(newEpidemics.index) }
-
-			epiCodes = self.getHttpData(self.url,epiCodesFields,self.username,self.password,params=epiCodesParams)
-			if(epiCodes != 'HTTP_ERROR'):
-				epiCodesUids = epiCodes['codes']
-				newEpidemics['event'] = epiCodesUids
-			else:
-				print("Failed to generated DHIS2 UID codes")
+			existingUids = self.getStateStore().getValues(kind,'event')
+			newEpidemics['event'] = self.generateUids(len(newEpidemics.index),existing=existingUids)
 		else:
 			print("Exiting no new outbreaks detected")
 		print("Detecting and updating Outbreaks .... ")
@@ -842,14 +1045,15 @@ class IdsrAppServer:
 			else:
 				pass
 		if updatedEpidemics.empty is not True:
+			# Stored and detected values are merged for epidemics and alerts alike
+			updatedEpidemics['confirmedValue']= self.getCaseStatus(updatedEpidemics,'CONFIRMED')
+			updatedEpidemics['suspectedValue']= self.getCaseStatus(updatedEpidemics,'SUSPECTED')
+			updatedEpidemics['deathValue']= self.getCaseStatus(updatedEpidemics,'DEATH')
+			updatedEpidemics.drop(list(updatedEpidemics.filter(regex = '_right')), axis = 1, inplace = True)
+			deleteColumns = self.dropColumns(df=updatedEpidemics.columns,columns=['confirmedValue_left','suspectedValue_left','deathValue_left'])
+			updatedEpidemics.drop(columns=deleteColumns,inplace=True)
+			updatedEpidemics.columns = updatedEpidemics.columns.str.replace('_left', '')
 			if type == 'EPIDEMIC':
-				updatedEpidemics['confirmedValue']= updatedEpidemics.apply(self.getCaseStatus,args=(updatedEpidemics.columns,'CONFIRMED'),axis=1)
-				updatedEpidemics['suspectedValue']=updatedEpidemics.apply(self.getCaseStatus,args=(updatedEpidemics.columns,'SUSPECTED'),axis=1)
-				updatedEpidemics['deathValue']=updatedEpidemics.apply(self.getCaseStatus,args=(updatedEpidemics.columns,'DEATH'),axis=1)
-				updatedEpidemics.drop(list(updatedEpidemics.filter(regex = '_right')), axis = 1, inplace = True)
-				deleteColumns = self.dropColumns(df=updatedEpidemics.columns,columns=['confirmedValue_left','suspectedValue_left','deathValue_left'])
-				updatedEpidemics.drop(columns=deleteColumns,inplace=True)
-				updatedEpidemics.columns = updatedEpidemics.columns.str.replace('_left', '')
 				updatedEpidemics['dataValues'] = updatedEpidemics.apply( self.createEventDatavalues,args=(config,updatedEpidemics.columns),axis=1);
 			else:
 				pass
@@ -866,184 +1070,213 @@ class IdsrAppServer:
 				newEpidemics.loc[:,'program'] = str(programConfig['reportingProgram']['id'])
 				newEpidemics.loc[:,'programStage'] = str(programConfig['reportingProgram']['programStage']['id'])
 				newEpidemics.loc[:,'storedBy'] = 'idsr'
-				newEpidemics['epicode']=newEpidemics.apply(self.trackEpidemics,args=(dfEpidemics,'epicode',['disease','orgUnit'],'orgUnitCode'),axis=1)
+				if openEpidemics is None:
+					openEpidemics = self.createOpenEpidemicsIndex()
+				newEpidemics['epicode'] = self.trackEpidemics(newEpidemics,openEpidemics,'epicode',['disease','orgUnit'])
+				untracked = newEpidemics['epicode'].isna()
+				if untracked.any():
+					newEpidemics.loc[untracked,'epicode'] = self.generateCodes(newEpidemics.loc[untracked],'orgUnitCode','E','_',existing=self.getEpicodes())
 				newEpidemics['dataValues'] = newEpidemics.apply( self.createEventDatavalues,args=(config,newEpidemics.columns),axis=1)
 				#newEpidemics = newEpidemics.loc[:,~newEpidemics.columns.duplicated()]
 				detectedNewEpidemicsAlertsMessage = newEpidemics.filter(alertColumns)
 				detectedNewEpidemicsAlertsMessage[messageColumns] = detectedNewEpidemicsAlertsMessage.apply(self.createMessage,args=(notify,'EPIDEMIC'),axis=1)
+				detectedNewEpidemicsAlertsMessage['messageType'] = 'EPIDEMIC'
 			else:
 				#newEpidemics = newEpidemics.loc[:,~newEpidemics.columns.duplicated()]
 				detectedNewEpidemicsAlertsMessage = newEpidemics.filter(alertColumns)
 				detectedNewEpidemicsAlertsMessage[messageColumns] = detectedNewEpidemicsAlertsMessage.apply(self.createMessage,args=(notify,'ALERT'),axis=1)
+				detectedNewEpidemicsAlertsMessage['messageType'] = 'ALERT'
 			#mergedAlerts = pd.concat([detectedNewEpidemicsAlerts],sort=False)
 			detectedMergedAlertsMessage = detectedMergedAlertsMessage.append(detectedNewEpidemicsAlertsMessage)
-		# Merge updated, new and existing epidemics
-		mergedEpidemics = pd.concat([existsEpidemics,updatedEpidemics,newEpidemics],sort=False)
+		# Merge updated and new epidemics
+		mergedEpidemics = pd.concat([updatedEpidemics,newEpidemics],sort=False)
 		return [mergedEpidemics,detectedMergedAlertsMessage]
 
-	def iterateDiseases(self,diseasesMeta,epidemics,alerts,type):
-		newUpdatedEpis = []
-		existingAlerts = alerts
-		existingEpidemics = epidemics
-		programConfig = diseasesMeta['config']
+	# Detect epidemics and alerts for a single disease
+	# Raises Dhis2Error when the cases or indicators could not be retrieved
+	# @return [mergedAlerts,mergedEpidemics,alertsMessage] or None for an unknown algorithm
+	def detectDisease(self,diseaseMeta,programConfig,rootOrgUnit,openEpidemics,type):
 		mPeriods = programConfig['mPeriods']
 		nPeriods = programConfig['nPeriods']
+		programStartDate = periods.addDays(self.today,-8)
+		# Merged alerts, epidemics and messages for this disease
+		detectedMergedAlerts = pd.DataFrame()
+		detectedMergedEpidemics = pd.DataFrame()
+		detectedMergedAlertsMessage = pd.DataFrame()
+		alertColumns = self.alertColumns
+		messageColumns = self.messageColumns
+
+		disease = diseaseMeta['disease']
+		ouLevel = 'LEVEL-' + str(diseaseMeta['detectionLevel'])
+		with self.metrics.stage('orgUnits',disease):
+			orgUnitIndex = self.getOrgUnitIndex(int(diseaseMeta['detectionLevel']))
+		piSeparator =';'
+		piIndicatorsArray = self.getArrayFromObject(diseaseMeta['programIndicators'])
+		piIndicators = piSeparator.join(piIndicatorsArray)
+		piFields = 'analytics'
+		notifyUser = diseaseMeta['notifiableUserGroups']
+		if diseaseMeta['epiAlgorithm'] == "CASE_BASED":
+			print("Detecting for case based diseases")
+			print ("Start outbreak detection for %s" %diseaseMeta['disease'])
+			#LAST_7_DAYS
+
+			eventsFields = 'analytics/events/query/' + self.programUid
+			teiFields = 'trackedEntityInstances/query'
+			# Get first case date: min and max is always the last case date registered
+			### Get Cases or Disease Events
+			#
+			caseEventParams = { "dimension": ['pe:' + self.period,'ou:' + ouLevel,self.dateOfOnsetUid,self.conditionOrDiseaseUid + ":IN:" + diseaseMeta["code"],self.patientStatusOutcome,self.regPatientStatusOutcome,self.caseClassification,self.testResult,self.testResultClassification],"displayProperty":"NAME"}
+			piEventParams = {"dimension": ["dx:"+ piIndicators,"ou:" + ouLevel],"filter": "pe:" + self.period,"displayProperty":"NAME","columns":"dx","rows":"ou","skipMeta":"false","hideEmptyRows":"true","skipRounding":"false","showHierarchy":"true"}
+
+			cDisease = programConfig["notificationProgram"]["disease"]["id"]+":IN:" + diseaseMeta["code"]
+			cOnset = programConfig["notificationProgram"]["dateOfOnSet"]["id"]
+			rootOrgUnitId = rootOrgUnit[0]["id"]
+
+			teiParams = {"ou":rootOrgUnitId,"program":self.programUid,"ouMode":"DESCENDANTS","programStatus":"ACTIVE","attribute": [cDisease,cOnset] ,"programStartDate":programStartDate,"skipPaging":"true"}
+
+			try:
+				with self.metrics.stage('fetch',disease):
+					if(type =='EVENT'):
+						caseEvents = self.getPagedTable(eventsFields,caseEventParams,'dimension')
+					if(type =='ANALYTICS'):
+						caseEvents = self.getHttpTable(self.url,piFields,self.username,self.password,params=piEventParams)
+					dateData = self.getPagedTable(teiFields,teiParams,'ou')
+			except Dhis2Error as e:
+				print("Failed to retrieve case events from analytics: ",e)
+				raise
+			self.metrics.countRows('fetch',0,self.getRowCount(caseEvents) + self.getRowCount(dateData),disease)
+			with self.metrics.stage('detect',disease):
+				detectedAggEpidemics = self.detectBasedOnProgramIndicators(caseEvents,diseaseMeta,orgUnitIndex,type,dateData,programConfig.get('classificationValues'))
+			self.metrics.countRows('detect',self.getRowCount(caseEvents),self.getRowCount(detectedAggEpidemics),disease)
+
+		elif diseaseMeta['epiAlgorithm'] == "SEASONAL" or diseaseMeta['epiAlgorithm'] == "NON_SEASONAL":
+			print("Detecting for " + diseaseMeta['epiAlgorithm'].lower().replace('_','-'))
+			print ("Start outbreak detection for %s" %diseaseMeta['disease'])
+			# periods are aggregate generated
+			aggPeriod = self.createAggThresholdPeriod(mPeriods,nPeriods,diseaseMeta['epiAlgorithm'])
+			# Only periods missing from the baseline store or still open to revision are fetched
+			detectionLevel = int(diseaseMeta['detectionLevel'])
+			fetchPeriods = self.getBaselineFetchPeriods(piIndicatorsArray,detectionLevel,aggPeriod,diseaseMeta['epiAlgorithm'],mPeriods,nPeriods)
+			aggPeriods = piSeparator.join(fetchPeriods)
+
+			aggParams = {"dimension": ["dx:"+ piIndicators,"ou:" + ouLevel,"pe:" + aggPeriods],"displayProperty":"NAME","tableLayout":"true","columns":"dx;pe","rows":"ou","skipMeta":"false","hideEmptyRows":"true","skipRounding":"false","showHierarchy":"true"}
+
+			try:
+				with self.metrics.stage('fetch',disease):
+					aggIndicators = self.getHttpTable(self.url,piFields,self.username,self.password,params=aggParams)
+			except Dhis2Error as e:
+				print("Failed to retrieve aggregate indicators from analytics: ",e)
+				raise
+			with self.metrics.stage('baselines',disease):
+				aggData = self.mergeBaselines(aggIndicators,piIndicatorsArray,detectionLevel,aggPeriod,fetchPeriods)
+			self.metrics.countRows('fetch',0,self.getRowCount(aggIndicators),disease)
+			self.metrics.countRows('baselines',self.getRowCount(aggIndicators),self.getRowCount(aggData),disease)
+			with self.metrics.stage('detect',disease):
+				detectedAggEpidemics = self.detectOnAggregateIndicators(aggData,diseaseMeta,orgUnitIndex,aggPeriod,mPeriods,nPeriods)
+			self.metrics.countRows('detect',self.getRowCount(aggData),self.getRowCount(detectedAggEpidemics),disease)
+		else:
+			return None
+
+		detectedAggAlerts = self.queryValue(detectedAggEpidemics,"alert == 'true'")
+		# Creating epidemics alerts
+		with self.metrics.stage('getEpidemics.alerts',disease):
+			mergedAlerts =self.getEpidemics(programConfig=programConfig,detectedAggEpidemics=detectedAggAlerts,detectedMergedAlertsMessage=detectedMergedAlertsMessage,kind='alerts',messageColumns=messageColumns,alertColumns=alertColumns,type='ALERT',notify=notifyUser)
+		if mergedAlerts is not None:
+			detectedMergedAlertsMessage = mergedAlerts[1]
+			detectedMergedAlerts =  detectedMergedAlerts.append(mergedAlerts[0])
+		self.metrics.countRows('getEpidemics.alerts',self.getRowCount(detectedAggAlerts),self.getRowCount(detectedMergedAlerts),disease)
+		# Creating threshold alerts
+		with self.metrics.stage('getEpidemics.epidemics',disease):
+			mergedEpidemics =self.getEpidemics(programConfig=programConfig,detectedAggEpidemics=detectedAggEpidemics,detectedMergedAlertsMessage=detectedMergedAlertsMessage,kind='epidemics',messageColumns=messageColumns,alertColumns=alertColumns,notify=notifyUser,openEpidemics=openEpidemics)
+		if mergedEpidemics is not None:
+			detectedMergedEpidemics = detectedMergedEpidemics.append(mergedEpidemics[0])
+			detectedMergedAlertsMessage = mergedEpidemics[1]
+		self.metrics.countRows('getEpidemics.epidemics',self.getRowCount(detectedAggEpidemics),self.getRowCount(detectedMergedEpidemics),disease)
+		self.metrics.addDiseaseTotal(disease,'detected',self.getRowCount(detectedAggEpidemics))
+		self.metrics.addDiseaseTotal(disease,'alerts',self.getRowCount(detectedMergedAlerts))
+		self.metrics.addDiseaseTotal(disease,'epidemics',self.getRowCount(detectedMergedEpidemics))
+		self.metrics.addDiseaseTotal(disease,'messages',self.getRowCount(detectedMergedAlertsMessage))
+		print ("Finished creating Outbreaks for %s" %diseaseMeta['disease'])
+		# Reminders
+		#reminders = self.queryValue(allAggEpidemics,remindersQuery)
+		return [detectedMergedAlerts,detectedMergedEpidemics,detectedMergedAlertsMessage]
+
+	# Run detectDisease and keep a failing disease from aborting the others
+	# @return [detected,error], error is None when the detection completed
+	def detectDiseaseSafely(self,diseaseMeta,*args):
+		started = time.perf_counter()
+		error = None
+		try:
+			detected = self.detectDisease(diseaseMeta,*args)
+		except Exception as e:
+			print("Failed outbreak detection for %s: %r" %(diseaseMeta.get('disease'),e))
+			detected = None
+			error = str(e)
+		self.metrics.addDiseaseTotal(diseaseMeta.get('disease'),'seconds',time.perf_counter() - started)
+		self.metrics.addDiseaseTotal(diseaseMeta.get('disease'),'completed',0 if detected is None else 1)
+		return [detected,error]
+
+	# Run detection for all diseases, concurrently when more than one worker is configured
+	# [detected,error] of each disease are returned in the order of the diseases
+	def detectDiseases(self,diseases,*args):
+		if self.workers <= 1 or len(diseases) <= 1:
+			return [self.detectDiseaseSafely(diseaseMeta,*args) for diseaseMeta in diseases]
+		with ThreadPoolExecutor(max_workers=min(self.workers,len(diseases))) as executor:
+			futures = [executor.submit(self.detectDiseaseSafely,diseaseMeta,*args) for diseaseMeta in diseases]
+			return [future.result() for future in futures]
+
+	# Messages left from previous runs are sent while detecting, the worker is stopped even when detection fails
+	# @return error of each disease by name, None for the diseases that completed
+	def iterateDiseases(self,diseasesMeta,epidemics,alerts,type):
+		dispatcher = self.getNotificationDispatcher()
+		dispatcher.start()
+		try:
+			return self.processDiseases(diseasesMeta,epidemics,alerts,type)
+		finally:
+			print("Sending queued messages")
+			with self.metrics.stage('sendMessages'):
+				dispatcher.stop(timeout=self.notificationDrainTimeout)
+
+	def processDiseases(self,diseasesMeta,epidemics,alerts,type):
+		programConfig = diseasesMeta['config']
 		rootOrgUnit = self.getRootOrgUnit()
-		programStartDate = moment.date(self.today).subtract(days=8)
-		programStartDate = moment.date(programStartDate).format('YYYY-MM-DD')
-		# Epidemics in the datastore
-		dfEpidemics = self.createDataFrame(epidemics)
-		# Alerts in the datastore
-		dfAlerts = self.createDataFrame(alerts)
-		# New epidemics only
-		detectedNewEpidemics = pd.DataFrame()
-		# updated epidemics only
-		detectedUpdatedEpidemics = pd.DataFrame()
-		# Existing epidemics only
-		detectedExistingEpidemics = pd.DataFrame()
+		# Epidemics and alerts in the datastore are loaded in the state store when they changed since the last run
+		stateStore = self.getStateStore()
+		# Partitioned datastores are synced by partition read, a single key holds all the records of its kind
+		with self.metrics.stage('syncState'):
+			for kind,records in [('epidemics',epidemics),('alerts',alerts)]:
+				partitions = None
+				if self.datastoreLayout == 'partitioned':
+					partitions = (self.epidemicsStore if kind == 'epidemics' else self.alertsStore).loaded
+				loaded = stateStore.sync(kind,records,self.getEpiYears()[0],partitions)
+				if len(loaded) > 0:
+					print("Loaded {} partitions of {} from the datastore in the state store".format(len(loaded),kind))
 		# Combine Existing,new and updated epidemics
 		detectedMergedEpidemics = pd.DataFrame()
 		# Combine Existing,new and updated alerts
 		detectedMergedAlerts = pd.DataFrame()
 		# New alerts messages
 		detectedMergedAlertsMessage = pd.DataFrame()
-		alertColumns = ['disease','orgUnit','orgUnitName','reportingOrgUnit','reportingOrgUnitName','confirmedValue','deathValue','suspectedValue','event','period','lastCaseDate','firstCaseDate','epicode','epidemic','alert','status']
-		messageColumns = ['subject','text','users','organisationUnits']
-
-		for diseaseMeta in diseasesMeta['diseases']:
-
-			ouLevel = 'LEVEL-' + str(diseaseMeta['detectionLevel'])
-			detectionXLevel = diseaseMeta['detectionLevel']
-			ouFields = 'organisationUnits'
-			ouParams = {"fields": "id,code,ancestors[id,code,name]","paging":"false","filter":"level:eq:"+ str(detectionXLevel)}
-			epiReportingOrgUnit	= self.getHttpData(self.url,ouFields,self.username,self.password,params=ouParams)
-			piSeparator =';'
-			piIndicatorsArray = self.getArrayFromObject(diseaseMeta['programIndicators'])
-			piIndicators = piSeparator.join(piIndicatorsArray)
-			piFields = 'analytics'
-			notifyUser = diseaseMeta['notifiableUserGroups']
-			if diseaseMeta['epiAlgorithm'] == "CASE_BASED":
-				print("Detecting for case based diseases")
-				print ("Start outbreak detection for %s" %diseaseMeta['disease'])
-				#LAST_7_DAYS
-
-				eventsFields = 'analytics/events/query/' + self.programUid
-				piFields = 'analytics'
-				teiFields = 'trackedEntityInstances/query'
-				# Get first case date: min and max is always the last case date registered
-				### Get Cases or Disease Events
-				#
-				caseEventParams = { "dimension": ['pe:' + self.period,'ou:' + ouLevel,self.dateOfOnsetUid,self.conditionOrDiseaseUid + ":IN:" + diseaseMeta["code"],self.patientStatusOutcome,self.regPatientStatusOutcome,self.caseClassification,self.testResult,self.testResultClassification],"displayProperty":"NAME"}
-				piEventParams = {"dimension": ["dx:"+ piIndicators,"ou:" + ouLevel],"filter": "pe:" + self.period,"displayProperty":"NAME","columns":"dx","rows":"ou","skipMeta":"false","hideEmptyRows":"true","skipRounding":"false","showHierarchy":"true"}
-
-				cDisease = programConfig["notificationProgram"]["disease"]["id"]+":IN:" + diseaseMeta["code"]
-				cOnset = programConfig["notificationProgram"]["dateOfOnSet"]["id"]
-				rootOrgUnitId = rootOrgUnit[0]["id"]
-
-				teiParams = {"ou":rootOrgUnitId,"program":self.programUid,"ouMode":"DESCENDANTS","programStatus":"ACTIVE","attribute": [cDisease,cOnset] ,"programStartDate":programStartDate,"skipPaging":"true"}
-
-				if(type =='EVENT'):
-					caseEvents = self.getHttpData(self.url,eventsFields,self.username,self.password,params=caseEventParams)
-				if(type =='ANALYTICS'):
-					caseEvents = self.getHttpData(self.url,piFields,self.username,self.password,params=piEventParams)
-				if(( caseEvents != 'HTTP_ERROR') and (epiReportingOrgUnit != 'HTTP_ERROR')):
-					orgUnits = epiReportingOrgUnit['organisationUnits']
-					dateData = self.getHttpData(self.url,teiFields,self.username,self.password,params=teiParams)
-					detectedAggEpidemics = self.detectBasedOnProgramIndicators(caseEvents,diseaseMeta,orgUnits,type,dateData)
-					detectedAggAlerts = self.queryValue(detectedAggEpidemics,"alert == 'true'")
-					# Creating epidemics alerts
-					mergedAlerts =self.getEpidemics(programConfig=programConfig,detectedAggEpidemics=detectedAggAlerts,detectedMergedAlertsMessage=detectedMergedAlertsMessage,dfEpidemics=dfAlerts,messageColumns=messageColumns,alertColumns=alertColumns,type='ALERT',notify=notifyUser)
-					if mergedAlerts is None:
-						return
-					detectedMergedAlertsMessage = mergedAlerts[1]
-					detectedMergedAlerts =  detectedMergedAlerts.append(mergedAlerts[0])
-					# Creating threshold alerts
-					mergedEpidemics =self.getEpidemics(programConfig=programConfig,detectedAggEpidemics=detectedAggEpidemics,detectedMergedAlertsMessage=detectedMergedAlertsMessage,dfEpidemics=dfEpidemics,messageColumns=messageColumns,alertColumns=alertColumns,notify=notifyUser)
-					if mergedEpidemics is None:
-						return
-					detectedMergedEpidemics = detectedMergedEpidemics.append(mergedEpidemics[0])
-					detectedMergedAlertsMessage = mergedEpidemics[1]
-					print ("Finished creating Outbreaks for %s" %diseaseMeta['disease'])
-					# Reminders
-					#reminders = self.queryValue(allAggEpidemics,remindersQuery)
-
-				else:
-					print("Failed to retrieve case events from analytics")
-
-			elif diseaseMeta['epiAlgorithm'] == "SEASONAL":
-				print("Detecting for seasonal")
-				print ("Start outbreak detection for %s" %diseaseMeta['disease'])
-				# periods are aggregate generated
-				aggPeriod = self.createAggThresholdPeriod(mPeriods,nPeriods,'SEASONAL')
-				aggPeriods = piSeparator.join(aggPeriod)
-
-				aggParams = {"dimension": ["dx:"+ piIndicators,"ou:" + ouLevel,"pe:" + aggPeriods],"displayProperty":"NAME","tableLayout":"true","columns":"dx;pe","rows":"ou","skipMeta":"false","hideEmptyRows":"true","skipRounding":"false","showHierarchy":"true"}
-
-				aggIndicators = self.getHttpData(self.url,piFields,self.username,self.password,params=aggParams)
-
-				if(( aggIndicators != 'HTTP_ERROR') and (epiReportingOrgUnit != 'HTTP_ERROR')):
-					aggData = aggIndicators
-					aggOrgUnit = epiReportingOrgUnit['organisationUnits']
-					detectedAggEpidemics = self.detectOnAggregateIndicators(aggData,diseaseMeta,epidemics,aggOrgUnit,aggPeriod,mPeriods,nPeriods)
-					detectedAggEpidemics.to_csv('detectedAggEpidemics.csv',encoding='utf-8')
-					detectedAggAlerts = self.queryValue(detectedAggEpidemics,"alert == 'true'")
-					# Creating epidemics alerts
-					mergedAlerts =self.getEpidemics(programConfig=programConfig,detectedAggEpidemics=detectedAggAlerts,detectedMergedAlertsMessage=detectedMergedAlertsMessage,dfEpidemics=dfAlerts,messageColumns=messageColumns,alertColumns=alertColumns,type='ALERT',notify=notifyUser)
-					if mergedAlerts is None:
-						return
-					detectedMergedAlertsMessage = mergedAlerts[1]
-					detectedMergedAlerts =  detectedMergedAlerts.append(mergedAlerts[0])
-					# Creating threshold alerts
-					mergedEpidemics =self.getEpidemics(programConfig=programConfig,detectedAggEpidemics=detectedAggEpidemics,detectedMergedAlertsMessage=detectedMergedAlertsMessage,dfEpidemics=dfEpidemics,messageColumns=messageColumns,alertColumns=alertColumns,notify=notifyUser)
-					if mergedEpidemics is None:
-						return
-					detectedMergedEpidemics = detectedMergedEpidemics.append(mergedEpidemics[0])
-					detectedMergedAlertsMessage = mergedEpidemics[1]
-					print ("Finished creating Outbreaks for %s" %diseaseMeta['disease'])
-					# Reminders
-					#reminders = self.queryValue(allAggEpidemics,remindersQuery)
-					### Send outbreak message
-
-
-				else:
-					print("Failed to retrieve case events from analytics")
-			elif diseaseMeta['epiAlgorithm'] == "NON_SEASONAL":
-				print("Detecting for non-seasonal")
-				print ("Start outbreak detection for %s" %diseaseMeta['disease'])
-				# periods are aggregate generated
-				aggPeriod = self.createAggThresholdPeriod(mPeriods,nPeriods,'NON_SEASONAL')
-				aggPeriods = piSeparator.join(aggPeriod)
-
-				aggParams = {"dimension": ["dx:"+ piIndicators,"ou:" + ouLevel,"pe:" + aggPeriods],"displayProperty":"NAME","tableLayout":"true","columns":"dx;pe","rows":"ou","skipMeta":"false","hideEmptyRows":"true","skipRounding":"false","showHierarchy":"true"}
-
-				aggIndicators = self.getHttpData(self.url,piFields,self.username,self.password,params=aggParams)
-
-				if(( aggIndicators != 'HTTP_ERROR') and (epiReportingOrgUnit != 'HTTP_ERROR')):
-					aggData = aggIndicators
-					aggOrgUnit = epiReportingOrgUnit['organisationUnits']
-					detectedAggEpidemics = self.detectOnAggregateIndicators(aggData,diseaseMeta,epidemics,aggOrgUnit,aggPeriod,mPeriods,nPeriods)
-					detectedAggAlerts = self.queryValue(detectedAggEpidemics,"alert == 'true'")
-					# Creating epidemics alerts
-					mergedAlerts =self.getEpidemics(programConfig=programConfig,detectedAggEpidemics=detectedAggAlerts,detectedMergedAlertsMessage=detectedMergedAlertsMessage,dfEpidemics=dfAlerts,messageColumns=messageColumns,alertColumns=alertColumns,type='ALERT',notify=notifyUser)
-					if mergedAlerts is None:
-						return
-					detectedMergedAlertsMessage = mergedAlerts[1]
-					detectedMergedAlerts =  detectedMergedAlerts.append(mergedAlerts[0])
-					# Creating threshold alerts
-					mergedEpidemics =self.getEpidemics(programConfig=programConfig,detectedAggEpidemics=detectedAggEpidemics,detectedMergedAlertsMessage=detectedMergedAlertsMessage,dfEpidemics=dfEpidemics,messageColumns=messageColumns,alertColumns=alertColumns,notify=notifyUser)
-					if mergedEpidemics is None:
-						return
-					detectedMergedEpidemics = detectedMergedEpidemics.append(mergedEpidemics[0])
-					detectedMergedAlertsMessage = mergedEpidemics[1]
-					print ("Finished creating Outbreaks for %s" %diseaseMeta['disease'])
-
-					# Reminders
-					#reminders = self.queryValue(allAggEpidemics,remindersQuery)
-					### Send outbreak messages
-				else:
-					print("Failed to retrieve case events from analytics")
-			else:
-				pass
+		alertColumns = self.alertColumns
+
+		# Open epidemics by disease and orgUnit for tracking outbreak codes
+		openEpidemics = self.createOpenEpidemicsIndex()
+
+		with self.metrics.stage('detectDiseases'):
+			detected = self.detectDiseases(diseasesMeta['diseases'],programConfig,rootOrgUnit,openEpidemics,type)
+		# Diseases with results, only their partitions are written
+		processedDiseases = set()
+		results = {}
+		# Merge in the order of the diseases so that results are deterministic
+		with self.metrics.stage('merge'):
+			for diseaseMeta,(diseaseDetected,error) in zip(diseasesMeta['diseases'],detected):
+				results[diseaseMeta['disease']] = error
+				if diseaseDetected is None:
+					continue
+				processedDiseases.add(diseaseMeta['disease'])
+				detectedMergedAlerts = detectedMergedAlerts.append(diseaseDetected[0])
+				detectedMergedEpidemics = detectedMergedEpidemics.append(diseaseDetected[1])
+				detectedMergedAlertsMessage = detectedMergedAlertsMessage.append(diseaseDetected[2])
 
 		# Transform mergedEpidemics to DHIS2 Events format
 		eventColumns = ['event','eventDate','program','programStage','storedBy','status','orgUnit','dataValues']
@@ -1054,14 +1287,37 @@ class IdsrAppServer:
 		except KeyError:
 			print("Key error in ", eventDropColumns)
 		dhis2Events = detectedMergedEpidemics.filter(eventColumns)
-		mergedEpidemicsEvents = detectedMergedEpidemics.filter(epidemicsColumns)
-		events = {'events': json.loads(dhis2Events.to_json(orient='records',date_format='iso'))}
+		events = json.loads(dhis2Events.to_json(orient='records',date_format='iso'))
+		epidemicsChanges = self.getStateChanges(detectedMergedEpidemics,epidemicsColumns)
+		with self.metrics.stage('saveState'):
+			stateStore.upsert('epidemics',epidemicsChanges,self.getEpiYears()[0])
 		print("Updating epidemics in the datastore online")
-		epiUpdateDataStoreEndPoint  = 'dataStore/' + self.dataStore + '/epidemics'
-		self.updateJsonData(self.url,epiUpdateDataStoreEndPoint,self.username,self.password,json.loads(mergedEpidemicsEvents.to_json(orient='records',date_format='iso')))
+		try:
+			with self.metrics.stage('saveEpidemics'):
+				mirrored = self.saveDatastoreMirror('epidemics',processedDiseases,epidemicsChanges)
+			self.metrics.countRows('saveEpidemics',len(epidemicsChanges),mirrored)
+		except Dhis2Error as e:
+			print("Failed to update epidemics in the datastore: ",e)
+			self.setFailed(results,processedDiseases,"Failed to update epidemics in the datastore: " + str(e))
 		print("Updating epidemics in the events online")
 		epiUpdateEventEndPoint  = 'events?importStrategy=CREATE_AND_UPDATE'
-		self.postJsonData(self.url,epiUpdateEventEndPoint,self.username,self.password,events)
+		totalEvents = len(events)
+		if self.useEventLedger:
+			with self.metrics.stage('eventLedger'):
+				events,eventHashes = self.getEventLedger().getChangedEvents(events)
+			self.metrics.countRows('eventLedger',totalEvents,len(events))
+			print("Posting {} new or changed of {} events".format(len(events),totalEvents))
+		eventImporter = EventImporter(lambda chunk: self.postJsonData(self.url,epiUpdateEventEndPoint,self.username,self.password,chunk),chunkSize=self.eventChunkSize,workers=self.importWorkers,retries=self.importRetries)
+		with self.metrics.stage('importEvents'):
+			importSummaries = eventImporter.importEvents(events)
+		importedEvents = eventImporter.getImportedEvents(events,importSummaries)
+		self.metrics.countRows('importEvents',len(events),len(importedEvents))
+		failedChunks = [summary['chunk'] for summary in importSummaries if summary['failed']]
+		if len(failedChunks) > 0:
+			print("Failed to update epidemics in the events for chunks: ",failedChunks)
+			self.setFailed(results,processedDiseases,"Failed to update epidemics in the events for chunks: " + str(failedChunks))
+		if self.useEventLedger:
+			self.getEventLedger().saveHashes({event['event']: eventHashes[event['event']] for event in importedEvents if event.get('event') is not None})
 		print ("Finished creating Outbreaks")
 		print("Sending alerts and messages")
 		try:
@@ -1069,67 +1325,246 @@ class IdsrAppServer:
 		except KeyError:
 			print("Key error in ",alertColumns)
 		if detectedMergedAlertsMessage.empty is not True:
-			messages = {'messageConversations': json.loads(detectedMergedAlertsMessage.to_json(orient='records')) }
-			self.sendSmsAndEmailMessage(messages)
+			with self.metrics.stage('queueMessages'):
+				queued = self.queueMessages(json.loads(detectedMergedAlertsMessage.to_json(orient='records')))
+			self.metrics.countRows('queueMessages',self.getRowCount(detectedMergedAlertsMessage),queued)
 		
-		mergedDataStoresMessages = detectedMergedAlerts.filter(alertColumns)
+		mergedDataStoresMessages = detectedMergedAlerts.filter(alertColumns + ['stateId'])
 		try:
 			mergedDataStoresMessages.drop_duplicates(subset=alertColumns,inplace=True)
 		except KeyError:
 			print("Key error in ",alertColumns)
+		alertsChanges = self.getStateChanges(mergedDataStoresMessages,alertColumns)
+		with self.metrics.stage('saveState'):
+			stateStore.upsert('alerts',alertsChanges,self.getEpiYears()[0])
 
 		print("Save alerts in the datastore online")
-		epiUpdateDataStoreEndPointAlert  = 'dataStore/' + self.dataStore + '/alerts'
-		self.updateJsonData(self.url,epiUpdateDataStoreEndPointAlert,self.username,self.password,json.loads(mergedDataStoresMessages.to_json(orient='records',date_format='iso')))
+		try:
+			with self.metrics.stage('saveAlerts'):
+				mirrored = self.saveDatastoreMirror('alerts',processedDiseases,alertsChanges)
+			self.metrics.countRows('saveAlerts',len(alertsChanges),mirrored)
+		except Dhis2Error as e:
+			print("Failed to save alerts in the datastore: ",e)
+			self.setFailed(results,processedDiseases,"Failed to save alerts in the datastore: " + str(e))
+		print("Done processing")
+		return results
+
+	# Record an error for diseases that did not fail before, their detections were not all saved
+	def setFailed(self,results,diseases,error):
+		for disease in diseases:
+			if results.get(disease) is None:
+				results[disease] = error
+
+	# None when the file cannot be read, settings are then loaded on every run
+	def getSettingsVersion(self):
+		try:
+			stat = os.stat(self.configFile)
+		except OSError:
+			return None
+		return (stat.st_mtime_ns,stat.st_size)
+
+	# Load settings when .idsr.json changed since they were last loaded, the caches stay warm otherwise
+	# @return True when the settings were loaded
+	def reloadSettings(self):
+		if self.settingsVersion is not None and self.getSettingsVersion() == self.settingsVersion:
+			return False
+		self.loadSettings()
+		return True
+
+	# Close the metadata cache and the stores of the local store file, they are opened again on first use
+	def closeStores(self):
+		for store in [self.metadataCache,self.baselineStore,self.stateStore,self.eventLedger]:
+			if store is not None:
+				store.close()
+		self.metadataCache = None
+		self.baselineStore = None
+		self.stateStore = None
+		self.eventLedger = None
+
+	# Read settings from .idsr.json
+	# The HTTP client is kept while the url, credentials, timeouts and retries are unchanged
+	# and the local stores while the store file and the cache TTLs are unchanged
+	def loadSettings(self):
+		settingsVersion = self.getSettingsVersion()
+		auth = self.getAuth()
+		self.settingsVersion = settingsVersion
+		self.username = auth['username']
+		self.password = auth['password']
+		self.url = auth['url']
+		self.workers = int(auth.get('workers',self.workers))
+		self.orgUnitIndexes = {}
+		self.timeouts = auth.get('timeouts')
+		self.retries = int(auth.get('retries',self.retries))
+		self.cassette = auth.get('cassette',self.cassette)
+		self.cassetteMode = auth.get('cassetteMode',self.cassetteMode)
+		self.replayLatency = auth.get('replayLatency',self.replayLatency)
+		clientSettings = json.dumps([self.url,self.username,self.password,self.timeouts,self.retries,self.workers,self.cassette,self.cassetteMode,self.replayLatency],sort_keys=True)
+		if clientSettings != self.clientSettings:
+			if self.client is not None:
+				self.client.close()
+			self.client = None
+			self.clientSettings = clientSettings
+		self.localStore = auth.get('localStore',self.localStore)
+		self.cacheTtls = auth.get('cacheTtls',self.cacheTtls)
+		self.refreshCache = bool(auth.get('refreshCache',self.refreshCache))
+		# The store file follows the url, caches of another file or with other TTLs are not kept
+		storeSettings = json.dumps([self.getLocalStorePath(),self.cacheTtls,self.refreshCache],sort_keys=True)
+		if storeSettings != self.storeSettings:
+			self.closeStores()
+			self.storeSettings = storeSettings
+		self.uidSource = auth.get('uidSource',self.uidSource)
+		self.useBaselineStore = bool(auth.get('baselineStore',self.useBaselineStore))
+		self.baselineRevisionWeeks = int(auth.get('baselineRevisionWeeks',self.baselineRevisionWeeks))
+		self.eventChunkSize = int(auth.get('eventChunkSize',self.eventChunkSize))
+		self.importWorkers = int(auth.get('importWorkers',self.importWorkers))
+		self.importRetries = int(auth.get('importRetries',self.importRetries))
+		self.useEventLedger = bool(auth.get('eventLedger',self.useEventLedger))
+		self.datastoreLayout = auth.get('datastoreLayout',self.datastoreLayout)
+		self.caseBasedDetection = auth.get('caseBasedDetection',self.caseBasedDetection)
+		self.notificationBatchSize = int(auth.get('notificationBatchSize',self.notificationBatchSize))
+		self.notificationRateLimit = float(auth.get('notificationRateLimit',self.notificationRateLimit))
+		self.notificationRetries = int(auth.get('notificationRetries',self.notificationRetries))
+		self.notificationDrainTimeout = float(auth.get('notificationDrainTimeout',self.notificationDrainTimeout))
+		if self.notificationDispatcher is not None:
+			self.notificationDispatcher.close()
+		self.notificationDispatcher = None
+		self.streamTables = bool(auth.get('streamTables',self.streamTables))
+		self.pageSize = int(auth.get('pageSize',self.pageSize))
+		self.pageWorkers = int(auth.get('pageWorkers',self.pageWorkers))
+		self.fanOutSubtrees = bool(auth.get('fanOutSubtrees',self.fanOutSubtrees))
+		self.useMetrics = bool(auth.get('metrics',self.useMetrics))
+		self.metricsDirectory = auth.get('metricsDirectory',self.metricsDirectory)
+		# Detection runs for a fixed day, e.g the day a replayed cassette was recorded
+		self.today = auth.get('today',self.today)
+		self.rng = None if auth.get('seed') is None else np.random.default_rng(int(auth['seed']))
+		return auth
+
+	# Get the diseases config from the datastore
+	def getDiseasesMeta(self):
+		diseaseFields = 'dataStore/' + self.dataStore + '/diseases'
+		return self.getCachedHttpData(diseaseFields,'diseases',diseaseFields,{})
 
-		return "Done processing"
+	# Keep the diseases to detect, by disease name or code
+	def filterDiseases(self,diseasesMeta,diseases=None):
+		if diseases is None:
+			return diseasesMeta
+		filteredMeta = dict(diseasesMeta)
+		filteredMeta['diseases'] = [diseaseMeta for diseaseMeta in diseasesMeta['diseases'] if diseaseMeta['disease'] in diseases or diseaseMeta.get('code') in diseases]
+		return filteredMeta
 
 		# Start epidemic detection
-	def startEpidemics(self):
+	# @param diseases names or codes of the diseases to detect, all when None
+	# @return error of each disease by name, None for the diseases that completed, None when already running
+	def startEpidemics(self,diseases=None):
+		# Runs of the same server never overlap
+		if not self.runLock.acquire(False):
+			print("Detection is already running")
+			return None
+		try:
+			self.metrics = RunMetrics()
+			with self.metrics.stage('run'):
+				return self.detectEpidemics(diseases)
+		finally:
+			self.writeMetrics()
+			self.runLock.release()
+
+	# Write the run report and the Prometheus text file, near the settings file by default
+	def writeMetrics(self):
+		self.metrics.finish()
+		if not self.useMetrics:
+			return
+		directory = self.getSettingsPath(self.metricsDirectory or '')
+		try:
+			self.metrics.writeReport(os.path.join(directory,'idsr-run.json'))
+			self.metrics.writePrometheus(os.path.join(directory,'idsr.prom'))
+			print("Run metrics written to " + directory)
+		except OSError as e:
+			print("Failed to write run metrics: ",e)
+
+	# Source of the cases of case based diseases, EVENT or ANALYTICS
+	def getCaseBasedType(self):
+		return 'EVENT' if self.caseBasedDetection == 'events' else 'ANALYTICS'
+
+	# @return error of each disease by name, None for the diseases that completed
+	def detectEpidemics(self,diseases=None):
 		print ("Started detection for outbreaks/epidemics")
+		# Under the daemon the settings were already loaded for this tick
+		self.reloadSettings()
 		# Get Disease Metadata
-		diseaseFields = 'dataStore/' + self.dataStore + '/diseases'
-		auth = self.getAuth()
-		self.username = auth['username']
-		self.password = auth['password']
-		self.url = auth['url']
-		diseasesMeta = self.getHttpData(self.url,diseaseFields,self.username,self.password,{})
+		try:
+			with self.metrics.stage('diseasesMeta'):
+				diseasesMeta = self.filterDiseases(self.getDiseasesMeta(),diseases)
+		except Dhis2Error as e:
+			print("Failed to get disease meta data: ",e)
+			return dict.fromkeys(diseases or [],str(e))
+		names = [diseaseMeta['disease'] for diseaseMeta in diseasesMeta['diseases']]
 
 		# Get Epidemics
-		if(diseasesMeta != 'HTTP_ERROR'):
-			diseaseConfig = diseasesMeta['config']['notificationProgram']
-
-			# programs
-			self.programUid = diseaseConfig['id']
-			self.outbreakProgram = diseasesMeta['config']['reportingProgram']['id']
-
-			# TE Attributes
-			self.dateOfOnsetUid = diseaseConfig['dateOfOnSet']['id']
-			self.conditionOrDiseaseUid = diseaseConfig['disease']['id']
-			self.patientStatusOutcome = diseaseConfig['patientStatusOutcome']['id']
-			self.regPatientStatusOutcome = diseaseConfig['regPatientStatusOutcome']['id']
-			self.caseClassification = diseaseConfig['caseClassification']['id']
-			self.testResult= diseaseConfig['testResult']['id']
-			self.testResultClassification= diseaseConfig['testResultClassification']['id']
+		diseaseConfig = diseasesMeta['config']['notificationProgram']
 
-			epidemicsFields = 'dataStore/' + self.dataStore + '/epidemics'
-			epidemicsData = self.getHttpData(self.url,epidemicsFields,self.username,self.password,{})
+		# programs
+		self.programUid = diseaseConfig['id']
+		self.outbreakProgram = diseasesMeta['config']['reportingProgram']['id']
 
-			alertsFields = 'dataStore/' + self.dataStore + '/alerts'
-			alertsData = self.getHttpData(self.url,alertsFields,self.username,self.password,{})
+		# TE Attributes
+		self.dateOfOnsetUid = diseaseConfig['dateOfOnSet']['id']
+		self.conditionOrDiseaseUid = diseaseConfig['disease']['id']
+		self.patientStatusOutcome = diseaseConfig['patientStatusOutcome']['id']
+		self.regPatientStatusOutcome = diseaseConfig['regPatientStatusOutcome']['id']
+		self.caseClassification = diseaseConfig['caseClassification']['id']
+		self.testResult= diseaseConfig['testResult']['id']
+		self.testResultClassification= diseaseConfig['testResultClassification']['id']
+
+		if self.datastoreLayout == 'partitioned':
+			diseases = set([diseaseMeta['disease'] for diseaseMeta in diseasesMeta['diseases']])
+			self.epidemicsStore = self.getPartitionedDatastore('epidemics')
+			self.alertsStore = self.getPartitionedDatastore('alerts')
+			try:
+				with self.metrics.stage('loadDatastore'):
+					epidemicsData = self.epidemicsStore.load(diseases,self.getEpiYears())
+					alertsData = self.alertsStore.load(diseases,self.getEpiYears())
+			except Dhis2Error as e:
+				print("Failed to load partitioned datastores: ",e)
+				return dict.fromkeys(names,str(e))
+			return self.iterateDiseases(diseasesMeta,epidemicsData,alertsData,self.getCaseBasedType())
 
-			if(epidemicsData != 'HTTP_ERROR'):
-				epidemicsProcessed = self.iterateDiseases(diseasesMeta,epidemicsData,alertsData,'ANALYTICS')
-				print(epidemicsProcessed)
-			else:
-				print("Failed to load epidemics datastores")
+		try:
+			epidemicsFields = 'dataStore/' + self.dataStore + '/epidemics'
+			with self.metrics.stage('loadDatastore'):
+				epidemicsData = self.getHttpData(self.url,epidemicsFields,self.username,self.password,{})
+		except Dhis2Error as e:
+			print("Failed to load epidemics datastores: ",e)
+			return dict.fromkeys(names,str(e))
 
-				#loggedin = self.getHttpData(self.url,'me',self.username,self.password,{})
-		else:
-			print("Failed to get disease meta data")
+		# Alerts datastore is created on the first save
+		try:
+			alertsFields = 'dataStore/' + self.dataStore + '/alerts'
+			with self.metrics.stage('loadDatastore'):
+				alertsData = self.getHttpData(self.url,alertsFields,self.username,self.password,{})
+		except Dhis2HttpError as e:
+			if e.status != 404:
+				print("Failed to load alerts datastores: ",e)
+				return dict.fromkeys(names,str(e))
+			alertsData = []
+
+		return self.iterateDiseases(diseasesMeta,epidemicsData,alertsData,self.getCaseBasedType())
+
+	# Keep running and detect each disease on its own cadence
+	def startDaemon(self):
+		auth = self.loadSettings()
+		scheduler = DiseaseScheduler(self,cadences=auth.get('schedule'),tick=float(auth.get('scheduleTick',60)),retry=float(auth.get('scheduleRetry',300)),healthHost=auth.get('healthHost','127.0.0.1'),healthPort=auth.get('healthPort'))
+		signal.signal(signal.SIGTERM,lambda signum,frame: scheduler.stop())
+		try:
+			scheduler.run()
+		except KeyboardInterrupt:
+			scheduler.stop()
+		return scheduler
 
 # Start the idsr processing
 if __name__ == "__main__":
 	idsrAppSerlvet = IdsrAppServer()
-	idsrAppSerlvet.startEpidemics()
+	if len(sys.argv) > 1 and sys.argv[1] == 'daemon':
+		idsrAppSerlvet.startDaemon()
+	else:
+		idsrAppSerlvet.startEpidemics()
 #main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+import os
+import sqlite3
+import hashlib
+import threading
+
+# Path of the store file of a DHIS2 instance e.g .idsr.sqlite -> .idsr.3f2a9c1b7e4d.sqlite
+# Cached metadata, baselines, outbreaks, event hashes and messages of one instance are
+# never read for another one sharing the same localStore setting
+def getStorePath(path,url):
+	root,extension = os.path.splitext(path)
+	return '{}.{}{}'.format(root,hashlib.sha1(str(url).rstrip('/').encode('utf-8')).hexdigest()[:12],extension)
+
+# Local SQLite file shared by the caches and stores of the engine
+# Subclasses list their tables in SCHEMA
+class LocalStore:
+	SCHEMA = []
+	# Values of an IN list bound in one statement, below the SQLite host parameter limit
+	CHUNK_SIZE = 500
+
+	def __init__(self,path):
+		self.path = path
+		self.lock = threading.RLock()
+		self.connection = sqlite3.connect(path,timeout=30,check_same_thread=False)
+		with self.lock:
+			self.connection.execute('PRAGMA journal_mode=WAL')
+			with self.connection:
+				for statement in self.SCHEMA:
+					self.connection.execute(statement)
+
+	def execute(self,sql,params=()):
+		with self.lock:
+			with self.connection:
+				return self.connection.execute(sql,params).fetchall()
+
+	def executemany(self,sql,params):
+		with self.lock:
+			with self.connection:
+				self.connection.executemany(sql,params)
+
+	def getMarks(self,values):
+		return ','.join(['?']*len(values))
+
+	# Run a query with an IN list of values, in chunks of CHUNK_SIZE values
+	# @param sql query with {} in place of the placeholders of the IN list
+	# @param before parameters before the IN list and after those after it
+	def executeIn(self,sql,values,before=(),after=()):
+		values = list(values)
+		rows = []
+		for start in range(0,len(values),self.CHUNK_SIZE):
+			part = values[start:(start+self.CHUNK_SIZE)]
+			rows.extend(self.execute(sql.format(self.getMarks(part)),list(before) + part + list(after)))
+		return rows
+
+	def close(self):
+		with self.lock:
+			self.connection.close()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+import json
+import threading
+import time
+
+from .localstore import LocalStore
+
+# On-disk TTL cache for slowly changing DHIS2 metadata
+# e.g org unit hierarchies, the root org unit and the diseases config
+class MetadataCache(LocalStore):
+	SCHEMA = ["CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT NOT NULL, fetched REAL NOT NULL)"]
+	# Time to live in seconds by resource
+	TTLS = {
+		'organisationUnits': 7*24*3600,
+		'rootOrgUnit': 7*24*3600,
+		'diseases': 3600
+	}
+
+	# @param refresh reload every key once in this process regardless of its age
+	def __init__(self,path,ttls=None,refresh=False):
+		LocalStore.__init__(self,path)
+		self.ttls = dict(self.TTLS)
+		if ttls is not None:
+			self.ttls.update(ttls)
+		self.refresh = refresh
+		self.refreshed = set()
+		# key -> (fetched,value) of values already loaded in this process
+		self.memory = {}
+		self.keyLocks = {}
+		self.keyLock = threading.Lock()
+
+	def getKeyLock(self,key):
+		with self.keyLock:
+			return self.keyLocks.setdefault(key,threading.Lock())
+
+	def isFresh(self,fetched,resource):
+		return (time.time() - fetched) < self.ttls.get(resource,0)
+
+	# Get a cached value, calling loader when missing, expired or refreshed
+	# Concurrent callers of the same key wait for a single load
+	# @param resource TTL resource of the key, defaults to the key
+	def get(self,key,loader,resource=None):
+		resource = key if resource is None else resource
+		with self.getKeyLock(key):
+			forced = self.refresh and key not in self.refreshed
+			if not forced:
+				entry = self.memory.get(key)
+				if entry is not None and self.isFresh(entry[0],resource):
+					return entry[1]
+				rows = self.execute("SELECT value,fetched FROM metadata WHERE key = ?",(key,))
+				if len(rows) > 0 and self.isFresh(rows[0][1],resource):
+					value = json.loads(rows[0][0])
+					self.memory[key] = (rows[0][1],value)
+					return value
+			value = loader()
+			fetched = time.time()
+			self.execute("INSERT OR REPLACE INTO metadata (key,value,fetched) VALUES (?,?,?)",(key,json.dumps(value),fetched))
+			self.memory[key] = (fetched,value)
+			self.refreshed.add(key)
+			return value
+
+	# Drop one key or everything from the cache
+	def invalidate(self,key=None):
+		with self.keyLock:
+			if key is None:
+				self.memory.clear()
+				self.execute("DELETE FROM metadata")
+			else:
+				self.memory.pop(key,None)
+				self.execute("DELETE FROM metadata WHERE key = ?",(key,))
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+import os
+import re
+import json
+import time
+import datetime
+import threading
+import contextlib
+
+# Instrumentation of a detection run
+# Wall time of each stage, HTTP latency and payload sizes by endpoint, rows in and out
+# of each DataFrame stage and totals by disease
+# Written at the end of the run as a JSON report and a Prometheus text file
+class RunMetrics:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.started = time.time()
+		self.finished = None
+		# (stage,disease) -> {calls,seconds}
+		self.stages = {}
+		# (method,endpoint) -> {requests,errors,seconds,maxSeconds,requestBytes,responseBytes,statuses}
+		self.http = {}
+		# (stage,disease) -> {calls,rowsIn,rowsOut}
+		self.rows = {}
+		# disease -> {name: value}
+		self.diseases = {}
+
+	# Time a stage, stages with a disease are timed per disease
+	@contextlib.contextmanager
+	def stage(self,name,disease=None):
+		started = time.perf_counter()
+		try:
+			yield
+		finally:
+			seconds = time.perf_counter() - started
+			with self.lock:
+				stage = self.stages.setdefault((name,disease),{'calls': 0,'seconds': 0.0})
+				stage['calls'] = stage['calls'] + 1
+				stage['seconds'] = stage['seconds'] + seconds
+
+	# Endpoint relative to the api url without the format and the query e.g analytics/events/query/xxx
+	def getEndPoint(self,endPoint):
+		endPoint = endPoint.split('?')[0].strip('/')
+		return endPoint[:-len('.json')] if endPoint.endswith('.json') else endPoint
+
+	# Record an HTTP call, status is None when DHIS2 could not be reached
+	def observeHttp(self,method,endPoint,seconds,status=None,requestBytes=0,responseBytes=0):
+		key = (method,self.getEndPoint(endPoint))
+		with self.lock:
+			http = self.http.setdefault(key,{'requests': 0,'errors': 0,'seconds': 0.0,'maxSeconds': 0.0,'requestBytes': 0,'responseBytes': 0,'statuses': {}})
+			http['requests'] = http['requests'] + 1
+			http['seconds'] = http['seconds'] + seconds
+			http['maxSeconds'] = max(http['maxSeconds'],seconds)
+			http['requestBytes'] = http['requestBytes'] + requestBytes
+			http['responseBytes'] = http['responseBytes'] + responseBytes
+			if status is None or status >= 300:
+				http['errors'] = http['errors'] + 1
+			status = 'error' if status is None else str(status)
+			http['statuses'][status] = http['statuses'].get(status,0) + 1
+
+	# Count rows going in and out of a DataFrame stage
+	def countRows(self,stage,rowsIn=0,rowsOut=0,disease=None):
+		with self.lock:
+			rows = self.rows.setdefault((stage,disease),{'calls': 0,'rowsIn': 0,'rowsOut': 0})
+			rows['calls'] = rows['calls'] + 1
+			rows['rowsIn'] = rows['rowsIn'] + int(rowsIn)
+			rows['rowsOut'] = rows['rowsOut'] + int(rowsOut)
+
+	# Add to a total of a disease e.g epidemics, alerts, messages, seconds
+	def addDiseaseTotal(self,disease,name,value):
+		with self.lock:
+			totals = self.diseases.setdefault(disease,{})
+			totals[name] = totals.get(name,0) + value
+
+	def finish(self):
+		self.finished = time.time()
+
+	def getDuration(self):
+		return (self.finished or time.time()) - self.started
+
+	def getReport(self):
+		with self.lock:
+			return {
+				'started': datetime.datetime.fromtimestamp(self.started).isoformat(),
+				'finished': None if self.finished is None else datetime.datetime.fromtimestamp(self.finished).isoformat(),
+				'seconds': self.getDuration(),
+				'stages': [dict({'stage': stage,'disease': disease},**values) for (stage,disease),values in self.stages.items()],
+				'http': [dict({'method': method,'endpoint': endPoint},**json.loads(json.dumps(values))) for (method,endPoint),values in sorted(self.http.items())],
+				'rows': [dict({'stage': stage,'disease': disease},**values) for (stage,disease),values in self.rows.items()],
+				'diseases': json.loads(json.dumps(self.diseases))
+			}
+
+	def escapeLabel(self,value):
+		return str(value).replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')
+
+	def formatLabels(self,labels):
+		labels = [(name,value) for name,value in labels if value is not None]
+		if len(labels) == 0:
+			return ''
+		return '{' + ','.join('{}="{}"'.format(name,self.escapeLabel(value)) for name,value in labels) + '}'
+
+	# Metric name of a disease total e.g maxSeconds -> idsr_disease_max_seconds
+	def getDiseaseMetricName(self,name):
+		return 'idsr_disease_' + re.sub(r'[^a-z0-9_]','_',re.sub(r'([a-z0-9])([A-Z])',r'\1_\2',name).lower())
+
+	# Prometheus text exposition format, e.g for the node exporter textfile collector
+	def getPrometheus(self):
+		report = self.getReport()
+		metrics = {}
+		def add(name,help,type,labels,value):
+			metric = metrics.setdefault(name,{'help': help,'type': type,'samples': []})
+			metric['samples'].append((labels,value))
+		add('idsr_run_start_timestamp_seconds','Start of the last detection run','gauge',[],self.started)
+		add('idsr_run_duration_seconds','Wall time of the last detection run','gauge',[],report['seconds'])
+		for stage in report['stages']:
+			labels = [('stage',stage['stage']),('disease',stage['disease'])]
+			add('idsr_stage_seconds','Wall time of a stage of the last run','gauge',labels,stage['seconds'])
+			add('idsr_stage_calls','Times a stage ran in the last run','gauge',labels,stage['calls'])
+		for http in report['http']:
+			labels = [('method',http['method']),('endpoint',http['endpoint'])]
+			add('idsr_http_request_seconds','Total latency of DHIS2 requests in the last run','gauge',labels,http['seconds'])
+			add('idsr_http_requests','DHIS2 requests in the last run','gauge',labels,http['requests'])
+			add('idsr_http_request_max_seconds','Slowest DHIS2 request in the last run','gauge',labels,http['maxSeconds'])
+			add('idsr_http_request_bytes','Request payload bytes sent to DHIS2 in the last run','gauge',labels,http['requestBytes'])
+			add('idsr_http_response_bytes','Response payload bytes received from DHIS2 in the last run','gauge',labels,http['responseBytes'])
+			for status,count in sorted(http['statuses'].items()):
+				add('idsr_http_responses','DHIS2 responses by status in the last run','gauge',labels + [('status',status)],count)
+		for rows in report['rows']:
+			labels = [('stage',rows['stage']),('disease',rows['disease'])]
+			add('idsr_stage_rows_in','Rows going into a DataFrame stage in the last run','gauge',labels,rows['rowsIn'])
+			add('idsr_stage_rows_out','Rows coming out of a DataFrame stage in the last run','gauge',labels,rows['rowsOut'])
+		for disease,totals in sorted(report['diseases'].items()):
+			for name,value in sorted(totals.items()):
+				add(self.getDiseaseMetricName(name),'Total ' + name + ' of a disease in the last run','gauge',[('disease',disease)],value)
+		lines = []
+		for name,metric in metrics.items():
+			lines.append('# HELP {} {}'.format(name,metric['help']))
+			lines.append('# TYPE {} {}'.format(name,metric['type']))
+			for labels,value in metric['samples']:
+				lines.append('{}{} {}'.format(name,self.formatLabels(labels),repr(float(value))))
+		return '\n'.join(lines) + '\n'
+
+	# Replace a file in one step so that collectors never read a partial file
+	def writeFile(self,path,text):
+		temporaryPath = path + '.tmp'
+		with open(temporaryPath,'w') as outputFile:
+			outputFile.write(text)
+		os.replace(temporaryPath,path)
+
+	def writeReport(self,path):
+		self.writeFile(path,json.dumps(self.getReport(),indent=2,default=str))
+
+	def writePrometheus(self,path):
+		self.writeFile(path,self.getPrometheus())
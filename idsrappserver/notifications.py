@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+import json
+import threading
+import time
+
+from .localstore import LocalStore
+from .httpclient import Dhis2Error
+
+# Persistent outbox of message conversations
+# A message is queued once per (disease, orgUnit, period, type), rows are kept after
+# sending so that the same alert is never sent twice across runs
+class NotificationOutbox(LocalStore):
+	SCHEMA = [
+		"CREATE TABLE IF NOT EXISTS notifications (id INTEGER PRIMARY KEY AUTOINCREMENT, disease TEXT NOT NULL, orgUnit TEXT NOT NULL, period TEXT NOT NULL, type TEXT NOT NULL, message TEXT NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, nextAttempt REAL NOT NULL, created REAL NOT NULL, sent REAL, error TEXT, UNIQUE (disease,orgUnit,period,type))",
+		"CREATE INDEX IF NOT EXISTS notificationsPending ON notifications (status,nextAttempt)"
+	]
+	PENDING = 'PENDING'
+	SENT = 'SENT'
+	FAILED = 'FAILED'
+
+	def getKey(self,message,type):
+		return (str(message.get('disease')),str(message.get('orgUnit')),str(message.get('period')),str(message.get('messageType',type)))
+
+	# Queue messages that were never queued before
+	# @return number of messages queued
+	def enqueue(self,messages,type='ALERT'):
+		now = time.time()
+		rows = [self.getKey(message,type) + (json.dumps(message,default=str),self.PENDING,now,now) for message in messages]
+		with self.lock:
+			before = self.connection.total_changes
+			with self.connection:
+				self.connection.executemany("INSERT OR IGNORE INTO notifications (disease,orgUnit,period,type,message,status,nextAttempt,created) VALUES (?,?,?,?,?,?,?,?)",rows)
+			return self.connection.total_changes - before
+
+	# Get messages due for sending as [(id,attempts,message)]
+	def getPending(self,limit):
+		rows = self.execute("SELECT id,attempts,message FROM notifications WHERE status = ? AND nextAttempt <= ? ORDER BY id LIMIT ?",(self.PENDING,time.time(),limit))
+		return [(id,attempts,json.loads(message)) for id,attempts,message in rows]
+
+	def countPending(self):
+		return self.execute("SELECT COUNT(*) FROM notifications WHERE status = ?",(self.PENDING,))[0][0]
+
+	def markSent(self,ids):
+		self.executemany("UPDATE notifications SET status = ?, sent = ?, error = NULL WHERE id = ?",[(self.SENT,time.time(),id) for id in ids])
+
+	# Schedule another attempt or give up after the last retry
+	def markFailed(self,ids,attempts,error,retries,backoff):
+		now = time.time()
+		rows = []
+		for id in ids:
+			status = self.FAILED if attempts[id] + 1 > retries else self.PENDING
+			rows.append((status,attempts[id] + 1,now + backoff*(2 ** attempts[id]),str(error),id))
+		self.executemany("UPDATE notifications SET status = ?, attempts = ?, nextAttempt = ?, error = ? WHERE id = ?",rows)
+
+# Background worker sending queued messages in batches
+class NotificationDispatcher:
+	# @param send function posting {'messageConversations': batch}
+	# @param rateLimit maximum messages per second
+	def __init__(self,outbox,send,batchSize=20,rateLimit=5,retries=5,backoff=30,interval=5):
+		self.outbox = outbox
+		self.send = send
+		self.batchSize = max(1,int(batchSize))
+		self.rateLimit = float(rateLimit)
+		self.retries = int(retries)
+		self.backoff = backoff
+		self.interval = interval
+		self.thread = None
+		self.stopping = threading.Event()
+		self.wakeup = threading.Event()
+
+	# Send one batch of due messages
+	# @return number of messages taken from the outbox
+	def dispatchBatch(self):
+		pending = self.outbox.getPending(self.batchSize)
+		if len(pending) == 0:
+			return 0
+		ids = [id for id,attempts,message in pending]
+		try:
+			self.send({'messageConversations': [message for id,attempts,message in pending]})
+			self.outbox.markSent(ids)
+			print("Messages sent: ",len(ids))
+		except Dhis2Error as e:
+			print("Failed to send messages: ",e)
+			self.outbox.markFailed(ids,{id: attempts for id,attempts,message in pending},e,self.retries,self.backoff)
+		except (TypeError,ValueError) as e:
+			# e.g a message that cannot be serialized, retried and given up like a failed request
+			print("Failed to send messages: %r" %e)
+			self.outbox.markFailed(ids,{id: attempts for id,attempts,message in pending},e,self.retries,self.backoff)
+		if self.rateLimit > 0:
+			self.stopping.wait(len(ids)/self.rateLimit)
+		return len(ids)
+
+	# Keep sending until stopped, errors are logged and the messages left pending for the next batch
+	def run(self):
+		while not self.stopping.is_set():
+			try:
+				dispatched = self.dispatchBatch()
+			except Exception as e:
+				print("Failed to dispatch messages: %r" %e)
+				dispatched = 0
+			if dispatched == 0:
+				self.wakeup.wait(self.interval)
+				self.wakeup.clear()
+
+	def start(self):
+		if self.thread is None or not self.thread.is_alive():
+			self.stopping.clear()
+			self.thread = threading.Thread(target=self.run,name='notifications',daemon=True)
+			self.thread.start()
+
+	# Wake the worker up after new messages were queued
+	def notify(self):
+		self.wakeup.set()
+
+	# Wait until no message is due or the timeout is reached, then stop the worker
+	# Messages left in the outbox are sent on the next start
+	def stop(self,timeout=None):
+		deadline = None if timeout is None else time.time() + timeout
+		while self.thread is not None and self.thread.is_alive() and len(self.outbox.getPending(1)) > 0:
+			if deadline is not None and time.time() >= deadline:
+				break
+			self.notify()
+			time.sleep(0.1)
+		self.join()
+		print("Messages waiting in the outbox: ",self.outbox.countPending())
+
+	# Stop the worker and wait for it to finish its batch
+	def join(self):
+		self.stopping.set()
+		self.wakeup.set()
+		if self.thread is not None:
+			self.thread.join()
+
+	# Stop the worker, without waiting for due messages, then close the outbox
+	def close(self):
+		self.join()
+		self.outbox.close()
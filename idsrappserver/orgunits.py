@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+# Org unit hierarchy index
+# Built once per run from organisationUnits?fields=id,code,name,ancestors[id,code,name]
+# and shared by every disease detecting at the same level
+class OrgUnitIndex:
+	def __init__(self,organisationUnits=None):
+		# id -> ancestors ordered from level 1 downwards
+		self.ancestors = {}
+		# id -> name, id -> code and code -> id of the indexed org units
+		self.names = {}
+		self.codes = {}
+		self.ids = {}
+		# (level,type) -> { id: ancestor value }
+		self.lookups = {}
+		if organisationUnits is not None:
+			for ou in organisationUnits:
+				self.ancestors[ou['id']] = ou.get('ancestors',[])
+				self.names[ou['id']] = ou.get('name')
+				self.codes[ou['id']] = ou.get('code')
+				if ou.get('code') is not None:
+					self.ids[ou['code']] = ou['id']
+
+	def __len__(self):
+		return len(self.ancestors)
+
+	# Get ancestors of an orgUnit
+	def getAncestors(self,ouId):
+		return self.ancestors.get(ouId,[])
+
+	# Get id -> ancestor value lookup for a hierarchy level
+	# @param level hierarchy level of the ancestor e.g 2 for districts
+	# @param type = { id,name,code}
+	def getLookup(self,level,type):
+		key = (level,type)
+		lookup = self.lookups.get(key)
+		if lookup is None:
+			lookup = {}
+			for ouId,ancestors in self.ancestors.items():
+				if len(ancestors) >= level:
+					lookup[ouId] = ancestors[level-1].get(type)
+			self.lookups[key] = lookup
+		return lookup
+
+	# Get ancestor value of an orgUnit
+	def getValue(self,ouId,level,type):
+		return self.getLookup(level,type).get(ouId)
+
+	# Resolve a column of orgUnit ids to ancestor values in one map
+	def mapValues(self,orgUnits,level,type):
+		return orgUnits.map(self.getLookup(level,type))
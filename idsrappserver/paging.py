@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .streaming import StreamedTable
+
+# Paged fetching of query tables e.g analytics/events/query and trackedEntityInstances/query
+# The first page gives the page count from metaData.pager, the other pages are fetched
+# concurrently and appended in page order so no single request is unbounded
+class PagedTableFetcher:
+	# @param fetch function getting one table for a dict of params
+	def __init__(self,fetch,pageSize=1000,workers=4):
+		self.fetch = fetch
+		self.pageSize = int(pageSize)
+		self.workers = max(1,int(workers))
+
+	def getPageParams(self,params,page):
+		pageParams = dict(params)
+		pageParams.pop('skipPaging',None)
+		pageParams.update({'paging': 'true','page': page,'pageSize': self.pageSize,'totalPages': 'true'})
+		return pageParams
+
+	def getPageCount(self,table):
+		metaData = table.get('metaData') or {}
+		pager = metaData.get('pager') or table.get('pager') or {}
+		return pager.get('pageCount')
+
+	def getRowCount(self,table):
+		return len(table['rows'])
+
+	# Create an empty table to append pages to
+	def createTable(self,first):
+		table = StreamedTable()
+		for key,value in first.items():
+			if key != 'rows':
+				table[key] = value
+		table.setHeaders(first['headers'])
+		return table
+
+	# Fetch every page of a query into one table
+	def fetchPages(self,params):
+		if self.pageSize <= 0:
+			return self.fetch(params)
+		first = self.fetch(self.getPageParams(params,1))
+		table = self.createTable(first)
+		table.extend(first)
+		pageCount = self.getPageCount(first)
+		if pageCount is None:
+			# No pager in the response, read pages until a short one
+			page = 1
+			last = first
+			while self.getRowCount(last) >= self.pageSize:
+				page = page + 1
+				last = self.fetch(self.getPageParams(params,page))
+				table.extend(last)
+		elif pageCount > 1:
+			pages = range(2,pageCount+1)
+			if self.workers == 1:
+				for page in pages:
+					table.extend(self.fetch(self.getPageParams(params,page)))
+			else:
+				with ThreadPoolExecutor(max_workers=min(self.workers,len(pages))) as executor:
+					# Pages are appended in order as they arrive, each is released once appended
+					for pageTable in executor.map(lambda page: self.fetch(self.getPageParams(params,page)),pages):
+						table.extend(pageTable)
+		table['height'] = table.getHeight()
+		table['width'] = len(table.columns)
+		return table
+
+	# Fetch the pages of several scopes of the same query e.g one per level 2 subtree
+	def fetchScopes(self,scopes):
+		table = None
+		for params in scopes:
+			scopeTable = self.fetchPages(params)
+			if table is None:
+				table = scopeTable if isinstance(scopeTable,StreamedTable) else self.createTable(scopeTable)
+				if table is not scopeTable:
+					table.extend(scopeTable)
+			else:
+				table.extend(scopeTable)
+		if table is not None:
+			table['height'] = table.getHeight()
+			table['width'] = len(table.columns)
+		return table
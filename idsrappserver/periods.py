@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+import re
+import datetime
+from functools import lru_cache
+
+import pandas as pd
+
+# Week periods and dates on the standard library
+# Periods are named like 2026W41: the calendar year and the week of the year starting on
+# Monday (strftime %W, days before the first Monday are week 00)
+# Week boundaries of a period are those of getStartEndDates: week 1 starts on the Monday of
+# the week of January 4, the following weeks every 7 days
+# Tables of week boundaries and period lists are computed once and answered by lookup
+
+DATE_FORMAT = '%Y-%m-%d'
+WEEK_FORMAT = '%YW%W'
+ISO_DATE = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+@lru_cache(maxsize=4096)
+def parseDate(date):
+	return datetime.datetime.strptime(date[:10],DATE_FORMAT)
+
+# Format a date or a date string as YYYY-MM-DD
+# Strings starting with an ISO date e.g 2026-10-10T08:00:00.000 keep that date
+def formatDate(date):
+	if isinstance(date,str):
+		if ISO_DATE.match(date):
+			return date[:10]
+		parsed = pd.to_datetime(date,errors='coerce')
+		return date if pd.isnull(parsed) else parsed.strftime(DATE_FORMAT)
+	if hasattr(date,'strftime') and not pd.isnull(date):
+		return date.strftime(DATE_FORMAT)
+	return date
+
+# Format a column of dates as YYYY-MM-DD
+def formatDates(values):
+	values = pd.Series(values,dtype=object)
+	text = values.astype(str)
+	iso = text.str.match(ISO_DATE.pattern).fillna(False).to_numpy(dtype=bool)
+	dates = text.str[:10]
+	if not iso.all():
+		dates[~iso] = values[~iso].map(formatDate)
+	return dates
+
+@lru_cache(maxsize=4096)
+def getWeek(date):
+	return parseDate(date).strftime(WEEK_FORMAT)
+
+# Get the period of a date e.g 2026-10-14 -> 2026W41
+def formatWeek(date):
+	if isinstance(date,str):
+		return getWeek(date[:10])
+	return date.strftime(WEEK_FORMAT)
+
+def addDays(date,days):
+	return (parseDate(date) + datetime.timedelta(days=days)).strftime(DATE_FORMAT)
+
+def getDateDifference(date,other):
+	return (parseDate(date) - parseDate(other)).days
+
+# Subtract months from a date, the day is kept within the resulting month e.g 2024-02-29 - 12 months = 2023-02-28
+def subtractMonths(date,months):
+	position = date.year*12 + date.month - 1 - months
+	year,month = divmod(position,12)
+	days = [31,29 if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) else 28,31,30,31,30,31,31,30,31,30,31]
+	return date.replace(year=year,month=month+1,day=min(date.day,days[month]))
+
+# Start and end of weeks 0 to 53 of a year
+# @return (starts,ends) lists of datetime
+@lru_cache(maxsize=64)
+def getWeekTable(year):
+	first = datetime.datetime(year,1,1)
+	if first.weekday() <= 3:
+		first = first - datetime.timedelta(first.weekday())
+	else:
+		first = first + datetime.timedelta(7-first.weekday())
+	starts = [first + datetime.timedelta(days=(week-1)*7) for week in range(0,54)]
+	ends = [start + datetime.timedelta(days=6) for start in starts]
+	return (starts,ends)
+
+# Get [start,end] of a week of a year
+def getStartEndDates(year,week):
+	week = int(week)
+	if 0 <= week <= 53:
+		starts,ends = getWeekTable(int(year))
+		return [starts[week],ends[week]]
+	start = getWeekTable(int(year))[0][1] + datetime.timedelta(days=(week-1)*7)
+	return [start,start + datetime.timedelta(days=6)]
+
+# Get the periods of a detection
+# SEASONAL: the current m weeks followed by the same m weeks in each of the n previous years
+# NON_SEASONAL: the current week and the m previous weeks
+# CASE_BASED: LAST_7_DAYS
+@lru_cache(maxsize=256)
+def getPeriods(today,m,n,algorithm):
+	current = parseDate(today)
+	periods = []
+	if algorithm == 'SEASONAL':
+		for year in range(0,(n+1),1):
+			yearDate = subtractMonths(current,year*12)
+			for week in range(0,m,1):
+				periods.append(formatWeek(yearDate - datetime.timedelta(weeks=week)))
+	elif algorithm == 'NON_SEASONAL':
+		for week in range(0,(m+1),1):
+			periods.append(formatWeek(current - datetime.timedelta(weeks=week)))
+	else:
+		periods.append('LAST_7_DAYS')
+	return tuple(periods)
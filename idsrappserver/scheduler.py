@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+import json
+import time
+import datetime
+import threading
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .httpclient import Dhis2Error
+
+# Daemon running detection for each disease on its own cadence
+# The server is kept between runs so the HTTP pool and the metadata caches stay warm
+class DiseaseScheduler:
+	# Seconds between runs by detection algorithm
+	CADENCES = {
+		'CASE_BASED': 3600,
+		'SEASONAL': 7*24*3600,
+		'NON_SEASONAL': 7*24*3600
+	}
+
+	# @param cadences seconds between runs by algorithm or disease name
+	# @param tick seconds between checks for due diseases
+	# @param retry seconds before a failed disease is run again, doubled after each failure up to its cadence
+	def __init__(self,server,cadences=None,tick=60,retry=300,healthHost='127.0.0.1',healthPort=None):
+		self.server = server
+		self.cadences = dict(self.CADENCES)
+		if cadences is not None:
+			self.cadences.update(cadences)
+		self.tick = tick
+		self.retry = retry
+		self.healthHost = healthHost
+		self.healthPort = healthPort
+		self.healthServer = None
+		self.stopping = threading.Event()
+		self.lock = threading.Lock()
+		# disease -> next run time
+		self.nextRuns = {}
+		# disease -> failed runs in a row
+		self.failures = {}
+		self.status = {'started': time.time(),'state': 'idle','runs': 0,'failures': 0,'lastRun': None,'lastError': None,'diseases': {}}
+
+	def getCadence(self,diseaseMeta):
+		cadence = self.cadences.get(diseaseMeta['disease'],self.cadences.get(diseaseMeta['epiAlgorithm']))
+		return None if cadence is None else float(cadence)
+
+	# Seconds before a failed disease is run again
+	def getRetryDelay(self,diseaseMeta):
+		return min(self.getCadence(diseaseMeta),self.retry*(2 ** (self.failures[diseaseMeta['disease']] - 1)))
+
+	# Get the diseases due for a run, diseases with an unknown algorithm are never run
+	def getDueDiseases(self,diseasesMeta,now):
+		due = []
+		for diseaseMeta in diseasesMeta['diseases']:
+			if self.getCadence(diseaseMeta) is None:
+				continue
+			if self.nextRuns.get(diseaseMeta['disease'],0) <= now:
+				due.append(diseaseMeta)
+		return due
+
+	# Run detection once for the due diseases
+	# @return names of the diseases run
+	def runDue(self):
+		now = time.time()
+		try:
+			# Settings are loaded again only when .idsr.json changed
+			if self.server.reloadSettings():
+				print("Settings loaded from " + self.server.configFile)
+		except (OSError,ValueError) as e:
+			print("Failed to load settings, keeping the previous ones: ",e)
+			self.setError(e)
+		try:
+			diseasesMeta = self.server.getDiseasesMeta()
+		except Dhis2Error as e:
+			print("Failed to get disease meta data: ",e)
+			self.setError(e)
+			return []
+		due = self.getDueDiseases(diseasesMeta,now)
+		if len(due) == 0:
+			return []
+		diseases = [diseaseMeta['disease'] for diseaseMeta in due]
+		with self.lock:
+			self.status['state'] = 'running'
+			self.status['running'] = diseases
+		# Detection runs for the day it starts on
+		self.server.today = datetime.date.today().strftime('%Y-%m-%d')
+		error = None
+		results = None
+		try:
+			results = self.server.startEpidemics(diseases=diseases)
+			if results is None:
+				error = "Detection is already running"
+		except Exception as e:
+			traceback.print_exc()
+			error = str(e)
+		finished = time.time()
+		errors = []
+		with self.lock:
+			self.status['state'] = 'idle'
+			self.status.pop('running',None)
+			self.status['runs'] = self.status['runs'] + 1
+			self.status['lastRun'] = {'started': now,'finished': finished,'diseases': diseases}
+			for diseaseMeta in due:
+				disease = diseaseMeta['disease']
+				if error is not None:
+					diseaseError = error
+				else:
+					diseaseError = results.get(disease,"Detection did not complete")
+				if diseaseError is None:
+					self.failures.pop(disease,None)
+					# The next run is counted from the start of this one, a late run is not repeated
+					self.nextRuns[disease] = now + self.getCadence(diseaseMeta)
+				else:
+					# A failed disease is run again after a backoff instead of its cadence
+					self.failures[disease] = self.failures.get(disease,0) + 1
+					self.nextRuns[disease] = finished + self.getRetryDelay(diseaseMeta)
+					errors.append("{}: {}".format(disease,diseaseError))
+				self.status['diseases'][disease] = {'lastRun': now,'duration': finished - now,'nextRun': self.nextRuns[disease],'error': diseaseError,'failures': self.failures.get(disease,0)}
+		if len(errors) > 0:
+			self.setError('; '.join(errors))
+		return diseases
+
+	def setError(self,error):
+		with self.lock:
+			self.status['failures'] = self.status['failures'] + 1
+			self.status['lastError'] = {'time': time.time(),'error': str(error)}
+
+	def getStatus(self):
+		with self.lock:
+			return json.loads(json.dumps(self.status))
+
+	# Start the health endpoint, GET /health and /status return the scheduler status
+	def startHealthServer(self):
+		if self.healthPort is None:
+			return
+		scheduler = self
+		class HealthHandler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				if self.path.split('?')[0] not in ['/','/health','/status']:
+					self.send_error(404)
+					return
+				body = json.dumps(scheduler.getStatus()).encode('utf-8')
+				self.send_response(200)
+				self.send_header('Content-Type','application/json')
+				self.send_header('Content-Length',str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self,format,*args):
+				pass
+		self.healthServer = ThreadingHTTPServer((self.healthHost,int(self.healthPort)),HealthHandler)
+		thread = threading.Thread(target=self.healthServer.serve_forever,name='health',daemon=True)
+		thread.start()
+		print("Health endpoint listening on {}:{}".format(self.healthHost,self.healthServer.server_address[1]))
+
+	# Run until stopped, due diseases are checked every tick
+	def run(self):
+		self.startHealthServer()
+		try:
+			while not self.stopping.is_set():
+				self.runDue()
+				self.stopping.wait(self.tick)
+		finally:
+			if self.healthServer is not None:
+				self.healthServer.shutdown()
+				self.healthServer.server_close()
+
+	def stop(self):
+		self.stopping.set()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+import json
+import time
+import hashlib
+
+import pandas as pd
+
+from .localstore import LocalStore
+from .periods import WEEK_FORMAT
+from .datastore import getEpiYear
+
+# Local state of the epidemics and alerts, the datastore keys are kept as a mirror of it
+# Stored outbreaks are indexed by (kind, orgUnit, disease, period) so that detections are
+# classified as new or updated by looking up their own keys instead of merging the whole
+# history. The period key is the period the detection carries, the week of the first case
+# date for records without one. The id keeps the datastore order.
+# Outbreaks are grouped in partitions of a disease and epi-year, as the partitioned datastore
+# keys. outbreakMirrors holds a hash of the datastore content of each partition the store was
+# last synced with, a partition is loaded again only when it was changed elsewhere
+class StateStore(LocalStore):
+	SCHEMA = [
+		"CREATE TABLE IF NOT EXISTS outbreaks (id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, orgUnit TEXT NOT NULL, disease TEXT NOT NULL, period TEXT NOT NULL, partition TEXT NOT NULL, event TEXT, epicode TEXT, status TEXT, closeDate TEXT, record TEXT NOT NULL, updated REAL NOT NULL)",
+		"CREATE INDEX IF NOT EXISTS outbreaksKey ON outbreaks (kind,orgUnit,disease,period)",
+		"CREATE INDEX IF NOT EXISTS outbreaksOpen ON outbreaks (kind,closeDate,status)",
+		"CREATE INDEX IF NOT EXISTS outbreaksEvent ON outbreaks (kind,event)",
+		"CREATE INDEX IF NOT EXISTS outbreaksEpicode ON outbreaks (kind,epicode)",
+		"CREATE INDEX IF NOT EXISTS outbreaksPartition ON outbreaks (kind,partition)",
+		"CREATE TABLE IF NOT EXISTS outbreakMirrors (kind TEXT NOT NULL, partition TEXT NOT NULL, hash TEXT NOT NULL, synced REAL NOT NULL, PRIMARY KEY (kind,partition))"
+	]
+	# Columns that can be read for all outbreaks of a kind
+	VALUE_COLUMNS = ['event','epicode']
+
+	# Period of each record e.g 2026W41, the week of the first case date when it has none
+	# Weeks are named as the periods of detections, see periods.py
+	def getPeriods(self,records):
+		dates = pd.to_datetime(pd.Series([record.get('firstCaseDate') for record in records],dtype=object),errors='coerce')
+		weeks = dates.dt.strftime(WEEK_FORMAT).fillna('').tolist()
+		return [str(record['period']) if record.get('period') else week for record,week in zip(records,weeks)]
+
+	# Hash of records regardless of their order
+	def getHash(self,records):
+		records = sorted(records,key=lambda record: (str(record.get('event')),str(record.get('orgUnit')),str(record.get('disease')),str(record.get('period'))))
+		return hashlib.sha1(json.dumps(records,sort_keys=True,default=str).encode('utf-8')).hexdigest()
+
+	def getText(self,value):
+		return None if value is None else str(value)
+
+	def getRow(self,kind,record,period,partition,updated):
+		return (kind,str(record.get('orgUnit')),str(record.get('disease')),period,partition,self.getText(record.get('event')),self.getText(record.get('epicode')),self.getText(record.get('status')),self.getText(record.get('closeDate')),json.dumps(record,default=str),updated)
+
+	def getPartitionKey(self,disease,year):
+		return '{}/{}'.format(disease,year)
+
+	# Partition of a record, its disease and epi-year as in PartitionedDatastore
+	# @param year epi-year of records without a first case date or period
+	def getPartition(self,record,year):
+		return self.getPartitionKey(record.get('disease'),getEpiYear(record,year))
+
+	# Group records by partition
+	def getPartitions(self,records,year):
+		partitions = {}
+		for record in records:
+			partitions.setdefault(self.getPartition(record,year),[]).append(record)
+		return partitions
+
+	def getMirrorHashes(self,kind):
+		return dict(self.execute("SELECT partition,hash FROM outbreakMirrors WHERE kind = ?",(kind,)))
+
+	# Record the hash of each partition of records written to the datastore
+	def setMirrorHashes(self,kind,records,year):
+		synced = time.time()
+		self.executemany("INSERT OR REPLACE INTO outbreakMirrors (kind,partition,hash,synced) VALUES (?,?,?,?)",[(kind,partition,self.getHash(partitionRecords),synced) for partition,partitionRecords in self.getPartitions(records,year).items()])
+
+	# Load the records read from the datastore, only the partitions the store does not hold already
+	# Stored records take the period key, as detections are matched on it
+	# @param partitions (disease,year) of the partitions read, None when the records are all those of the kind
+	# and stored partitions without records are then removed
+	# @return keys of the partitions loaded
+	def sync(self,kind,records,year,partitions=None):
+		grouped = self.getPartitions(records or [],year)
+		if partitions is None:
+			keys = set(grouped) | set([row[0] for row in self.execute("SELECT DISTINCT partition FROM outbreaks WHERE kind = ?",(kind,))])
+		else:
+			keys = set(grouped) | set([self.getPartitionKey(disease,partitionYear) for disease,partitionYear in partitions])
+		mirrorHashes = self.getMirrorHashes(kind)
+		updated = time.time()
+		loaded = []
+		rows = []
+		hashes = []
+		for partition in sorted(keys):
+			partitionRecords = grouped.get(partition,[])
+			mirrorHash = self.getHash(partitionRecords)
+			if mirrorHash == mirrorHashes.get(partition):
+				continue
+			loaded.append(partition)
+			hashes.append((kind,partition,mirrorHash,updated))
+			for record,period in zip(partitionRecords,self.getPeriods(partitionRecords)):
+				rows.append(self.getRow(kind,dict(record,period=period),period,partition,updated))
+		if len(loaded) == 0:
+			return loaded
+		with self.lock:
+			with self.connection:
+				self.connection.executemany("DELETE FROM outbreaks WHERE kind = ? AND partition = ?",[(kind,partition) for partition in loaded])
+				self.connection.executemany("INSERT INTO outbreaks (kind,orgUnit,disease,period,partition,event,epicode,status,closeDate,record,updated) VALUES (?,?,?,?,?,?,?,?,?,?,?)",rows)
+				self.connection.executemany("INSERT OR REPLACE INTO outbreakMirrors (kind,partition,hash,synced) VALUES (?,?,?,?)",hashes)
+		return loaded
+
+	# Get stored records with the keys of detections, records take their period key
+	# @param keys (orgUnit,disease,period) of the detections
+	# @return list of (id,record) in the stored order
+	def getMatches(self,kind,keys):
+		keys = set([(str(orgUnit),str(disease),str(period)) for orgUnit,disease,period in keys])
+		if len(keys) == 0:
+			return []
+		diseases = list(set([key[1] for key in keys]))
+		periods = list(set([key[2] for key in keys]))
+		orgUnits = list(set([key[0] for key in keys]))
+		query = "SELECT id,orgUnit,disease,period,record FROM outbreaks WHERE kind = ? AND orgUnit IN ({{}}) AND disease IN ({}) AND period IN ({})".format(self.getMarks(diseases),self.getMarks(periods))
+		rows = self.executeIn(query,orgUnits,before=[kind],after=diseases + periods)
+		matches = [(id,dict(json.loads(record),period=period)) for id,orgUnit,disease,period,record in rows if (orgUnit,disease,period) in keys]
+		return sorted(matches,key=lambda match: match[0])
+
+	# Get open outbreaks, those with an empty closeDate, in the stored order
+	# @return list of (disease,orgUnit,epicode)
+	def getOpen(self,kind):
+		return self.execute("SELECT disease,orgUnit,epicode FROM outbreaks WHERE kind = ? AND closeDate = '' ORDER BY id",(kind,))
+
+	# Get the distinct values of a column of all outbreaks of a kind e.g the UIDs in use
+	def getValues(self,kind,column):
+		if column not in self.VALUE_COLUMNS:
+			raise ValueError("Unknown outbreak column " + column)
+		return set([row[0] for row in self.execute("SELECT DISTINCT {} FROM outbreaks WHERE kind = ? AND {} IS NOT NULL".format(column,column),(kind,))])
+
+	# Get the period keys of stored records by id
+	def getStoredPeriods(self,ids):
+		return dict(self.executeIn("SELECT id,period FROM outbreaks WHERE id IN ({})",set(ids)))
+
+	# Update stored records and insert new ones
+	# Updated records keep the period key they were matched on
+	# @param changes list of (id,record), id is None for new records
+	# @param year epi-year of records without a first case date or period
+	def upsert(self,kind,changes,year):
+		if len(changes) == 0:
+			return
+		updated = time.time()
+		storedPeriods = self.getStoredPeriods([id for id,record in changes if id is not None])
+		periods = self.getPeriods([record for id,record in changes if id is None])
+		inserts = []
+		updates = []
+		for id,record in changes:
+			if id is None:
+				period = periods[len(inserts)]
+				record = dict(record,period=period)
+				inserts.append(self.getRow(kind,record,period,self.getPartition(record,year),updated))
+			elif id in storedPeriods:
+				period = storedPeriods[id]
+				record = dict(record,period=period)
+				updates.append(self.getRow(kind,record,period,self.getPartition(record,year),updated)[1:] + (id,))
+		with self.lock:
+			with self.connection:
+				self.connection.executemany("UPDATE outbreaks SET orgUnit = ?,disease = ?,period = ?,partition = ?,event = ?,epicode = ?,status = ?,closeDate = ?,record = ?,updated = ? WHERE id = ?",updates)
+				self.connection.executemany("INSERT INTO outbreaks (kind,orgUnit,disease,period,partition,event,epicode,status,closeDate,record,updated) VALUES (?,?,?,?,?,?,?,?,?,?,?)",inserts)
+
+	# Get stored records in the stored order, of some diseases or all
+	def getRecords(self,kind,diseases=None):
+		if diseases is None:
+			rows = self.execute("SELECT record FROM outbreaks WHERE kind = ? ORDER BY id",(kind,))
+		else:
+			diseases = [str(disease) for disease in diseases]
+			rows = self.execute("SELECT record FROM outbreaks WHERE kind = ? AND disease IN ({}) ORDER BY id".format(self.getMarks(diseases)),[kind] + diseases) if len(diseases) > 0 else []
+		# Records are decoded in one pass
+		return json.loads('[' + ','.join([row[0] for row in rows]) + ']')
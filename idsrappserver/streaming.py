@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+import re
+import json
+import codecs
+from array import array
+
+import numpy as np
+import pandas as pd
+
+# Streaming parser for DHIS2 table responses {headers,metaData,rows,height,width}
+# e.g analytics, analytics/events/query and trackedEntityInstances/query
+# Rows are decoded one at a time straight into column buffers so that the whole body
+# and the list of rows are never held in memory
+
+# Header types and value types parsed into float columns
+NUMERIC_TYPES = ['java.lang.Double','java.lang.Integer','java.lang.Long','java.lang.Float']
+NUMERIC_VALUE_TYPES = ['NUMBER','INTEGER','INTEGER_POSITIVE','INTEGER_NEGATIVE','INTEGER_ZERO_OR_POSITIVE','PERCENTAGE','UNIT_INTERVAL']
+WHITESPACE = re.compile(r'[ \t\n\r,]*')
+# Characters continuing a number after its integer or fraction part
+NUMBER_PARTS = '.eE'
+
+# Column buffer, float values in a compact array or objects in a list
+class ColumnBuffer:
+	def __init__(self,numeric=False):
+		self.numeric = numeric
+		self.values = array('d') if numeric else []
+
+	def append(self,value):
+		if self.numeric:
+			if value is None or value == '':
+				self.values.append(np.nan)
+				return
+			try:
+				self.values.append(float(value))
+				return
+			except (TypeError,ValueError):
+				# Not a number after all, keep the column as objects
+				self.numeric = False
+				self.values = self.values.tolist()
+		self.values.append(value)
+
+	def toArray(self):
+		if isinstance(self.values,np.ndarray):
+			return self.values
+		if self.numeric:
+			return np.frombuffer(self.values,dtype=np.float64)
+		return np.array(self.values,dtype=object)
+
+	def __len__(self):
+		return len(self.values)
+
+# Rows of a streamed table, read back from the column buffers
+class StreamedRows:
+	def __init__(self,table):
+		self.table = table
+
+	def __len__(self):
+		return self.table.getHeight()
+
+	def __iter__(self):
+		columns = self.table.columns
+		for position in range(len(self)):
+			yield [column.values[position] for column in columns]
+
+	def __getitem__(self,position):
+		return [column.values[position] for column in self.table.columns]
+
+# Table parsed from a stream, used like the decoded JSON body
+# e.g table['headers'], table['height'], len(table['rows'])
+class StreamedTable(dict):
+	def __init__(self):
+		dict.__init__(self)
+		self.columns = []
+		self['headers'] = []
+		self['rows'] = StreamedRows(self)
+
+	def isNumeric(self,header):
+		return header.get('type') in NUMERIC_TYPES or header.get('valueType') in NUMERIC_VALUE_TYPES
+
+	def setHeaders(self,headers):
+		self['headers'] = headers
+		self.columns = [ColumnBuffer(self.isNumeric(header)) for header in headers]
+
+	def appendRow(self,row):
+		if len(row) > len(self.columns):
+			# Rows wider than the headers, extra columns are kept as objects
+			for position in range(len(self.columns),len(row)):
+				column = ColumnBuffer()
+				column.values.extend([None]*self.getHeight())
+				self.columns.append(column)
+		for column,value in zip(self.columns,row):
+			column.append(value)
+		for column in self.columns[len(row):]:
+			column.append(None)
+
+	def getHeight(self):
+		return len(self.columns[0]) if len(self.columns) > 0 else 0
+
+	# Append the rows of another page of the same query
+	def extend(self,table):
+		if len(self.columns) == 0 and len(self['headers']) == 0:
+			self.setHeaders(table['headers'])
+		if not isinstance(table,StreamedTable) or len(table.columns) != len(self.columns):
+			for row in table['rows']:
+				self.appendRow(row)
+			return
+		for column,other in zip(self.columns,table.columns):
+			if column.numeric and other.numeric:
+				column.values.extend(other.values)
+				continue
+			if column.numeric:
+				column.numeric = False
+				column.values = column.values.tolist()
+			column.values.extend(other.values.tolist() if other.numeric else other.values)
+
+	# Create a DataFrame from the column buffers
+	# Each buffer is replaced by its array so the values are held once
+	def createDataFrame(self,columns):
+		arrays = {}
+		for position,column in enumerate(self.columns):
+			column.values = column.toArray()
+			arrays[position] = column.values
+		dataFrame = pd.DataFrame(arrays,index=pd.RangeIndex(self.getHeight()))
+		if len(columns) == len(dataFrame.columns):
+			dataFrame.columns = columns
+		return dataFrame
+
+# Incremental reader of JSON values from a stream of byte chunks
+class JsonStream:
+	def __init__(self,chunks):
+		self.chunks = iter(chunks)
+		self.decoder = json.JSONDecoder()
+		self.textDecoder = codecs.getincrementaldecoder('utf-8')()
+		self.buffer = ''
+		self.position = 0
+		self.ended = False
+
+	# Read more chunks until the unread text has at least doubled
+	def read(self):
+		if self.ended:
+			return False
+		if self.position > 0:
+			self.buffer = self.buffer[self.position:]
+			self.position = 0
+		wanted = max(2*len(self.buffer),65536)
+		parts = [self.buffer]
+		size = len(self.buffer)
+		while size < wanted:
+			try:
+				chunk = next(self.chunks)
+			except StopIteration:
+				parts.append(self.textDecoder.decode(b'',final=True))
+				self.ended = True
+				break
+			text = self.textDecoder.decode(chunk) if isinstance(chunk,bytes) else chunk
+			parts.append(text)
+			size = size + len(text)
+		self.buffer = ''.join(parts)
+		return True
+
+	# Skip whitespace and commas, return the next character
+	def peek(self):
+		while True:
+			self.position = WHITESPACE.match(self.buffer,self.position).end()
+			if self.position < len(self.buffer):
+				return self.buffer[self.position]
+			if not self.read():
+				return None
+
+	def expect(self,character):
+		if self.peek() != character:
+			raise ValueError("Expected '{}' at position {} of the response".format(character,self.position))
+		self.position = self.position + 1
+
+	def isCutNumber(self,value,end):
+		return isinstance(value,(int,float)) and not isinstance(value,bool) and self.buffer[end] in NUMBER_PARTS
+
+	# Decode the next complete JSON value
+	def value(self):
+		self.peek()
+		while True:
+			try:
+				value,end = self.decoder.raw_decode(self.buffer,self.position)
+				# A number at the end of the buffer may continue in the next chunk
+				# e.g 1.5 cut after 1. is decoded as 1 followed by an unread fraction
+				if self.ended or (end < len(self.buffer) and not self.isCutNumber(value,end)):
+					self.position = end
+					return value
+			except ValueError:
+				if self.ended:
+					raise
+			self.read()
+
+# Parse a table response from byte chunks e.g response.iter_content(65536)
+# Rows received before the headers are kept aside and moved to the buffers once headers arrive
+def parseTable(chunks):
+	stream = JsonStream(chunks)
+	table = StreamedTable()
+	pendingRows = []
+	stream.expect('{')
+	while stream.peek() != '}':
+		if stream.peek() is None:
+			raise ValueError("Unexpected end of the response")
+		key = stream.value()
+		stream.expect(':')
+		if key == 'rows' and stream.peek() == '[':
+			stream.expect('[')
+			while stream.peek() != ']':
+				if stream.peek() is None:
+					raise ValueError("Unexpected end of the response")
+				row = stream.value()
+				if len(table.columns) > 0 or len(table['headers']) > 0:
+					table.appendRow(row)
+				else:
+					pendingRows.append(row)
+			stream.expect(']')
+		elif key == 'headers':
+			table.setHeaders(stream.value())
+			for row in pendingRows:
+				table.appendRow(row)
+			pendingRows = []
+		else:
+			table[key] = stream.value()
+	for row in pendingRows:
+		table.appendRow(row)
+	table.setdefault('height',table.getHeight())
+	table.setdefault('width',len(table.columns))
+	return table
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+# Threshold engine for aggregate detection
+# Values are held in a dense (orgUnit x indicator x period) array
+# Indicator 0 is cases and indicator 1 is deaths as configured in programIndicators
+
+CASES = 0
+DEATHS = 1
+
+# Reshape the value columns of an analytics table into (orgUnit x indicator x period)
+# Columns must be ordered by indicator then period as requested with columns=dx;pe
+def createCube(values,indicators,periods):
+	values = np.asarray(values)
+	if values.ndim != 2 or values.shape[1] != indicators*periods:
+		raise ValueError("Expected {} indicators x {} periods of values, got {} columns".format(indicators,periods,values.shape[-1]))
+	return values.reshape(values.shape[0],indicators,periods)
+
+# Get positions of the current and baseline periods in the period list
+# NON_SEASONAL: current week followed by the m previous weeks
+# SEASONAL: current m weeks followed by the same m weeks of the n previous years
+def getWindows(algorithm,m,n):
+	if algorithm == 'SEASONAL':
+		return [np.arange(0,m),np.arange(m,m+(m*n))]
+	return [np.arange(0,1),np.arange(1,m+1)]
+
+# Compute current mean, baseline mean, standard deviation and 1.5/2 std thresholds
+# for all org units and indicators in one pass
+# @param cube array of (... x indicator x period), leading axes are kept
+# @return dict of (... x indicator) arrays
+def computeThresholds(cube,current,baseline):
+	with np.errstate(invalid='ignore',divide='ignore'):
+		if len(current) == 1:
+			# No need to do mean for a single current period
+			currentMean = cube[...,current[0]]
+		else:
+			currentMean = cube[...,current].mean(axis=-1)
+		baselineValues = cube[...,baseline]
+		mean = baselineValues.mean(axis=-1)
+		std = baselineValues.std(axis=-1,ddof=1)
+	return {
+		'current': currentMean,
+		'mean': mean,
+		'std': std,
+		'threshold15': mean + (1.5*std),
+		'threshold20': mean + (2*std)
+	}
+
+# Get the epidemic mask: current cases at or above the 2 std threshold
+def getEpidemicMask(thresholds,indicator=CASES):
+	current = thresholds['current'][:,indicator]
+	threshold = thresholds['threshold20'][:,indicator]
+	with np.errstate(invalid='ignore'):
+		return (current >= threshold) & (current != 0) & (threshold != 0)
@@ -10,4 +10,13 @@ setup(name='idsrappserver',
       author_email='atumwesigye@gmail.com',
       license='MIT',
       packages=['idsrappserver'],
+      python_requires='>=3.9',
+      install_requires=[
+          'pandas>=1.5,<2.0',
+          'numpy>=1.26,<2.0',
+          'requests>=2.31'
+      ],
+      entry_points={
+          'console_scripts': ['idsr=idsrappserver.cli:main']
+      },
       zip_safe=False)
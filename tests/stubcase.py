@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,ROOT)
+sys.path.insert(0,os.path.join(ROOT,'benchmarks'))
+
+from stubserver import StubDhis2, StubServer
+from idsrappserver.localstore import getStorePath
+
+DATASTORE = 'ugxzr_idsr_app'
+
+# Test case running the engine against the local stub DHIS2 server
+# Each test gets its own stub, temporary directory and settings file
+class StubTestCase(unittest.TestCase):
+	# Arguments of the StubDhis2 of each test
+	STUB = {'orgUnits': 100,'diseases': 1,'seed': 1}
+
+	def setUp(self):
+		self.stub = StubDhis2(**self.STUB)
+		self.server = StubServer(self.stub).start()
+		self.directory = tempfile.mkdtemp(prefix='idsr-test-')
+		self.localStore = os.path.join(self.directory,'idsr.sqlite')
+		self.configFile = os.path.join(self.directory,'idsr.json')
+		self.writeConfig()
+		self.workingDirectory = os.getcwd()
+		# The engine writes csv files in its working directory
+		os.chdir(self.directory)
+
+	def tearDown(self):
+		os.chdir(self.workingDirectory)
+		self.server.stop()
+		shutil.rmtree(self.directory,ignore_errors=True)
+
+	# Store file the engine opens for the localStore setting and the stub url
+	def getLocalStorePath(self):
+		return getStorePath(self.localStore,self.server.getUrl())
+
+	def writeConfig(self,**settings):
+		config = {'url': self.server.getUrl(),'username': 'admin','password': 'district','localStore': self.localStore,'baselineStore': False,'metrics': False,'notificationRateLimit': 0}
+		config.update(settings)
+		with open(self.configFile,'w') as outputFile:
+			json.dump(config,outputFile)
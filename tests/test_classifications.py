@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import unittest
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from idsrappserver import classifications
+
+class ClassificationsTest(unittest.TestCase):
+	# Unknown values are kept, missing values stay missing
+	def testNormalizeColumn(self):
+		column = pd.Series(['Confirmed','Probable',None,'Confirmed case',np.nan,'Suspected'],index=[5,4,3,2,1,0],name='caseClassification')
+		normalized = classifications.normalizeColumn(column,classifications.getLookup())
+		self.assertEqual(normalized.name,'caseClassification')
+		self.assertEqual(normalized.index.tolist(),[5,4,3,2,1,0])
+		self.assertEqual(normalized.astype(object).where(normalized.notna(),None).tolist(),['confirmedValue','Probable',None,'confirmedValue',None,'suspectedValue'])
+		# Values mapped to the same text share a category
+		self.assertEqual(sorted(normalized.cat.categories),['Probable','confirmedValue','suspectedValue'])
+		empty = classifications.normalizeColumn(pd.Series([None,None],dtype=object),classifications.getLookup())
+		self.assertTrue(empty.isna().all())
+
+	def testConfiguredValues(self):
+		df = pd.DataFrame({'caseClassification': ['Died','Confirmed'],'immediateOutcome': ['Died','died'],'ouname': ['Died','Confirmed']})
+		df = classifications.normalize(df,{'Died': 'deathValue','Confirmed': 'suspectedValue'})
+		self.assertEqual(df['caseClassification'].tolist(),['deathValue','suspectedValue'])
+		self.assertEqual(df['immediateOutcome'].tolist(),['deathValue','deathValue'])
+		self.assertEqual(df['ouname'].tolist(),['Died','Confirmed'])
+		self.assertEqual(classifications.getLookup()['Confirmed'],'confirmedValue')
+
+	# Unknown values get their own count column, missing values are not counted
+	def testCountValues(self):
+		df = pd.DataFrame({'orgUnit': ['OU1','OU1','OU1','OU2','OU2'],'caseClassification': ['Confirmed','Probable',None,'Suspected case',np.nan]})
+		df = classifications.normalize(df)
+		counts = classifications.countValues(df,['orgUnit'],'caseClassification').set_index('orgUnit')
+		self.assertEqual(sorted(counts.columns),['Probable','confirmedValue','suspectedValue'])
+		self.assertEqual(counts.loc['OU1'].to_dict(),{'confirmedValue': 1,'Probable': 1,'suspectedValue': 0})
+		self.assertEqual(counts.loc['OU2'].to_dict(),{'confirmedValue': 0,'Probable': 0,'suspectedValue': 1})
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+import os
+import re
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from idsrappserver import codes
+
+class CodesTest(unittest.TestCase):
+	def testUidFormat(self):
+		uids = codes.generateUids(5000,rng=np.random.default_rng(1))
+		self.assertEqual(len(uids),5000)
+		self.assertEqual(len(set(uids)),5000)
+		for uid in uids:
+			self.assertRegex(uid,'^[A-Za-z][A-Za-z0-9]{10}$')
+		self.assertEqual(codes.generateUids(3,rng=np.random.default_rng(7)).tolist(),codes.generateUids(3,rng=np.random.default_rng(7)).tolist())
+		self.assertEqual(len(codes.generateUids(0)),0)
+
+	# Draws colliding with each other or with existing UIDs are redrawn
+	def testUidCollisions(self):
+		# 2 letters x 4 characters give 8 UIDs
+		uids = codes.generateUids(8,alphabet='ab01',length=2,rng=np.random.default_rng(1))
+		self.assertEqual(sorted(uids),['a0','a1','aa','ab','b0','b1','ba','bb'])
+		uids = codes.generateUids(6,existing=['a0','b1'],alphabet='ab01',length=2,rng=np.random.default_rng(1))
+		self.assertEqual(sorted(uids),['a1','aa','ab','b0','ba','bb'])
+
+	def testCodeCollisions(self):
+		generated = codes.generateCodes(36,prefix='E',sep='_',size=1,rng=np.random.default_rng(1))
+		self.assertEqual(sorted(generated),sorted(['E_' + character for character in codes.CODE_ALPHABET]))
+		existing = ['E_OU1_' + character for character in codes.CODE_ALPHABET[1:]]
+		generated = codes.generateCodes(2,values=['OU1','OU2'],prefix='E',sep='_',existing=existing,size=1,rng=np.random.default_rng(1))
+		self.assertEqual(generated[0],'E_OU1_A')
+		self.assertTrue(re.match('^E_OU2_[A-Z0-9]$',generated[1]))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import copy
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from idsrappserver.datastore import PartitionedDatastore
+from idsrappserver.httpclient import Dhis2HttpError
+
+# Partitioned datastore over a dict of keys, counting the keys saved
+class PartitionedDatastoreTest(unittest.TestCase):
+	def setUp(self):
+		self.keys = {}
+		self.saved = []
+
+	def get(self,key):
+		if key not in self.keys:
+			raise Dhis2HttpError('Not found',status=404)
+		return copy.deepcopy(self.keys[key])
+
+	def save(self,key,data):
+		self.saved.append(key)
+		self.keys[key] = copy.deepcopy(data)
+
+	def getStore(self):
+		return PartitionedDatastore(self.get,self.save,'epidemics')
+
+	def getRecords(self):
+		return [
+			{'orgUnit': 'OU1','disease': 'Cholera','period': '2026W41','firstCaseDate': '2026-10-05','closeDate': '','event': 'EVENT000001'},
+			{'orgUnit': 'OU2','disease': 'Cholera','period': '2025W10','firstCaseDate': '2025-03-03','closeDate': '2025-04-01','event': 'EVENT000002'},
+			{'orgUnit': 'OU1','disease': 'Measles','period': '','firstCaseDate': '','closeDate': '','event': 'EVENT000003'},
+			{'orgUnit': 'OU3','period': '2026W41','event': 'EVENT000004'}
+		]
+
+	# Migrating the same records again writes the same keys with the same content
+	def testMigrateIsIdempotent(self):
+		written = sorted(self.getStore().migrate(self.getRecords(),2026))
+		self.assertEqual(written,['epidemics-Cholera-2025','epidemics-Cholera-2026','epidemics-Measles-2026'])
+		keys = copy.deepcopy(self.keys)
+		index = keys['epidemics-index']['partitions']
+		self.assertEqual([(entry['key'],entry['count'],entry['open']) for entry in index],[('epidemics-Cholera-2025',1,0),('epidemics-Cholera-2026',1,1),('epidemics-Measles-2026',1,1)])
+		self.assertEqual(sorted(self.getStore().migrate(self.getRecords(),2026)),written)
+		self.assertEqual(self.keys,keys)
+		# Records without a disease are not migrated
+		self.assertEqual(sum([len(self.keys[key]) for key in written]),3)
+
+	# Loaded partitions that did not change are not written back
+	def testUnchangedPartitionsAreNotSaved(self):
+		self.getStore().migrate(self.getRecords(),2026)
+		self.saved = []
+		store = self.getStore()
+		records = store.load(['Cholera','Measles'],[2026])
+		self.assertEqual(sorted(store.loaded),[('Cholera',2026),('Measles',2026)])
+		self.assertEqual(store.saveRecords(records,['Cholera','Measles'],2026),[])
+		self.assertEqual(self.saved,[])
+		records[0]['closeDate'] = '2026-10-12'
+		self.assertEqual(store.saveRecords(records,['Cholera','Measles'],2026),['epidemics-Cholera-2026'])
+		self.assertEqual(self.saved,['epidemics-Cholera-2026','epidemics-index'])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import contextlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,ROOT)
+sys.path.insert(0,os.path.join(ROOT,'benchmarks'))
+
+import fixtures
+from idsrappserver.idsrappserver import IdsrAppServer
+from idsrappserver.orgunits import OrgUnitIndex
+
+TODAY = '2026-10-14'
+DISEASE = {'disease': 'Cholera','code': 'D1','epiAlgorithm': 'CASE_BASED','detectionLevel': 6,'reportingLevel': 5,'incubationDays': 14,'alertThreshold': 2,'epiThreshold': 5}
+
+# Case based detection on program indicators
+class CaseBasedDetectionTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp(prefix='idsr-test-')
+		self.workingDirectory = os.getcwd()
+		# The engine writes csv files in its working directory
+		os.chdir(self.directory)
+
+	def tearDown(self):
+		os.chdir(self.workingDirectory)
+		shutil.rmtree(self.directory,ignore_errors=True)
+
+	# Detect on confirmed, deaths and suspected counts of each org unit
+	def detect(self,counts):
+		orgUnits = fixtures.createOrgUnits(len(counts),6)
+		caseEvents = fixtures.createProgramIndicatorTable(orgUnits,['CONFIRMED','DEATHS','SUSPECTED'])
+		for row,values in zip(caseEvents['rows'],counts):
+			row[-3:] = [str(value) for value in values]
+		dateData = fixtures.createTrackedEntityTable(orgUnits,DISEASE['disease'],TODAY)
+		with open(os.devnull,'w') as output,contextlib.redirect_stdout(output):
+			server = IdsrAppServer()
+			server.today = TODAY
+			detected = server.detectBasedOnProgramIndicators(caseEvents,DISEASE,OrgUnitIndex(orgUnits),'ANALYTICS',dateData)
+		return detected.set_index('orgUnit')
+
+	# Confirmed cases are counted as suspected, an alert is raised once they reach the alert threshold
+	def testConfirmedCasesAreSuspected(self):
+		detected = self.detect([(3,0,0),(0,0,2),(1,0,0),(2,1,4),(6,0,1)])
+		self.assertEqual(detected['suspectedValue'].astype(int).tolist(),[3,2,1,4,6])
+		self.assertEqual(detected['alert'].tolist(),['true','true','false','true','false'])
+		self.assertEqual(detected['epidemic'].tolist(),['false','false','false','false','true'])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from idsrappserver.eventimport import EventImporter
+from idsrappserver.httpclient import Dhis2HttpError, Dhis2ConnectionError
+
+class Response:
+	def __init__(self,body):
+		self.body = body
+
+	def json(self):
+		return self.body
+
+# ImportSummaries of a chunk, the events of rejected references are ignored with a conflict
+def getImportSummaries(events,rejected=()):
+	summaries = []
+	for event in events:
+		if event['event'] in rejected:
+			summaries.append({'status': 'ERROR','reference': event['event'],'importCount': {'imported': 0,'ignored': 1},'conflicts': [{'object': 'orgUnit','value': 'Org unit not in program'}]})
+		else:
+			summaries.append({'status': 'SUCCESS','reference': event['event'],'importCount': {'imported': 1,'ignored': 0},'conflicts': []})
+	ignored = len([event for event in events if event['event'] in rejected])
+	return {'httpStatus': 'Conflict','response': {'status': 'WARNING' if ignored > 0 else 'SUCCESS','imported': len(events) - ignored,'updated': 0,'ignored': ignored,'deleted': 0,'importSummaries': summaries}}
+
+class EventImportTest(unittest.TestCase):
+	def setUp(self):
+		self.events = [{'event': 'EVENT{:06d}'.format(position)} for position in range(5)]
+		self.posted = []
+
+	# Chunks with some rejected events are imported, without the rejected events
+	def testPartialConflicts(self):
+		def post(data):
+			self.posted.append([event['event'] for event in data['events']])
+			body = getImportSummaries(data['events'],rejected=['EVENT000001','EVENT000003'])
+			raise Dhis2HttpError('POST events returned 409',status=409,response=Response(body))
+		importer = EventImporter(post,chunkSize=2,workers=1)
+		summaries = importer.importEvents(self.events)
+		self.assertEqual(len(self.posted),3)
+		self.assertEqual([summary['failed'] for summary in summaries],[False,False,False])
+		self.assertEqual([summary['status'] for summary in summaries],['WARNING','WARNING','SUCCESS'])
+		self.assertEqual(summaries[0]['rejected'],['EVENT000001'])
+		self.assertEqual(summaries[1]['conflicts'],[{'reference': 'EVENT000003','object': 'orgUnit','value': 'Org unit not in program'}])
+		self.assertEqual([event['event'] for event in importer.getImportedEvents(self.events,summaries)],['EVENT000000','EVENT000002','EVENT000004'])
+
+	# Only the failed chunk is posted again, after a backoff
+	@mock.patch('idsrappserver.eventimport.time.sleep')
+	def testFailedChunkIsRetried(self,sleep):
+		failures = ['EVENT000002']
+		def post(data):
+			uids = [event['event'] for event in data['events']]
+			self.posted.append(uids)
+			if uids[0] in failures:
+				failures.remove(uids[0])
+				raise Dhis2ConnectionError('POST events timed out')
+			return Response(getImportSummaries(data['events']))
+		importer = EventImporter(post,chunkSize=2,workers=2,retries=2)
+		summaries = importer.importEvents(self.events)
+		self.assertEqual(sorted(self.posted),[['EVENT000000','EVENT000001'],['EVENT000002','EVENT000003'],['EVENT000002','EVENT000003'],['EVENT000004']])
+		self.assertEqual(sleep.call_args_list,[mock.call(1)])
+		self.assertEqual([summary['attempt'] for summary in summaries],[1,2,1])
+		self.assertEqual([summary['failed'] for summary in summaries],[False,False,False])
+		self.assertEqual(len(importer.getImportedEvents(self.events,summaries)),5)
+
+	# Chunks failing after all retries are left out of the imported events
+	@mock.patch('idsrappserver.eventimport.time.sleep')
+	def testChunkFailingAllRetries(self,sleep):
+		def post(data):
+			self.posted.append(data['events'])
+			if data['events'][0]['event'] == 'EVENT000000':
+				raise Dhis2HttpError('POST events returned 500',status=500)
+			return Response(getImportSummaries(data['events']))
+		importer = EventImporter(post,chunkSize=2,workers=1,retries=2)
+		summaries = importer.importEvents(self.events)
+		self.assertEqual(len(self.posted),5)
+		self.assertEqual(sleep.call_args_list,[mock.call(1),mock.call(2)])
+		self.assertEqual(summaries[0]['attempt'],3)
+		self.assertTrue(summaries[0]['failed'])
+		self.assertEqual(summaries[0]['error'],'POST events returned 500')
+		self.assertEqual([event['event'] for event in importer.getImportedEvents(self.events,summaries)],['EVENT000002','EVENT000003','EVENT000004'])
+
+if __name__ == "__main__":
+	unittest.main()
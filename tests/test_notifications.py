@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import contextlib
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from idsrappserver.notifications import NotificationOutbox, NotificationDispatcher
+
+MESSAGE = {'disease': 'Cholera','orgUnit': 'OU000000001','period': '2026W41','subject': 'Alert','text': 'Alert'}
+
+class NotificationDispatcherTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp(prefix='idsr-test-')
+		self.outbox = NotificationOutbox(os.path.join(self.directory,'idsr.sqlite'))
+		self.sent = []
+
+	def tearDown(self):
+		shutil.rmtree(self.directory,ignore_errors=True)
+
+	# The first send fails with an error that is not a Dhis2Error, the worker keeps going
+	def send(self,payload):
+		if len(self.sent) == 0:
+			self.sent.append(None)
+			raise RuntimeError('database is locked')
+		self.sent.append(payload)
+
+	def testWorkerSurvivesErrors(self):
+		dispatcher = NotificationDispatcher(self.outbox,self.send,rateLimit=0,interval=0.05)
+		with open(os.devnull,'w') as output,contextlib.redirect_stdout(output):
+			self.outbox.enqueue([MESSAGE])
+			dispatcher.start()
+			dispatcher.stop(timeout=10)
+			self.assertEqual(self.outbox.countPending(),0)
+			self.assertEqual(len(self.sent),2)
+			dispatcher.close()
+		self.assertFalse(dispatcher.thread.is_alive())
+
+if __name__ == "__main__":
+	unittest.main()
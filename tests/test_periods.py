@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import datetime
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from idsrappserver import periods
+
+class PeriodsTest(unittest.TestCase):
+	# Days before the first Monday of a year are week 00, years starting on a Monday have a week 53
+	def testWeeks(self):
+		self.assertEqual(periods.formatWeek('2026-10-14'),'2026W41')
+		self.assertEqual(periods.formatWeek('2026-01-04T08:00:00.000'),'2026W00')
+		self.assertEqual(periods.formatWeek('2026-01-05'),'2026W01')
+		self.assertEqual(periods.formatWeek(datetime.datetime(2024,12,31)),'2024W53')
+		self.assertEqual(periods.formatWeek('2025-12-31'),'2025W52')
+
+	# Period lists across the year boundary
+	def testPeriodsAcrossYears(self):
+		self.assertEqual(periods.getPeriods('2025-01-01',3,0,'NON_SEASONAL'),('2025W00','2024W52','2024W51','2024W50'))
+		self.assertEqual(periods.getPeriods('2025-01-07',2,0,'NON_SEASONAL'),('2025W01','2024W53','2024W52'))
+		self.assertEqual(periods.getPeriods('2026-01-04',2,1,'SEASONAL'),('2026W00','2025W51','2025W00','2024W52'))
+		self.assertEqual(periods.getPeriods('2026-10-14',4,5,'CASE_BASED'),('LAST_7_DAYS',))
+
+	# Week 1 starts on the Monday of the week of January 4
+	def testStartEndDates(self):
+		self.assertEqual(periods.getStartEndDates(2026,1),[datetime.datetime(2025,12,29),datetime.datetime(2026,1,4)])
+		self.assertEqual(periods.getStartEndDates('2026','00'),[datetime.datetime(2025,12,22),datetime.datetime(2025,12,28)])
+		self.assertEqual(periods.getStartEndDates(2024,53),[datetime.datetime(2024,12,30),datetime.datetime(2025,1,5)])
+		self.assertEqual(periods.getStartEndDates(2026,54),[datetime.datetime(2027,1,4),datetime.datetime(2027,1,10)])
+
+	def testDates(self):
+		self.assertEqual(periods.formatDate('2026-10-10T08:00:00.000'),'2026-10-10')
+		self.assertEqual(periods.formatDate('10/12/2026'),'2026-10-12')
+		self.assertEqual(periods.formatDates(['2026-10-10 00:00:00.0',datetime.datetime(2026,10,11),'']).tolist(),['2026-10-10','2026-10-11',''])
+		self.assertEqual(periods.subtractMonths(datetime.datetime(2024,2,29),12),datetime.datetime(2023,2,28))
+		self.assertEqual(periods.addDays('2026-12-30',3),'2027-01-02')
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+import os
+import sqlite3
+import unittest
+import contextlib
+
+from stubcase import StubTestCase, DATASTORE
+from idsrappserver.idsrappserver import IdsrAppServer
+
+# Detection run again on the same data against the local stub DHIS2 server
+class RerunTest(StubTestCase):
+	STUB = {'orgUnits': 200,'diseases': 2,'caseBased': 1,'seed': 1}
+
+	def runDetection(self,diseases=None):
+		with open(os.devnull,'w') as output,contextlib.redirect_stdout(output):
+			IdsrAppServer(configFile=self.configFile).startEpidemics(diseases)
+
+	# Ids of the stored outbreaks by disease
+	def getStoredIds(self,kind):
+		connection = sqlite3.connect(self.getLocalStorePath())
+		try:
+			rows = connection.execute("SELECT disease,id FROM outbreaks WHERE kind = ? ORDER BY id",(kind,)).fetchall()
+		finally:
+			connection.close()
+		ids = {}
+		for disease,id in rows:
+			ids.setdefault(disease,[]).append(id)
+		return ids
+
+	# Stored outbreaks by kind, without a period key and in the datastore
+	def getSizes(self):
+		connection = sqlite3.connect(self.getLocalStorePath())
+		try:
+			stored = dict(connection.execute("SELECT kind,COUNT(*) FROM outbreaks GROUP BY kind").fetchall())
+			unkeyed = connection.execute("SELECT COUNT(*) FROM outbreaks WHERE period = ''").fetchone()[0]
+		finally:
+			connection.close()
+		mirrored = {kind: len(self.stub.dataStore.get(DATASTORE + '/' + kind,[])) for kind in ['epidemics','alerts']}
+		return {'stored': stored,'unkeyed': unkeyed,'mirrored': mirrored}
+
+	def testRerunKeepsStoreAndMirrorSizes(self):
+		self.runDetection()
+		sizes = self.getSizes()
+		self.assertGreater(sizes['stored'].get('epidemics',0),0)
+		self.assertGreater(sizes['stored'].get('alerts',0),0)
+		self.assertEqual(sizes['unkeyed'],0)
+		for run in range(2):
+			self.runDetection()
+			self.assertEqual(self.getSizes(),sizes)
+
+	def testRerunPostsNoEvents(self):
+		self.runDetection()
+		self.assertGreater(self.stub.events,0)
+		for run in range(2):
+			posted = self.stub.events
+			self.runDetection()
+			self.assertEqual(self.stub.events,posted)
+
+	# Case based diseases detected on the case events, classifications mapped by classifications.normalize
+	def testEventBasedDetection(self):
+		self.writeConfig(caseBasedDetection='events')
+		self.runDetection()
+		records = self.stub.dataStore[DATASTORE + '/epidemics']
+		caseBased = [record for record in records if record['disease'] == 'Case disease 0']
+		self.assertGreater(len(caseBased),0)
+		self.assertTrue(all(record['period'] for record in caseBased))
+		self.assertGreater(sum(record['confirmedValue'] for record in caseBased),0)
+		sizes = self.getSizes()
+		posted = self.stub.events
+		self.runDetection()
+		self.assertEqual(self.getSizes(),sizes)
+		self.assertEqual(self.stub.events,posted)
+
+	# Runs of one disease at a time, as under the daemon, keep the stored partitions of the other diseases
+	def testPartitionedRunsByDisease(self):
+		self.writeConfig(datastoreLayout='partitioned')
+		diseases = [diseaseMeta['disease'] for diseaseMeta in self.stub.diseasesMeta['diseases']][:2]
+		self.runDetection([diseases[0]])
+		first = self.getStoredIds('epidemics')
+		self.assertEqual(list(first),[diseases[0]])
+		self.runDetection([diseases[1]])
+		stored = self.getStoredIds('epidemics')
+		self.assertEqual(sorted(stored),sorted(diseases))
+		self.assertEqual(stored[diseases[0]],first[diseases[0]])
+		self.runDetection([diseases[0]])
+		self.assertEqual(self.getStoredIds('epidemics'),stored)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+import os
+import unittest
+import contextlib
+
+from stubcase import StubTestCase, DATASTORE
+from idsrappserver.idsrappserver import IdsrAppServer
+from idsrappserver.scheduler import DiseaseScheduler
+
+# Scheduled runs of the daemon against the local stub DHIS2 server
+class SchedulerTest(StubTestCase):
+	STUB = {'orgUnits': 100,'diseases': 2,'seed': 1}
+
+	# Run the scheduler once with every disease due
+	def runTick(self,scheduler):
+		scheduler.nextRuns = {}
+		with open(os.devnull,'w') as output,contextlib.redirect_stdout(output):
+			return scheduler.runDue()
+
+	def testCachesStayWarmBetweenRuns(self):
+		engine = IdsrAppServer(configFile=self.configFile)
+		engine.loadSettings()
+		scheduler = DiseaseScheduler(engine)
+		self.assertEqual(len(self.runTick(scheduler)),2)
+		dispatcher = engine.notificationDispatcher
+		orgUnitIndexes = dict(engine.orgUnitIndexes)
+		self.assertGreater(len(orgUnitIndexes),0)
+		self.assertEqual(len(self.runTick(scheduler)),2)
+		self.assertIs(engine.notificationDispatcher,dispatcher)
+		self.assertEqual(engine.orgUnitIndexes,orgUnitIndexes)
+		# Changed settings are loaded on the next run
+		self.writeConfig(workers=2)
+		self.runTick(scheduler)
+		self.assertEqual(engine.workers,2)
+		self.assertIsNot(engine.notificationDispatcher,dispatcher)
+		self.assertFalse(dispatcher.thread.is_alive())
+
+	# Analytics of the first disease answer 409 while failing[0] is set
+	def failAnalytics(self,failing):
+		indicators = [indicator['id'] for indicator in self.stub.diseasesMeta['diseases'][0]['programIndicators']]
+		handle = self.stub.handle
+		def failingHandle(method,path,params,body):
+			dimensions = ';'.join(params.get('dimension',[]))
+			if failing[0] and path.rstrip('/').endswith('/analytics.json') and any(indicator in dimensions for indicator in indicators):
+				return 409,{'httpStatusCode': 409,'status': 'ERROR','message': 'Analytics table missing'}
+			return handle(method,path,params,body)
+		self.stub.handle = failingHandle
+
+	# A disease whose analytics fail is run again on the next tick, the other one waits for its cadence
+	def testFailedDiseaseIsRetried(self):
+		failing = [True]
+		self.failAnalytics(failing)
+		engine = IdsrAppServer(configFile=self.configFile)
+		engine.loadSettings()
+		scheduler = DiseaseScheduler(engine,retry=0)
+		failed,completed = [diseaseMeta['disease'] for diseaseMeta in self.stub.diseasesMeta['diseases']]
+		with open(os.devnull,'w') as output,contextlib.redirect_stdout(output):
+			self.assertEqual(scheduler.runDue(),[failed,completed])
+			status = scheduler.getStatus()
+			self.assertIn('409',status['diseases'][failed]['error'])
+			self.assertEqual(status['diseases'][failed]['failures'],1)
+			self.assertIsNone(status['diseases'][completed]['error'])
+			self.assertIn(failed,status['lastError']['error'])
+			self.assertGreater(scheduler.nextRuns[completed],status['lastRun']['finished'] + 3600)
+			# Still failing, only the failed disease is due
+			self.assertEqual(scheduler.runDue(),[failed])
+			self.assertEqual(scheduler.getStatus()['diseases'][failed]['failures'],2)
+			failing[0] = False
+			self.assertEqual(scheduler.runDue(),[failed])
+			status = scheduler.getStatus()
+			self.assertIsNone(status['diseases'][failed]['error'])
+			self.assertEqual(status['diseases'][failed]['failures'],0)
+			self.assertEqual(scheduler.runDue(),[])
+		self.assertGreater(len(self.stub.dataStore[DATASTORE + '/epidemics']),0)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+import os
+import unittest
+import argparse
+
+from stubcase import StubTestCase
+from idsrappserver import cli
+from idsrappserver.idsrappserver import IdsrAppServer
+
+# Settings read from a settings file outside the project folder
+class SettingsTest(StubTestCase):
+	def testPathsAreRelativeToTheSettingsFile(self):
+		self.writeConfig(localStore='store.sqlite',cassette='week41.jsonl.gz')
+		engine = IdsrAppServer(configFile=self.configFile)
+		engine.loadSettings()
+		self.assertEqual(os.path.dirname(engine.getLocalStorePath()),self.directory)
+		self.assertEqual(engine.getSettingsPath(engine.cassette),os.path.join(self.directory,'week41.jsonl.gz'))
+		self.assertEqual(engine.getSettingsPath('/var/lib/idsr'),'/var/lib/idsr')
+		args = argparse.Namespace(config=self.configFile)
+		self.assertEqual(cli.getLocalStore(args,cli.getConfig(args)),engine.getLocalStorePath())
+
+	# Stores of two DHIS2 instances sharing the localStore setting are kept apart
+	def testLocalStoreOfEachInstance(self):
+		engine = IdsrAppServer(configFile=self.configFile)
+		engine.loadSettings()
+		self.assertEqual(engine.getLocalStorePath(),self.getLocalStorePath())
+		self.writeConfig(url='https://play.dhis2.org/demo/api/')
+		engine.loadSettings()
+		self.assertNotEqual(engine.getLocalStorePath(),self.getLocalStorePath())
+		self.assertTrue(engine.getLocalStorePath().endswith('.sqlite'))
+
+	# Stores are opened again when the store file or the cache TTLs change
+	def testStoresFollowTheSettings(self):
+		engine = IdsrAppServer(configFile=self.configFile)
+		engine.loadSettings()
+		cache = engine.getMetadataCache()
+		stateStore = engine.getStateStore()
+		engine.loadSettings()
+		self.assertIs(engine.getMetadataCache(),cache)
+		self.assertIs(engine.getStateStore(),stateStore)
+		self.writeConfig(cacheTtls={'diseases': 10})
+		engine.loadSettings()
+		self.assertIsNot(engine.getMetadataCache(),cache)
+		self.assertEqual(engine.getMetadataCache().ttls['diseases'],10)
+		self.assertIsNot(engine.getStateStore(),stateStore)
+		stateStore = engine.getStateStore()
+		self.writeConfig(url='https://play.dhis2.org/demo/api/')
+		engine.loadSettings()
+		self.assertNotEqual(engine.getStateStore().path,stateStore.path)
+		self.assertEqual(engine.getNotificationDispatcher().outbox.path,engine.getStateStore().path)
+		engine.notificationDispatcher.close()
+		engine.closeStores()
+
+if __name__ == "__main__":
+	unittest.main()
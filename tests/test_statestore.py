@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from idsrappserver.statestore import StateStore
+from idsrappserver import periods
+
+class StateStoreTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp(prefix='idsr-test-')
+		self.store = StateStore(os.path.join(self.directory,'idsr.sqlite'))
+
+	def tearDown(self):
+		self.store.close()
+		shutil.rmtree(self.directory,ignore_errors=True)
+
+	# Records without a period are keyed on the week of their first case date, named as detections name it
+	def testPeriodOfRecordsWithoutOne(self):
+		records = [{'firstCaseDate': date} for date in ['2026-01-01','2026-01-05','2027-01-03','2020-12-31']] + [{'period': '2026W41','firstCaseDate': '2026-01-01'},{'firstCaseDate': ''}]
+		self.assertEqual(self.store.getPeriods(records),['2026W00','2026W01','2027W00','2020W52','2026W41',''])
+		self.assertEqual(self.store.getPeriods(records[:4]),[periods.formatWeek(record['firstCaseDate']) for record in records[:4]])
+		# Stored records without a period are matched by detections of that week
+		self.store.sync('epidemics',[{'orgUnit': 'OU1','disease': 'Cholera','firstCaseDate': '2026-01-01','event': 'EVENT000001'}],2026)
+		matches = self.store.getMatches('epidemics',[('OU1','Cholera','2026W00')])
+		self.assertEqual([record['event'] for id,record in matches],['EVENT000001'])
+
+	def getIds(self,disease):
+		return [id for id,record in self.store.getMatches('epidemics',[('OU1',disease,'2026W41')])]
+
+	# Only partitions changed in the datastore are loaded again
+	def testSyncByPartition(self):
+		records = [{'orgUnit': 'OU1','disease': disease,'period': '2026W41','firstCaseDate': '2026-10-05','confirmedValue': 1} for disease in ['Cholera','Measles']]
+		self.assertEqual(self.store.sync('epidemics',records,2026),['Cholera/2026','Measles/2026'])
+		cholera = self.getIds('Cholera')
+		measles = self.getIds('Measles')
+		self.assertEqual(self.store.sync('epidemics',records,2026),[])
+		# Partitions read from a partitioned datastore, only Measles changed
+		changed = dict(records[1],confirmedValue=2)
+		self.assertEqual(self.store.sync('epidemics',[changed],2026,[('Measles',2026)]),['Measles/2026'])
+		self.assertEqual(self.getIds('Cholera'),cholera)
+		self.assertNotEqual(self.getIds('Measles'),measles)
+		self.assertGreater(self.getIds('Measles')[0],cholera[0])
+		# Records written by the engine are not loaded again
+		self.store.setMirrorHashes('epidemics',self.store.getRecords('epidemics'),2026)
+		self.assertEqual(self.store.sync('epidemics',self.store.getRecords('epidemics'),2026),[])
+		# A single key holds all records, partitions missing from it are removed
+		self.assertEqual(self.store.sync('epidemics',[records[0]],2026),['Measles/2026'])
+		self.assertEqual(self.getIds('Measles'),[])
+		self.assertEqual(self.getIds('Cholera'),cholera)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import unittest
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,ROOT)
+sys.path.insert(0,os.path.join(ROOT,'benchmarks'))
+
+import fixtures
+from idsrappserver.streaming import JsonStream, parseTable
+
+# Split a body in chunks of a size
+def getChunks(body,size):
+	return [body[start:(start+size)] for start in range(0,len(body),size)]
+
+class StreamingTest(unittest.TestCase):
+	HEADERS = [{'name': 'text','type': 'java.lang.String'},{'name': 'value','type': 'java.lang.String'}]
+	# Values with escapes, \u sequences, surrogate pairs and numbers in all their forms
+	VALUES = ['quote " backslash \\ slash /','tab\tnew line\ncarriage return\r','café 中文 \U0001f9a0','\u0000\u001f',-1.5e-07,1234567890,0.25,-0.0,2E+10,True,False,None,'']
+
+	def getRows(self,count):
+		return [[self.VALUES[position % len(self.VALUES)],self.VALUES[(3*position) % len(self.VALUES)]] for position in range(count)]
+
+	def getBody(self,rows,padding,ensureAscii):
+		return json.dumps({'metaData': {'padding': 'x'*padding},'headers': self.HEADERS,'rows': rows},ensure_ascii=ensureAscii).encode('utf-8')
+
+	# Tokens cut at the end of a chunk or of the read buffer are read whole
+	def testTokensSplitAcrossChunks(self):
+		rows = self.getRows(4000)
+		for ensureAscii in [True,False]:
+			# Shift the rows so that each position of a row falls on the end of the read buffer
+			for padding in range(0,len(json.dumps(rows[:len(self.VALUES)],ensure_ascii=ensureAscii)),3):
+				table = parseTable(getChunks(self.getBody(rows,padding,ensureAscii),4096))
+				self.assertEqual(list(table['rows']),rows)
+			for size in [1,7]:
+				table = parseTable(getChunks(self.getBody(rows,5,ensureAscii),size))
+				self.assertEqual(list(table['rows']),rows)
+
+	# Numbers whose fraction or exponent is in the next chunk are not cut short
+	def testNumbersSplitAcrossChunks(self):
+		for text in ['1.5','-12.25e-3','7e+2','10E5','-0.5']:
+			for cut in range(1,len(text)):
+				# The first read stops after the first chunk of 65536 bytes
+				body = ('[' + ' '*(65535-cut) + text + ']').encode('utf-8')
+				stream = JsonStream(getChunks(body,65536))
+				stream.expect('[')
+				self.assertEqual(stream.value(),json.loads(text))
+				stream.expect(']')
+
+	# Rows before the headers are kept until the headers are read, nested keys are plain values
+	def testRowsBeforeHeaders(self):
+		body = json.dumps({'rows': [['a','1'],['b','']],'metaData': {'rows': [['c']],'headers': {'rows': []}},'headers': [{'name': 'name','type': 'java.lang.String'},{'name': 'value','type': 'java.lang.Double'}],'height': 2})
+		table = parseTable(getChunks(body.encode('utf-8'),3))
+		self.assertEqual([header['name'] for header in table['headers']],['name','value'])
+		self.assertEqual(table['metaData'],{'rows': [['c']],'headers': {'rows': []}})
+		self.assertEqual(table['height'],2)
+		self.assertEqual(table['width'],2)
+		dataFrame = table.createDataFrame(['name','value'])
+		self.assertEqual(dataFrame['name'].tolist(),['a','b'])
+		self.assertEqual(dataFrame['value'].iloc[0],1.0)
+		self.assertTrue(pd.isna(dataFrame['value'].iloc[1]))
+
+	# Empty rows and responses without rows
+	def testEmptyRows(self):
+		headers = [{'name': 'name','type': 'java.lang.String'},{'name': 'value','type': 'java.lang.Double'}]
+		table = parseTable([json.dumps({'headers': headers,'rows': []}).encode('utf-8')])
+		self.assertEqual(table['height'],0)
+		self.assertEqual(table['width'],2)
+		self.assertEqual(list(table.createDataFrame(['name','value']).columns),['name','value'])
+		table = parseTable([json.dumps({'headers': headers,'rows': [[],['a','2']]}).encode('utf-8')])
+		self.assertEqual(table['height'],2)
+		self.assertEqual(table['rows'][0][0],None)
+		self.assertTrue(pd.isna(table['rows'][0][1]))
+		table = parseTable([b'{"headers": [], "height": 0}'])
+		self.assertEqual(len(table['rows']),0)
+		self.assertRaises(ValueError,parseTable,[b'{"headers": [], "rows": [["a"]'])
+
+	def assertParsedAsJson(self,data,sizes):
+		body = json.dumps(data).encode('utf-8')
+		names = [header['name'] for header in data['headers']]
+		expected = pd.DataFrame(json.loads(body)['rows'],columns=names)
+		for header in data['headers']:
+			if header['type'] == 'java.lang.Double':
+				expected[header['name']] = pd.to_numeric(expected[header['name']]).astype(float)
+		for size in sizes:
+			table = parseTable(getChunks(body,size))
+			pd.testing.assert_frame_equal(table.createDataFrame(names),expected)
+			self.assertEqual(table['height'],len(data['rows']))
+
+	# Benchmark payloads parse to the same table as the decoded JSON body
+	def testFixturesMatchJsonLoads(self):
+		orgUnits = fixtures.createOrgUnits(500,6)
+		self.assertParsedAsJson(fixtures.createAnalyticsTable(orgUnits,['IND00000001','IND00000002'],['2026W{:02d}'.format(week) for week in range(30,42)],level=6),[7,65536])
+		self.assertParsedAsJson(fixtures.createProgramIndicatorTable(orgUnits,['PICASES0001','PIDEATH0001','PISUSP00001']),[1,4096])
+		self.assertParsedAsJson(fixtures.createTrackedEntityTable(orgUnits,'Cholera','2026-10-12'),[7,65536])
+		self.assertParsedAsJson(fixtures.createEventQueryTable(orgUnits,'Cholera','2026-10-12'),[7,65536])
+
+if __name__ == "__main__":
+	unittest.main()
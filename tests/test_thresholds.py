@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import unittest
+import warnings
+
+import numpy as np
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from idsrappserver import thresholds
+
+class ThresholdsTest(unittest.TestCase):
+	def testWindows(self):
+		current,baseline = thresholds.getWindows('NON_SEASONAL',4,2)
+		self.assertEqual(current.tolist(),[0])
+		self.assertEqual(baseline.tolist(),[1,2,3,4])
+		current,baseline = thresholds.getWindows('SEASONAL',3,2)
+		self.assertEqual(current.tolist(),[0,1,2])
+		self.assertEqual(baseline.tolist(),[3,4,5,6,7,8])
+
+	def testCube(self):
+		cube = thresholds.createCube([[1,2,3,4,5,6]],2,3)
+		self.assertEqual(cube[0,1].tolist(),[4,5,6])
+		self.assertRaises(ValueError,thresholds.createCube,[[1,2,3,4,5]],2,3)
+
+	# Thresholds use the sample standard deviation of the baseline
+	def testSampleStandardDeviation(self):
+		cube = np.array([[[9,1,2,3,4],[0,0,0,0,0]]],dtype=float)
+		current,baseline = thresholds.getWindows('NON_SEASONAL',4,0)
+		values = thresholds.computeThresholds(cube,current,baseline)
+		std = np.sqrt(5.0/3)
+		self.assertEqual(values['current'][0].tolist(),[9,0])
+		self.assertAlmostEqual(values['mean'][0,0],2.5)
+		self.assertAlmostEqual(values['std'][0,0],std)
+		self.assertAlmostEqual(values['threshold15'][0,0],2.5 + 1.5*std)
+		self.assertAlmostEqual(values['threshold20'][0,0],2.5 + 2*std)
+		self.assertEqual(thresholds.getEpidemicMask(values).tolist(),[True])
+		# SEASONAL current values are the mean of the current weeks
+		current,baseline = thresholds.getWindows('SEASONAL',2,1)
+		values = thresholds.computeThresholds(cube[...,:4],current,baseline)
+		self.assertEqual(values['current'][0,0],5)
+		self.assertAlmostEqual(values['std'][0,0],np.std([2,3],ddof=1))
+
+	# Missing values, zero thresholds and a single baseline period detect nothing
+	def testMissingValues(self):
+		cube = np.array([
+			[[9,1,np.nan,3,4]],
+			[[np.nan,1,2,3,4]],
+			[[0,0,0,0,0]],
+			[[5,0,0,0,0]],
+			[[1,0,0,0,0]]
+		])
+		current,baseline = thresholds.getWindows('NON_SEASONAL',4,0)
+		with warnings.catch_warnings():
+			warnings.simplefilter('error')
+			values = thresholds.computeThresholds(cube,current,baseline)
+			mask = thresholds.getEpidemicMask(values)
+			self.assertTrue(np.isnan(values['mean'][0,0]))
+			self.assertEqual(mask.tolist(),[False,False,False,False,False])
+		# numpy warns of the degrees of freedom of a single baseline period
+		with warnings.catch_warnings():
+			warnings.simplefilter('ignore')
+			values = thresholds.computeThresholds(cube[:,:,:2],current,np.arange(1,2))
+		self.assertTrue(np.isnan(values['std']).all())
+		self.assertEqual(thresholds.getEpidemicMask(values).tolist(),[False,False,False,False,False])
+
+if __name__ == "__main__":
+	unittest.main()